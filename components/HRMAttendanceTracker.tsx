@@ -1,5 +1,5 @@
 
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { Employee, Attendance, Xarun, Branch } from '../types';
 import { API } from '../services/api';
 
@@ -31,6 +31,8 @@ const HRMAttendanceTracker: React.FC<HRMAttendanceTrackerProps> = ({
   const [showLogsModal, setShowLogsModal] = useState(false);
   const [serviceLogs, setServiceLogs] = useState<string[]>([]);
   const [logsLoading, setLogsLoading] = useState(false);
+  const logsCursor = useRef<number | null>(null); // /logs cursor: only lines newer than this are fetched
+  const logsEpoch = useRef<string | null>(null); // service process the cursor belongs to
 
   // Edit Modal State
   const [editingRecord, setEditingRecord] = useState<{empId: string, record: Attendance | null} | null>(null);
@@ -75,11 +77,24 @@ const HRMAttendanceTracker: React.FC<HRMAttendanceTrackerProps> = ({
     if (!hardwareUrl) return;
     setLogsLoading(true);
     try {
-        const res = await fetch(`${hardwareUrl}/logs`);
-        const data = await res.json();
-        setServiceLogs(data.logs || []);
+        const after = logsCursor.current;
+        let res = await fetch(`${hardwareUrl}/logs` + (after !== null ? `?after=${after}&limit=500` : ''));
+        let data = await res.json();
+        let fresh = after === null || data.cursor === undefined;
+        if (!fresh && (data.epoch !== logsEpoch.current || data.cursor < after || data.truncated)) {
+            // Service restarted, or more than one page was missed -> start over
+            res = await fetch(`${hardwareUrl}/logs`);
+            data = await res.json();
+            fresh = true;
+        }
+        const lines: string[] = data.logs || [];
+        setServiceLogs(prev => fresh ? lines : [...lines, ...prev].slice(0, 500));
+        logsCursor.current = data.cursor ?? null;
+        logsEpoch.current = data.epoch ?? null;
     } catch (e) {
         console.error(e);
+        logsCursor.current = null;
+        logsEpoch.current = null;
         setServiceLogs(["Failed to fetch logs. Service might be down."]);
     } finally {
         setLogsLoading(false);
@@ -0,0 +1,180 @@
+
+-- ==========================================
+-- PYTHON BRIDGE: SYNC STATE
+-- ==========================================
+
+-- 1. Per-device log watermark (last committed punch on the device)
+-- last_log_at:      timestamp of the newest punch already pushed (device local time)
+-- last_log_seq:     how many punches with exactly that timestamp were pushed
+-- last_log_records: device record count seen at the last sync (detects cleared buffers)
+ALTER TABLE public.devices ADD COLUMN IF NOT EXISTS last_log_at TIMESTAMP;
+ALTER TABLE public.devices ADD COLUMN IF NOT EXISTS last_log_seq INTEGER DEFAULT 0;
+ALTER TABLE public.devices ADD COLUMN IF NOT EXISTS last_log_records INTEGER DEFAULT 0;
+ALTER TABLE public.devices ADD COLUMN IF NOT EXISTS last_log_synced_at TIMESTAMP WITH TIME ZONE;
+
+-- 2. Batch punch ingestion: one request per batch (python_bridge/punch_ingest.py, INGEST_MODE=rpc)
+-- p_punches: [{"code": "1001", "ts": "2026-01-05T07:58:12", "device_uuid": "...", "device_label": "Gate (10.0.0.5)"}, ...]
+--   code = employees.employee_id_code, ts = device local time (written like the bridge writes clock_in)
+-- Punches are folded per (employee, date) into first-in / last-out, the clock-in is classified
+-- against the shift thresholds and the day is inserted or its clock_out moved forward.
+-- Returns one row per input punch (idx = position in p_punches):
+--   clock_in | clock_out | folded (absorbed by an earlier/later punch of the same day)
+--   skipped (not later than the stored clock_out / inside the debounce) | unknown_employee | invalid
+CREATE INDEX IF NOT EXISTS attendance_employee_date_idx ON public.attendance (employee_id, date);
+
+CREATE OR REPLACE FUNCTION public.ingest_punches(
+    p_punches JSONB,
+    p_source TEXT DEFAULT 'live',
+    p_debounce_seconds INTEGER DEFAULT 0
+)
+RETURNS TABLE (idx INTEGER, outcome TEXT, employee_id TEXT, date DATE, attendance_id TEXT)
+LANGUAGE plpgsql
+AS $$
+#variable_conflict use_column
+DECLARE
+    d RECORD;
+    cur RECORD;
+    v_class TEXT;
+    v_id TEXT;
+    v_moved BOOLEAN;
+    days JSONB := '{}'::jsonb; -- "employee_id|date" -> {"id", "new", "moved"}
+BEGIN
+    FOR d IN
+        WITH p AS (
+            SELECT e.value->>'code' AS code,
+                   NULLIF(e.value->>'ts', '')::timestamp AS ts,
+                   NULLIF(e.value->>'device_uuid', '')::uuid AS device_uuid,
+                   e.value->>'device_label' AS device_label
+            FROM jsonb_array_elements(p_punches) AS e(value)
+        )
+        SELECT v.employee_id AS emp_id, p.ts::date AS day,
+               min(p.ts) AS first_ts, max(p.ts) AS last_ts,
+               (array_agg(p.device_uuid ORDER BY p.ts DESC))[1] AS device_uuid,
+               (array_agg(p.device_label ORDER BY p.ts DESC))[1] AS device_label,
+               COALESCE(min(v.late_threshold::text)::time, '08:00:00') AS late_at,
+               COALESCE(min(v.absent_threshold::text)::time, '09:00:00') AS absent_at
+        FROM p
+        JOIN public.employee_shift_view v ON v.employee_id_code = p.code
+        WHERE p.ts IS NOT NULL
+        GROUP BY v.employee_id, p.ts::date
+        ORDER BY 1, 2 -- same lock order in every call
+    LOOP
+        -- Serializes concurrent batches (live drain + manual sync) for one employee-day
+        PERFORM pg_advisory_xact_lock(hashtext(d.emp_id || '|' || d.day::text));
+
+        SELECT a.id, a.clock_in, a.clock_out INTO cur
+        FROM public.attendance a
+        WHERE a.employee_id = d.emp_id AND a.date = d.day
+        ORDER BY a.created_at
+        LIMIT 1;
+
+        IF NOT FOUND THEN
+            -- === CLOCK IN (+ CLOCK OUT if there were later punches) ===
+            v_class := CASE
+                WHEN d.first_ts::time >= d.absent_at THEN 'very_late'
+                WHEN d.first_ts::time >= d.late_at THEN 'late'
+                ELSE 'on_time' END;
+            v_id := gen_random_uuid()::text;
+            INSERT INTO public.attendance (id, employee_id, date, status, clock_in, clock_out, device_id, device_uuid, notes)
+            VALUES (
+                v_id, d.emp_id, d.day,
+                CASE WHEN v_class = 'on_time' THEN 'PRESENT' ELSE 'LATE' END,
+                d.first_ts, CASE WHEN d.last_ts > d.first_ts THEN d.last_ts END,
+                d.device_label, d.device_uuid,
+                CASE WHEN p_source = 'history' THEN
+                    CASE v_class WHEN 'on_time' THEN 'Device History Sync'
+                                 WHEN 'late' THEN 'Late Arrival (History Sync)'
+                                 ELSE 'Very Late (History Sync)' END
+                ELSE
+                    CASE v_class WHEN 'on_time' THEN 'On Time'
+                                 WHEN 'late' THEN 'Late Arrival'
+                                 ELSE 'Very Late (After Absent Threshold)' END
+                END
+            );
+            days := days || jsonb_build_object(d.emp_id || '|' || d.day::text,
+                jsonb_build_object('id', v_id, 'new', true, 'moved', d.last_ts > d.first_ts));
+        ELSE
+            -- === CLOCK OUT (only if the last punch moves it forward) ===
+            v_moved := cur.clock_in IS NOT NULL
+                AND d.last_ts::timestamptz > cur.clock_in
+                AND (cur.clock_out IS NULL OR d.last_ts::timestamptz > cur.clock_out)
+                AND d.last_ts::timestamptz >= COALESCE(cur.clock_out, cur.clock_in) + make_interval(secs => p_debounce_seconds);
+            IF v_moved THEN
+                UPDATE public.attendance
+                SET clock_out = d.last_ts, device_id = d.device_label, device_uuid = d.device_uuid
+                WHERE id = cur.id;
+            END IF;
+            days := days || jsonb_build_object(d.emp_id || '|' || d.day::text,
+                jsonb_build_object('id', cur.id, 'new', false, 'moved', v_moved));
+        END IF;
+    END LOOP;
+
+    RETURN QUERY
+    WITH p AS (
+        SELECT (e.ord - 1)::int AS i, e.value->>'code' AS code,
+               NULLIF(e.value->>'ts', '')::timestamp AS ts
+        FROM jsonb_array_elements(p_punches) WITH ORDINALITY AS e(value, ord)
+    ), r AS (
+        SELECT p.i, p.ts, v.employee_id AS emp_id,
+               row_number() OVER (PARTITION BY v.employee_id, p.ts::date ORDER BY p.ts, p.i) AS from_first,
+               row_number() OVER (PARTITION BY v.employee_id, p.ts::date ORDER BY p.ts DESC, p.i DESC) AS from_last,
+               days -> (v.employee_id || '|' || p.ts::date::text) AS day
+        FROM p
+        LEFT JOIN public.employee_shift_view v ON v.employee_id_code = p.code AND p.ts IS NOT NULL
+    )
+    SELECT r.i,
+           CASE
+               WHEN r.ts IS NULL THEN 'invalid'
+               WHEN r.emp_id IS NULL THEN 'unknown_employee'
+               WHEN (r.day->>'new')::boolean AND r.from_first = 1 THEN 'clock_in'
+               WHEN (r.day->>'moved')::boolean AND r.from_last = 1 THEN 'clock_out'
+               WHEN NOT (r.day->>'new')::boolean AND r.from_last = 1 THEN 'skipped'
+               ELSE 'folded'
+           END,
+           r.emp_id, r.ts::date, r.day->>'id'
+    FROM r
+    ORDER BY r.i;
+END;
+$$;
+
+-- 3. Raw punch ledger (python_bridge/punch_ledger.py, PUNCH_LEDGER=on)
+-- Every punch the bridge has seen, exactly once. (device_ip, device_user_id, punched_at) is the
+-- natural key and the bridge inserts with ON CONFLICT DO NOTHING, so replays, overlapping manual
+-- and live syncs and several bridges add nothing. Attendance is derived only from new rows;
+-- applied_at marks the rows already derived.
+CREATE TABLE IF NOT EXISTS public.punch_ledger (
+    id BIGSERIAL PRIMARY KEY,
+    device_ip TEXT NOT NULL,
+    device_user_id TEXT NOT NULL,
+    punched_at TIMESTAMP NOT NULL, -- device local time
+    device_uuid UUID REFERENCES public.devices(id) ON DELETE SET NULL,
+    device_name TEXT,
+    source TEXT, -- live | sync
+    received_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    applied_at TIMESTAMP WITH TIME ZONE,
+    UNIQUE (device_ip, device_user_id, punched_at)
+);
+CREATE INDEX IF NOT EXISTS punch_ledger_pending_idx ON public.punch_ledger (received_at) WHERE applied_at IS NULL;
+
+-- 4. Auto-absent per shift and xarun (python_bridge/absent_engine.py)
+-- The bridge groups its cached directory by (xarun_id, absent_threshold), so the view carries both,
+-- plus status (only ACTIVE employees are marked). New columns go last: CREATE OR REPLACE VIEW
+-- cannot reorder existing ones. Presence is checked with date = today AND employee_id IN (...),
+-- which uses attendance_employee_date_idx from section 2.
+CREATE OR REPLACE VIEW employee_shift_view AS
+SELECT
+    e.id as employee_id,
+    e.name,
+    e.finger_id,
+    e.employee_id_code,
+    e.branch_id,
+    s.start_time,
+    s.late_threshold,
+    s.absent_threshold,
+    e.xarun_id,
+    e.status
+FROM employees e
+LEFT JOIN shifts s ON e.shift_id = s.id;
+
+-- Force Schema Reload
+NOTIFY pgrst, 'reload schema';
@@ -0,0 +1,188 @@
+
+import uuid
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime
+
+# ==========================================
+# AUTO-ABSENT ENGINE (PER SHIFT & XARUN)
+# ==========================================
+# The old check ran once at 09:00 for everyone: all ACTIVE employees, all of
+# today's attendance, then one insert with every absent row. Now tick() runs
+# every minute and only looks at employees whose shift absent_threshold has
+# passed and who were not decided yet today, grouped by (xarun_id,
+# absent_threshold) from the in-memory directory. Each shift is handled when
+# it is due instead of everybody at 09:00.
+#
+# - Present = in the open-day state, or found by a chunked
+#   date = today AND employee_id IN (...) read (attendance_employee_date_idx).
+# - ABSENT rows are inserted WRITE_CHUNK at a time. A failed chunk stays
+#   undecided and is retried on the next tick.
+# - A restart re-reads instead of re-inserting: earlier ABSENT rows count
+#   as attendance.
+# - ABSENT_OFF_DAYS in .env (default Friday) replaces the hard-coded Friday.
+
+READ_CHUNK = 200 # UUIDs per IN (...) filter, keeps the request URL short
+WRITE_CHUNK = 500
+DAY_NAMES = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+def parse_off_days(value):
+    """'Friday' / 'fri,sat' / '4' (Mon=0) -> {weekday}. Empty -> no off days."""
+    days = set()
+    for part in (value or '').split(','):
+        part = part.strip().lower()
+        if not part:
+            continue
+        if part.isdigit():
+            days.add(int(part) % 7)
+        elif part[:3] in DAY_NAMES:
+            days.add(DAY_NAMES.index(part[:3]))
+        else:
+            logging.warning(f"⚠️ Unknown off day '{part}' in ABSENT_OFF_DAYS ignored.")
+    return days
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+class AbsentEngine:
+    def __init__(self, read_chunk=READ_CHUNK, write_chunk=WRITE_CHUNK):
+        self.read_chunk = read_chunk
+        self.write_chunk = write_chunk
+        self.lock = threading.Lock() # one evaluation at a time (scheduler + /trigger-absent)
+        self.date = None
+        self.decided = set() # employee uuids decided today (present or marked)
+        self.groups = {} # "xarun@threshold" -> {evaluated, marked, at}
+        self.off_day_logged = None
+        self.runs = 0
+        self.reads = 0
+        self.writes = 0
+        self.failed_chunks = 0
+        self.marked_total = 0
+        self.last_run = None
+
+    def due(self, directory, clock, force=False):
+        """{(xarun_id, threshold): [EmployeeEntry]} of undecided ACTIVE employees past their threshold."""
+        groups = defaultdict(list)
+        seen = set()
+        for emp in directory.values():
+            if emp.get('status') != 'ACTIVE' or emp.uuid in self.decided or emp.uuid in seen:
+                continue
+            threshold = str(emp.absent_threshold)[:8]
+            if not force and clock < threshold:
+                continue
+            seen.add(emp.uuid)
+            groups[(emp.get('xarun_id'), threshold)].append(emp)
+        return groups
+
+    def tick(self, supabase, directory, open_day, off_days=(), now=None, force=False):
+        """
+        Evaluates every due group. force=True ignores the thresholds (manual trigger).
+        Returns how many employees were marked ABSENT, or None if a run is already going.
+        """
+        if not self.lock.acquire(blocking=False):
+            return None
+        try:
+            now = now or datetime.now()
+            today = now.strftime("%Y-%m-%d")
+            if self.date != today:
+                self.date, self.decided, self.groups = today, set(), {}
+
+            if now.weekday() in off_days:
+                if force or self.off_day_logged != today:
+                    logging.info(f"📅 Today is {now.strftime('%A')} (Off Day). Skipping Absent Check.")
+                    self.off_day_logged = today
+                return 0
+
+            groups = self.due(directory, now.strftime("%H:%M:%S"), force)
+            if not groups:
+                if force:
+                    logging.info("✅ Everyone is present! No absences marked.")
+                return 0
+            self.runs += 1
+            self.last_run = now.isoformat()
+            marked = 0
+            for (xarun_id, threshold), emps in sorted(groups.items(), key=lambda kv: (kv[0][1], str(kv[0][0]))):
+                marked += self.evaluate_group(supabase, open_day, today, xarun_id, threshold, emps)
+            return marked
+        finally:
+            self.lock.release()
+
+    def evaluate_group(self, supabase, open_day, today, xarun_id, threshold, emps):
+        known = open_day.records if open_day.date == today else {}
+        candidates = []
+        for emp in emps:
+            if emp.uuid in known:
+                self.decided.add(emp.uuid)
+            else:
+                candidates.append(emp)
+
+        # Confirm the rest against the DB (other writers: dashboard, app.py, other bridges)
+        missing = []
+        for chunk in chunks(candidates, self.read_chunk):
+            try:
+                res = supabase.table('attendance').select("employee_id") \
+                    .eq('date', today).in_('employee_id', [emp.uuid for emp in chunk]).execute()
+            except Exception as e:
+                logging.error(f"❌ Auto-Absent lookup failed (xarun {xarun_id}, {threshold}): {e}")
+                self.failed_chunks += 1
+                continue
+            self.reads += 1
+            present = {r['employee_id'] for r in res.data or []}
+            for emp in chunk:
+                if emp.uuid in present:
+                    self.decided.add(emp.uuid)
+                else:
+                    missing.append(emp)
+
+        marked = 0
+        notes = f"Auto-marked at {threshold[:5]}"
+        for chunk in chunks(missing, self.write_chunk):
+            # A clock-in may have landed in memory while we were reading
+            known = open_day.records if open_day.date == today else {}
+            chunk = [emp for emp in chunk if emp.uuid not in known]
+            rows = [{
+                "id": str(uuid.uuid4()),
+                "employee_id": emp.uuid,
+                "date": today,
+                "status": "ABSENT",
+                "notes": notes,
+                "device_id": "SYSTEM-AUTO"
+            } for emp in chunk]
+            if not rows:
+                continue
+            try:
+                supabase.table('attendance').insert(rows).execute()
+            except Exception as e:
+                logging.error(f"❌ Auto-Absent insert failed (xarun {xarun_id}, {threshold}, {len(rows)} rows): {e}")
+                self.failed_chunks += 1
+                continue
+            self.writes += 1
+            for row in rows:
+                open_day.remember(row['employee_id'], today, {"id": row['id'], "clock_in": None, "clock_out": None})
+                self.decided.add(row['employee_id'])
+            marked += len(rows)
+
+        group = self.groups.setdefault(f"{xarun_id}@{threshold[:5]}", {"evaluated": 0, "marked": 0, "at": None})
+        group["evaluated"] += len(emps)
+        group["marked"] += marked
+        group["at"] = datetime.now().isoformat()
+        self.marked_total += marked
+        if marked:
+            logging.info(f"✅ Marked {marked}/{len(emps)} employees as ABSENT (xarun {xarun_id}, threshold {threshold[:5]}).")
+        return marked
+
+    def stats(self):
+        return {
+            "date": self.date,
+            "decided_today": len(self.decided),
+            "marked_today": sum(g["marked"] for g in self.groups.values()),
+            "groups": dict(self.groups),
+            "runs": self.runs,
+            "reads": self.reads,
+            "writes": self.writes,
+            "failed_chunks": self.failed_chunks,
+            "marked_total": self.marked_total,
+            "last_run": self.last_run
+        }
@@ -1,19 +1,41 @@
 
 import time
+process_started = time.perf_counter() # startup timings count from here
 import sys
 import os
 import schedule
 import threading
 import uuid
 import logging
-from collections import deque
+import multiprocessing
 from datetime import datetime, time as dtime, timedelta
 from pathlib import Path
-from zk import ZK
-from supabase import create_client, Client
 from dotenv import load_dotenv
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+from attendance_fold import classify_clock_in
+from employee_cache import EmployeeCache
+from employee_directory import EmployeeEntry, load_directory
+from employee_snapshot import EmployeeSnapshot, DeviceSnapshot
+from user_sync import sync_users as sync_user_diff
+from open_day import OpenDayState
+from punch_outbox import PunchOutbox, drain_forever
+from sync_watermark import load_watermark, advance_watermark, save_watermark, check_buffer, WatermarkCursor
+from attendance_stream import stream_attendance
+from zk_session import ZKSessionManager, LIVE_POLL_SECONDS
+from job_registry import JobRegistry
+from metrics import registry as metrics, InstrumentedClient, SCAN_BUCKETS, DOWNLOAD_BUCKETS
+from absent_engine import AbsentEngine, parse_off_days
+from scan_debounce import ScanDebouncer
+from punch_ingest import ingest_batch, batches, WRITTEN, LIVE_DEBOUNCE_SECONDS
+import punch_ledger
+from tracing import span, traced_method, recent as recent_spans, summary as span_summary
+import profiler
+from startup import StartupTimer, wait_for_network
+from log_pipeline import LogPipeline, bind as bind_log_context
+# Deferred (slow in the frozen .exe): supabase in init_supabase, async_engine /
+# shard_supervisor when those modes start. pyzk itself is small (~5ms) and comes
+# in with attendance_stream / zk_session.
 
 # --- PATH SETUP (CRITICAL FIX FOR EXE) ---
 if getattr(sys, 'frozen', False):
@@ -21,25 +43,19 @@ if getattr(sys, 'frozen', False):
 else:
     base_dir = Path(__file__).resolve().parent
 
-log_file_path = base_dir / "monitor_service.log"
+# Log, outbox and snapshots live in SMARTSTOCK_STATE_DIR if set (benches,
+# simulators, a second bridge on the same PC), else next to the exe. Read from the
+# process environment on import, before .env is loaded.
+state_dir = Path(os.environ.get('SMARTSTOCK_STATE_DIR') or base_dir)
+log_file_path = state_dir / "monitor_service.log"
+outbox_path = state_dir / "punch_outbox.db"
+snapshot_path = state_dir / "employee_snapshot.db"
+device_snapshot_path = state_dir / "device_snapshot.json"
 env_path = base_dir / '.env'
 
 # --- LOGGING ---
-log_buffer = deque(maxlen=50)
-
-class ListHandler(logging.Handler):
-    def emit(self, record):
-        try:
-            log_entry = self.format(record)
-            log_buffer.appendleft(log_entry)
-        except:
-            pass
-
-handlers = [
-    logging.FileHandler(str(log_file_path), encoding='utf-8', mode='a'),
-    ListHandler()
-]
-
+# Queue-backed: the calling thread never writes the file (see log_pipeline)
+console = None
 if sys.stdout:
     try:
         if sys.platform.startswith('win'):
@@ -48,10 +64,14 @@ if sys.stdout:
                 sys.stdout.reconfigure(encoding='utf-8')
             else:
                 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
-        handlers.append(logging.StreamHandler(sys.stdout))
+        console = sys.stdout
     except Exception: pass
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s', handlers=handlers)
+if multiprocessing.current_process().name != 'MainProcess':
+    # Shard workers keep their own file: only one process may rotate a log
+    log_file_path = state_dir / f"monitor_service_{multiprocessing.current_process().name.lower().replace('-', '')}.log"
+
+log_pipeline = LogPipeline(log_file_path, console)
 
 # --- FLASK API ---
 app = Flask(__name__)
@@ -59,17 +79,23 @@ CORS(app, resources={r"/*": {"origins": "*"}})
 
 supabase = None
 
+def load_config():
+    if env_path.exists():
+        load_dotenv(dotenv_path=env_path)
+        return True
+    return False
+
 def init_supabase():
     global supabase
     logging.info(f"📂 Loading config from: {env_path}")
     
-    if env_path.exists():
-        load_dotenv(dotenv_path=env_path)
+    if load_config():
         url = os.getenv('SUPABASE_URL')
         key = os.getenv('SUPABASE_KEY')
         if url and key:
             try:
-                supabase = create_client(url, key)
+                from supabase import create_client
+                supabase = InstrumentedClient(create_client(url, key)) # timed per table/op for /metrics
                 logging.info("✅ Supabase Connected Successfully")
                 return True
             except Exception as e:
@@ -80,11 +106,97 @@ def init_supabase():
         logging.error(f"❌ .env file NOT found at {env_path}")
     return False
 
+# Per-phase startup timings (/ status)
+startup = StartupTimer(process_started)
+
 # Global Cache & Locks
-employee_cache = {}
+employee_cache = EmployeeCache(lambda: load_employee_directory())
+# Last good directory on disk: resolves scans right after boot, even offline
+employee_snapshot = EmployeeSnapshot(snapshot_path)
+# Last active devices list: monitoring starts from it before Supabase answers
+device_snapshot = DeviceSnapshot(device_snapshot_path)
 active_devices = {}
-active_zk_connections = {} 
-device_locks = {}
+# One connection per device, owned by its monitor thread; manual syncs borrow it
+zk_sessions = ZKSessionManager()
+# IPs whose last catch-up stopped at a failed write (live must not move their watermark)
+catchup_pending = set()
+# ip -> device that went live before Supabase connected; caught up once it does
+catchup_deferred = {}
+# Set once the startup network probe + Supabase init have run (main loop retries after that)
+cloud_attempted = threading.Event()
+# Tracked /sync-users and /sync-logs jobs (one per device and operation)
+jobs = JobRegistry()
+
+# --- METRICS (/metrics) ---
+scan_to_commit = metrics.histogram(
+    "attendance_scan_to_commit_seconds", "Device scan time to attendance row written (device clock).",
+    ("device",), SCAN_BUCKETS)
+download_seconds = metrics.histogram(
+    "zk_attendance_download_seconds", "Attendance buffer download duration.", ("device",), DOWNLOAD_BUCKETS)
+download_records = metrics.counter(
+    "zk_attendance_download_records_total", "Records scanned in attendance downloads.", ("device",))
+device_buffer_records = metrics.gauge(
+    "zk_device_buffer_records", "Attendance records on the device at the last download.", ("device",))
+device_connects = metrics.counter("zk_connects_total", "Successful device connections.", ("device",))
+device_link_lost = metrics.counter("zk_link_lost_total", "Device sessions that ended with an error.", ("device",))
+scans_debounced = metrics.counter("scans_debounced_total", "Live scans dropped as repeats within the debounce window.", ("device",))
+
+def record_commit(device_info, timestamp, source):
+    """Scan-to-commit lag, for live captures only (catch-up / manual / ledger replays are hours old)."""
+    if source != 'live':
+        return
+    lag = (datetime.now() - timestamp).total_seconds()
+    if lag >= 0:
+        scan_to_commit.observe(lag, device=device_info.get('ip_address', 'unknown'))
+
+@metrics.collector
+def collect_service_metrics():
+    cache = employee_cache.stats()
+    outbox_stats = outbox.stats() if outbox else {}
+    samples = [
+        ("employee_cache_hits_total", "counter", "Employee cache hits.", {}, cache['hits']),
+        ("employee_cache_misses_total", "counter", "Employee cache misses.", {}, cache['misses']),
+        ("employee_cache_negative_hits_total", "counter", "Lookups answered by the negative cache.", {}, cache['negative_hits']),
+        ("employee_cache_refreshes_total", "counter", "Full employee directory reloads.", {}, cache['refreshes']),
+        ("employee_cache_refresh_errors_total", "counter", "Failed employee directory reloads.", {}, cache['refresh_errors']),
+        ("employee_cache_size", "gauge", "Employees in the cache.", {}, cache['size']),
+        ("employee_cache_load_seconds", "gauge", "Duration of the last directory load.", {}, cache['last_load_seconds']),
+        ("punch_outbox_pending", "gauge", "Live punches waiting in the local outbox.", {}, outbox_stats.get('pending')),
+        ("punch_outbox_dead_letters", "gauge", "Punches moved to dead_punches after repeated failures.", {}, outbox_stats.get('dead_letters')),
+    ]
+
+    # Devices: connected = live session open; reconnecting = monitored but not connected
+    if async_engine:
+        monitored = list(async_engine.tasks)
+    elif shard_supervisor:
+        monitored = [d['ip_address'] for d in shard_supervisor.devices]
+    else:
+        monitored = list(active_devices)
+    connected = set(zk_sessions.connected_ips())
+    samples.append(("zk_devices_connected", "gauge", "Devices with an open session.", {}, len(connected)))
+    samples.append(("zk_devices_reconnecting", "gauge", "Monitored devices without a session.", {},
+                    len([ip for ip in monitored if ip not in connected])))
+    for ip in monitored:
+        samples.append(("zk_device_up", "gauge", "1 if the device session is open.", {"device": ip}, int(ip in connected)))
+    return samples
+
+# Today's open attendance row per employee (saves the per-scan SELECT)
+open_day = OpenDayState()
+
+# Repeat scans (same person, any gate) are dropped here before any DB call
+scan_debouncer = ScanDebouncer()
+
+# Shift-aware auto-absent, evaluated incrementally through the day
+absent_engine = AbsentEngine()
+
+# Live punches are queued locally first, then drained to Supabase.
+# Opened by main() / the shard worker, not on import (benches, tools).
+outbox = None
+
+def open_outbox(path=None):
+    global outbox
+    outbox = PunchOutbox(path or outbox_path)
+    return outbox
 
 @app.route('/')
 def status_check():
@@ -93,16 +205,73 @@ def status_check():
         "status": status, 
         "message": "SmartStock Service Running", 
         "env_path": str(env_path),
+        "outbox": outbox.stats() if outbox else None,
+        "employee_cache": employee_cache.stats(),
+        "employee_snapshot": employee_snapshot.stats(),
+        "open_day": open_day.stats(),
+        "scan_debounce": scan_debouncer.stats(),
+        "auto_absent": absent_engine.stats(),
+        "zk_sessions": zk_sessions.stats(),
+        "engine": async_engine.stats() if async_engine else {"mode": "threads", "devices": len(active_devices)},
+        "shards": shard_supervisor.stats() if shard_supervisor else None,
+        "jobs": jobs.stats(),
+        "startup": startup.stats(),
         "timestamp": datetime.now().isoformat()
     })
 
+@app.route('/metrics')
+def metrics_endpoint():
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+# --- DEBUG: TRACING SPANS & PROFILING ---
+@app.route('/debug/spans')
+def debug_spans():
+    name = request.args.get('name')
+    device = request.args.get('device')
+    limit = request.args.get('limit', type=int) if 'limit' in request.args else 200
+    if limit is None or limit <= 0:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+    limit = min(limit, 2000)
+    return jsonify({"spans": recent_spans(name, device, limit)})
+
+@app.route('/debug/spans/summary')
+def debug_span_summary():
+    return jsonify(span_summary())
+
+@app.route('/debug/profile')
+def debug_profile():
+    # Samples every thread's stack for N seconds -> collapsed stacks (flamegraph.pl / speedscope)
+    # type=float gives None for a bad value instead of raising (was a 500)
+    seconds = request.args.get('seconds', type=float) if 'seconds' in request.args else 10.0
+    interval = request.args.get('interval', type=float) if 'interval' in request.args else profiler.DEFAULT_INTERVAL
+    if not all(value is not None and 0 < value < float('inf') for value in (seconds, interval)):
+        return jsonify({"error": "seconds and interval must be positive numbers"}), 400
+    seconds = min(seconds, profiler.MAX_SECONDS)
+    interval = max(interval, 0.001)
+    text = profiler.collapsed(seconds, interval)
+    if text is None:
+        return jsonify({"error": "A profile is already running"}), 409
+    return text, 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
 @app.route('/logs')
 def get_logs():
-    return jsonify({"logs": list(log_buffer)})
+    # ?level=WARNING&device=10.0.0.5&after=<cursor>&limit=50 -> newest first; pass cursor back as after
+    # (only while epoch stays the same: a restarted service numbers its records from 1 again)
+    after = request.args.get('after', type=int)
+    limit = min(request.args.get('limit', 50, type=int), 1000)
+    records, cursor, truncated = log_pipeline.query(after, request.args.get('level'), request.args.get('device'), limit)
+    return jsonify({
+        "logs": [r["text"] for r in records],
+        "records": records,
+        "cursor": cursor,
+        "epoch": log_pipeline.epoch,
+        "truncated": truncated,
+        "pipeline": log_pipeline.stats()
+    })
 
 @app.route('/trigger-absent', methods=['POST'])
 def manual_absent_check():
-    threading.Thread(target=run_auto_absent_check).start()
+    threading.Thread(target=run_auto_absent_check, kwargs={'force': True}).start()
     return jsonify({"message": "Absent check started.", "status": "running"})
 
 # --- NEW: SYNC ENDPOINTS (Matches app.py for UI Compatibility) ---
@@ -115,9 +284,11 @@ def api_sync_users():
     
     if not ip: return jsonify({"error": "IP required"}), 400
     
-    # Run in background to not block
-    threading.Thread(target=run_manual_user_sync, args=(ip, port, xarun_id)).start()
-    return jsonify({"success": True, "message": "User sync started in background."})
+    # Run in background to not block (joins the running job for this device if there is one)
+    job, created = jobs.submit('sync_users', ip, lambda job: run_manual_user_sync(ip, port, xarun_id, job.update),
+                               {'port': port, 'xarun_id': xarun_id})
+    message = "User sync started in background." if created else "User sync already running for this device."
+    return jsonify({"success": True, "message": message, "job_id": job.id, "coalesced": not created})
 
 @app.route('/sync-logs', methods=['POST'])
 def api_sync_logs():
@@ -128,87 +299,264 @@ def api_sync_logs():
     if not ip: return jsonify({"error": "IP required"}), 400
 
     # Run in background
-    threading.Thread(target=run_manual_log_sync, args=(ip, port)).start()
-    return jsonify({"success": True, "message": "Log sync started in background."})
+    job, created = jobs.submit('sync_logs', ip, lambda job: run_manual_log_sync(ip, port, job.update), {'port': port})
+    message = "Log sync started in background." if created else "Log sync already running for this device."
+    return jsonify({"success": True, "message": message, "job_id": job.id, "coalesced": not created})
+
+@app.route('/jobs')
+def list_jobs():
+    return jsonify({"jobs": jobs.list()})
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if not job: return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
 
 # --- MANUAL SYNC FUNCTIONS ---
-def run_manual_user_sync(ip, port, xarun_id):
+# Both run on the monitor's live connection when there is one (capture is
+# paused for the job and resumed), otherwise on their own short connection.
+def manual_connect(ip, port):
+    return lambda: make_zk(ip, port, timeout=20).connect()
+
+TRACED_ZK_CALLS = ('connect', 'disable_device', 'enable_device', 'get_users', 'get_attendance', 'read_sizes')
+
+def make_zk(ip, port=4370, timeout=30):
+    """ZK client whose slow device calls show up as zk.* spans."""
+    from zk import ZK
+    zk = ZK(ip, port=port, timeout=timeout, force_udp=False, ommit_ping=True)
+    for name in TRACED_ZK_CALLS:
+        traced_method(zk, name, f"zk.{name}", device=ip)
+    return zk
+
+# Errors are logged and re-raised so a tracked job ends as "failed".
+def run_manual_user_sync(ip, port, xarun_id, progress=None):
+    if shard_supervisor: # the shard process that owns the device runs it
+        return shard_supervisor.run_job(ip, 'sync_users', (ip, port, xarun_id))
     logging.info(f"🔄 Manual User Sync Request for {ip}...")
-    device_locks[ip] = True # Pause monitoring
-    conn = None
+    device = {'xarun_id': xarun_id, 'name': 'Manual Sync', 'ip_address': ip}
     try:
-        zk = ZK(ip, port=port, timeout=20, force_udp=False, ommit_ping=True)
-        conn = zk.connect()
-        conn.disable_device()
-        sync_device_users(conn, {'xarun_id': xarun_id, 'name': 'Manual Sync', 'ip_address': ip})
-        conn.enable_device()
+        result = zk_sessions.run(ip, lambda conn: sync_device_users(conn, device, progress), manual_connect(ip, port))
         logging.info("✅ Manual User Sync Completed.")
+        return result
     except Exception as e:
         logging.error(f"Manual Sync Error: {e}")
-    finally:
-        if conn: conn.disconnect()
-        device_locks[ip] = False # Resume monitoring
+        raise
 
-def run_manual_log_sync(ip, port):
+def run_manual_log_sync(ip, port, progress=None):
+    if shard_supervisor:
+        return shard_supervisor.run_job(ip, 'sync_logs', (ip, port))
     logging.info(f"🔄 Manual Log Sync Request for {ip}...")
-    device_locks[ip] = True
-    conn = None
+    device = {'name': 'Manual Sync', 'ip_address': ip}
     try:
-        zk = ZK(ip, port=port, timeout=20, force_udp=False, ommit_ping=True)
-        conn = zk.connect()
-        conn.disable_device()
-        
-        logs = conn.get_attendance()
-        logging.info(f"📥 Downloaded {len(logs)} logs from device.")
-        
-        count = 0
-        for log in logs:
-            if push_attendance(log.user_id, log.timestamp, {'name': 'Manual Sync', 'ip_address': ip}):
-                count += 1
-        
-        logging.info(f"✅ Manual Log Sync: Processed {len(logs)}, Inserted/Updated {count}.")
-        conn.enable_device()
+        downloaded, new_count, count, _, complete = zk_sessions.run(
+            ip, lambda conn: push_new_device_logs(conn, device, progress=progress), manual_connect(ip, port), covers_logs=True
+        )
+        logging.info(f"✅ Manual Log Sync: Downloaded {downloaded}, New {new_count}, Inserted/Updated {count}.")
+        return {"downloaded": downloaded, "new": new_count, "written": count, "complete": complete}
     except Exception as e:
         logging.error(f"Manual Log Sync Error: {e}")
-    finally:
-        if conn: conn.disconnect()
-        device_locks[ip] = False
+        raise
+
+def push_new_device_logs(conn, device, cutoff=None, progress=None):
+    """
+    Streams the device buffer and pushes only punches after the device watermark.
+    Only those are kept in memory (not the whole buffer); they are sorted once
+    across all chunks, because a buffer that is not in time order (clock reset,
+    merged buffers) can hold a day's first punch in a later chunk. Writes stop
+    at the first failure and the watermark stays before the failed punch.
+    progress(downloaded=, processed=, written=) is called as it goes (jobs).
+    Returns (downloaded, new, written, watermark, complete); complete is False
+    when a write failed and the watermark stopped before the failed punch.
+    """
+    watermark = load_watermark(supabase, device)
+    starts = [t for t in (cutoff, watermark['last_at'] if watermark else None) if t]
+    cursor = WatermarkCursor(watermark, cutoff)
+    stream_stats = {}
+    ip = device.get('ip_address', 'unknown')
+    new_logs = []
+    started = time.perf_counter()
+    with span("zk.download_attendance", device=ip):
+        for chunk in stream_attendance(conn, start=max(starts) if starts else None, stats=stream_stats):
+            new_logs.extend(cursor.new_logs(chunk))
+            if progress: progress(downloaded=stream_stats['scanned'])
+    download_time = time.perf_counter() - started
+    new_logs.sort(key=lambda x: x.timestamp)
+
+    committed, written = commit_device_logs(new_logs, device, progress)
+    cursor.committed(new_logs[:committed])
+    complete = committed == len(new_logs)
+    if not complete:
+        cursor.blocked(new_logs[committed:committed + 1])
+    download_seconds.observe(download_time, device=ip)
+    download_records.inc(stream_stats.get('scanned', 0), device=ip)
+    device_buffer_records.set(stream_stats.get('records', 0), device=ip)
+    check_buffer(watermark, conn.records)
+    if progress: progress(downloaded=stream_stats.get('scanned', 0), processed=committed, written=written)
+
+    if complete:
+        catchup_pending.discard(ip)
+    else:
+        catchup_pending.add(ip)
+        logging.warning(f"⚠️ {ip}: {cursor.new - committed} punches not written, the next sync retries them.")
+    if watermark:
+        watermark = cursor.result(conn.records)
+        save_watermark(supabase, watermark)
+    return stream_stats.get('records', 0), cursor.new, written, watermark, complete
+
+def commit_device_logs(logs, device, progress=None):
+    """
+    Writes sorted device logs. Returns (done, written): done = how many
+    leading logs are settled; it stops at the first failed write.
+    """
+    done = 0
+    written = 0
+    if ledger_enabled() or rpc_ingest_enabled():
+        # Batches through the ledger and / or ingest_punches
+        for batch in batches(logs):
+            try:
+                batch_done, batch_written = write_punches([(log.user_id, log.timestamp, device) for log in batch], 'sync')
+            except Exception as e:
+                logging.error(f"❌ Batch write failed for {device.get('ip_address')}: {e}")
+                break
+            done += batch_done
+            written += batch_written
+            if progress: progress(processed=done, written=written)
+            if batch_done < len(batch):
+                break
+    else:
+        for log in logs:
+            result = push_attendance(log.user_id, log.timestamp, device)
+            if result is None:
+                break # DB write failed -> next sync retries from here
+            done += 1
+            if result: written += 1
+            if progress and done % 50 == 0: progress(processed=done, written=written)
+    return done, written
+
+# --- SERVER-SIDE INGESTION (INGEST_MODE=rpc in .env) ---
+def rpc_ingest_enabled():
+    return os.getenv('INGEST_MODE', 'rows') == 'rpc'
+
+def ingest_punches(punches, source='sync'):
+    """
+    Writes [(user_id, timestamp, device_info)] with one ingest_punches request.
+    Unknown employees go through push_attendance (auto-register).
+    Returns (done, written): done = how many leading punches are settled.
+    """
+    with span("push.ingest_batch", punches=len(punches)):
+        outcomes = ingest_batch(supabase, punches, source, LIVE_DEBOUNCE_SECONDS)
+    # Open-day state in time order: a batch may list a day's clock-out before its clock-in
+    for (_, timestamp, _), row in sorted(zip(punches, outcomes), key=lambda pair: pair[0][1]):
+        if row['outcome'] == 'clock_in':
+            open_day.remember(row['employee_id'], row['date'],
+                              {"id": row['attendance_id'], "clock_in": timestamp.isoformat(), "clock_out": None})
+        elif row['outcome'] == 'clock_out':
+            open_day.remember(row['employee_id'], row['date'], {"id": row['attendance_id'], "clock_out": timestamp.isoformat()})
+    done = 0
+    written = 0
+    for (user_id, timestamp, device_info), row in zip(punches, outcomes):
+        outcome = row['outcome']
+        if outcome == 'unknown_employee':
+            result = push_attendance(user_id, timestamp, device_info, source)
+            if result is None:
+                break
+            if result: written += 1
+        if outcome in WRITTEN:
+            written += 1
+            record_commit(device_info, timestamp, source)
+        done += 1
+    return done, written
+
+# --- RAW PUNCH LEDGER (PUNCH_LEDGER=on in .env) ---
+def ledger_enabled():
+    return os.getenv('PUNCH_LEDGER', 'off') == 'on'
+
+def derive_attendance(punches, source='sync'):
+    """Attendance for [(user_id, timestamp, device_info)] -> (done, written)."""
+    if rpc_ingest_enabled():
+        return ingest_punches(punches, source)
+    done = 0
+    written = 0
+    for user_id, timestamp, device_info in punches:
+        result = push_attendance(user_id, timestamp, device_info, source)
+        if result is None:
+            break
+        done += 1
+        if result: written += 1
+    return done, written
+
+def write_punches(punches, source='live'):
+    """
+    Batch write path for device punches. Returns (done, written), done =
+    how many leading punches are settled. With the ledger on, punches are
+    appended first and attendance is derived only from the new ledger rows;
+    once they are in the ledger they count as done (apply_pending_ledger
+    finishes whatever the derive step could not).
+    """
+    if not ledger_enabled():
+        return derive_attendance(punches, source)
+    with span("push.ledger_append", punches=len(punches)):
+        fresh = punch_ledger.append(supabase, punches, source)
+    if not fresh:
+        return len(punches), 0
+    done, written = derive_attendance([punch for _, punch in fresh], source)
+    try:
+        punch_ledger.mark_applied(supabase, [ledger_id for ledger_id, _ in fresh[:done]])
+    except Exception as e:
+        logging.warning(f"⚠️ Ledger rows not marked applied (will be re-derived): {e}")
+    if done < len(fresh):
+        logging.warning(f"⏳ Ledger: {len(fresh) - done} punches stored but not derived yet.")
+    return len(punches), written
+
+def apply_pending_ledger():
+    """Scheduled: derives attendance for ledger rows a failed write left behind."""
+    if supabase and ledger_enabled():
+        punch_ledger.apply_pending(supabase, derive_attendance)
 
 # --- ATTENDANCE LOGIC (SMART IN/OUT) ---
-def push_attendance(user_id, timestamp, device_info):
-    if not supabase: return False
+# Returns True (written), False (skipped: debounce / unknown user) or None (DB failure, retry later)
+# source: 'live' for captured scans (outbox), 'sync' for catch-up / manual / ledger replays
+def push_attendance(user_id, timestamp, device_info, source='sync'):
+    with span("push_attendance", device=device_info.get('ip_address'), employee=str(user_id)):
+        return _push_attendance(user_id, timestamp, device_info, source)
+
+def push_live_attendance(user_id, timestamp, device_info):
+    return push_attendance(user_id, timestamp, device_info, 'live')
+
+def _push_attendance(user_id, timestamp, device_info, source='sync'):
+    if not supabase: return None
     
     zk_id = str(user_id)
     
-    # 1. Resolve Employee from Cache
-    if zk_id not in employee_cache:
-        refresh_employee_cache()
+    # 1. Resolve Employee from Cache (a miss shares one rate-limited reload)
+    with span("push.resolve_employee"):
+        emp = employee_cache.resolve(zk_id)
     
     # 2. Auto Create if totally missing (Safety Net)
-    if zk_id not in employee_cache:
-        try:
-            new_uuid = str(uuid.uuid4())
-            supabase.table('employees').insert({
-                "id": new_uuid,
-                "name": f"Staff {zk_id}",
-                "employee_id_code": zk_id,
-                "status": "ACTIVE",
-                "joined_date": datetime.now().strftime("%Y-%m-%d"),
-                "xarun_id": device_info.get('xarun_id'),
-                "salary": 0
-            }).execute()
-            refresh_employee_cache()
-            logging.info(f"🆕 Auto-registered new user: {zk_id}")
-        except Exception as e:
-            # Handle Race Condition / Duplicate Key
-            if "23505" in str(e) or "duplicate key" in str(e):
-                logging.warning(f"⚠️ User {zk_id} exists in DB but not in cache. Refreshing cache.")
-                refresh_employee_cache()
-            else:
-                logging.error(f"❌ Failed to auto-register {zk_id}: {e}")
-                return False
+    if not emp:
+        with span("push.auto_register"):
+            try:
+                new_uuid = str(uuid.uuid4())
+                supabase.table('employees').insert({
+                    "id": new_uuid,
+                    "name": f"Staff {zk_id}",
+                    "employee_id_code": zk_id,
+                    "status": "ACTIVE",
+                    "joined_date": datetime.now().strftime("%Y-%m-%d"),
+                    "xarun_id": device_info.get('xarun_id'),
+                    "salary": 0
+                }).execute()
+                logging.info(f"🆕 Auto-registered new user: {zk_id}")
+            except Exception as e:
+                # Handle Race Condition / Duplicate Key
+                if "23505" in str(e) or "duplicate key" in str(e):
+                    logging.warning(f"⚠️ User {zk_id} exists in DB but not in cache. Loading it.")
+                else:
+                    logging.error(f"❌ Failed to auto-register {zk_id}: {e}")
+                    return None
+            emp = load_single_employee(zk_id)
 
-    emp = employee_cache.get(zk_id)
     if not emp: 
         logging.error(f"❌ Could not resolve employee {zk_id}")
         return False
@@ -219,256 +567,310 @@ def push_attendance(user_id, timestamp, device_info):
     ip_addr = device_info.get('ip_address', 'Unknown')
 
     try:
-        # Check today's record
-        existing = supabase.table('attendance').select("*").eq("employee_id", emp['uuid']).eq("date", date_str).execute()
-        
-        if not existing.data:
-            # === CLOCK IN (First Scan of the Day) ===
-            check_in_time = timestamp.strftime("%H:%M:%S")
-            status = 'PRESENT'
-            notes = 'On Time'
-
-            # Dynamic Thresholds from Cache
-            late_time = emp.get('late_threshold', '08:00:00')
-            absent_time = emp.get('absent_threshold', '09:00:00')
-
-            if check_in_time >= absent_time:
-                status = 'LATE'
-                notes = 'Very Late (After Absent Threshold)'
-            elif check_in_time >= late_time:
-                status = 'LATE'
-                notes = 'Late Arrival'
-
-            data = {
-                "id": str(uuid.uuid4()),
-                "employee_id": emp['uuid'],
-                "date": date_str,
-                "status": status,
-                "clock_in": iso_time,
-                "device_id": f"{dev_name} ({ip_addr})",
-                "device_uuid": device_info.get('id'),
-                "notes": notes
-            }
-            supabase.table('attendance').insert(data).execute()
-            logging.info(f"✅ CLOCK IN: {emp['name']} ({zk_id}) at {timestamp.strftime('%H:%M')}")
-            return True
+        lock = open_day.lock_for(emp['uuid'])
+        with span("push.lock_wait"):
+            lock.acquire()
+        try:
+            for _ in range(2):
+                # Today's record comes from memory; misses and past dates read the DB
+                with span("push.get_record"):
+                    record = open_day.get_record(supabase, emp['uuid'], date_str)
 
-        else:
-            # === CLOCK OUT (Update Last Scan) ===
-            record = existing.data[0]
-            record_id = record['id']
-            
-            # Prevent rapid duplicate scans (debounce 2 mins)
-            last_action_time = record.get('clock_out') or record.get('clock_in')
-            if last_action_time:
-                try:
-                    last_dt = datetime.fromisoformat(last_action_time.replace('Z', '+00:00'))
-                    # make timestamp aware if needed, or naive
-                    ts_naive = timestamp.replace(tzinfo=None)
-                    last_naive = last_dt.replace(tzinfo=None)
-                    time_diff = (ts_naive - last_naive).total_seconds()
-                    
-                    if time_diff < 120: 
-                        return False
-                except: pass
-
-            update_payload = {
-                "clock_out": iso_time,
-                "device_id": f"{dev_name} ({ip_addr})",
-                "device_uuid": device_info.get('id')
-            }
-            
-            supabase.table('attendance').update(update_payload).eq('id', record_id).execute()
-            logging.info(f"👋 CLOCK OUT Updated: {emp['name']} at {timestamp.strftime('%H:%M')}")
-            return True
+                if not record:
+                    # === CLOCK IN (First Scan of the Day) ===
+                    # Dynamic Thresholds from Cache
+                    status, notes = classify_clock_in(timestamp.strftime("%H:%M:%S"), emp)
+
+                    data = {
+                        "id": str(uuid.uuid4()),
+                        "employee_id": emp['uuid'],
+                        "date": date_str,
+                        "status": status,
+                        "clock_in": iso_time,
+                        "device_id": f"{dev_name} ({ip_addr})",
+                        "device_uuid": device_info.get('id'),
+                        "notes": notes
+                    }
+                    with span("push.clock_in_insert"):
+                        supabase.table('attendance').insert(data).execute()
+                    open_day.remember(emp['uuid'], date_str, {"id": data['id'], "clock_in": iso_time, "clock_out": None})
+                    logging.info(f"✅ CLOCK IN: {emp['name']} ({zk_id}) at {timestamp.strftime('%H:%M')}")
+                    record_commit(device_info, timestamp, source)
+                    return True
+
+                # === CLOCK OUT (Update Last Scan) ===
+                record_id = record['id']
+                
+                # Prevent rapid duplicate scans (debounce 2 mins). The row may be stale;
+                # the UPDATE below re-checks both rules in the database.
+                last_action_time = record.get('clock_out') or record.get('clock_in')
+                if last_action_time:
+                    try:
+                        last_dt = datetime.fromisoformat(last_action_time.replace('Z', '+00:00'))
+                        # make timestamp aware if needed, or naive
+                        ts_naive = timestamp.replace(tzinfo=None)
+                        last_naive = last_dt.replace(tzinfo=None)
+                        time_diff = (ts_naive - last_naive).total_seconds()
+                        
+                        if time_diff < 120: 
+                            return False
+                    except: pass
+
+                update_payload = {
+                    "clock_out": iso_time,
+                    "device_id": f"{dev_name} ({ip_addr})",
+                    "device_uuid": device_info.get('id')
+                }
+                
+                with span("push.clock_out_update"):
+                    updated = open_day.clock_out(supabase, emp['uuid'], date_str, record_id, update_payload, debounce=120)
+                if updated:
+                    logging.info(f"👋 CLOCK OUT Updated: {emp['name']} at {timestamp.strftime('%H:%M')}")
+                    record_commit(device_info, timestamp, source)
+                    return True
+
+                # Row changed (later clock_out) or was removed by someone else -> re-read and decide again
+            return None
+        finally:
+            lock.release()
 
     except Exception as e:
         logging.error(f"DB Error processing attendance: {e}")
-        return False
+        return None
 
-def refresh_employee_cache():
-    if not supabase: return
-    global employee_cache
+def load_employee_directory():
+    # Use the view that includes shift info (keyset-paginated, compact entries)
+    directory = load_directory(supabase)
+    threading.Thread(target=employee_snapshot.save, args=(directory,), name="Thread-Snapshot", daemon=True).start()
+    return directory
+
+def load_employee_snapshot():
+    """Startup: last saved directory into the cache before Supabase answers."""
+    directory = employee_snapshot.load()
+    if directory:
+        employee_cache.load_snapshot(directory)
+
+def load_single_employee(zk_id):
+    """Fetches one employee (e.g. right after auto-register) instead of reloading everyone."""
     try:
-        # Use the view that includes shift info
-        response = supabase.table('employee_shift_view').select("*").execute()
-        new_cache = {}
-        for row in response.data:
-            key_code = str(row.get('employee_id_code'))
-            new_cache[key_code] = {
-                'uuid': row['employee_id'], 
-                'name': row['name'],
-                'late_threshold': row.get('late_threshold', '08:00:00'),
-                'absent_threshold': row.get('absent_threshold', '09:00:00')
-            }
-        employee_cache = new_cache
-        logging.info(f"🔄 Cache Refreshed: {len(employee_cache)} employees.")
+        res = supabase.table('employee_shift_view').select("*").eq('employee_id_code', zk_id).limit(1).execute()
     except Exception as e:
         logging.error(f"Cache Error: {e}")
+        return None
+    if not res.data:
+        return None
+    emp = EmployeeEntry.from_row(res.data[0])
+    employee_cache.put(zk_id, emp)
+    return emp
 
-def sync_device_users(conn, device_info):
+def refresh_employee_cache():
+    """Scheduled / post-sync full reload (joins an in-flight reload if there is one)."""
     if not supabase: return
+    if employee_cache.refresh(force=True) and shard_supervisor:
+        shard_supervisor.broadcast_cache()
+
+def sync_device_users(conn, device_info, progress=None):
+    """Adds device users missing from employees. Raises on failure (a /sync-users job then fails)."""
     try:
+        if not supabase:
+            raise RuntimeError("Database not connected")
         logging.info(f"👤 Syncing users from {device_info.get('name')}...")
         device_users = conn.get_users()
+        if progress: progress(downloaded=len(device_users))
         if not device_users: return
 
-        res = supabase.table('employees').select("id, employee_id_code, name").execute()
-        existing_map = {str(e['employee_id_code']): e for e in res.data}
-        
-        updates_count = 0
-        new_count = 0
-        
         xarun_id = device_info.get('xarun_id') 
         if not xarun_id:
              xr = supabase.table('xarumo').select('id').limit(1).execute()
              if xr.data: xarun_id = xr.data[0]['id']
 
-        for user in device_users:
-            raw_id = str(user.user_id)
-            raw_name = user.name.strip().replace('\x00', '') if user.name else ""
-            
-            if raw_id in existing_map:
-                db_emp = existing_map[raw_id]
-                # Update name if device has a name and DB has placeholder
-                if raw_name and ("Staff" in db_emp['name'] or "Worker" in db_emp['name'] or not db_emp['name']):
-                    try:
-                        supabase.table('employees').update({"name": raw_name}).eq("id", db_emp['id']).execute()
-                        updates_count += 1
-                    except Exception as e:
-                        logging.error(f"Error updating user {raw_id}: {e}")
-            else:
-                display_name = raw_name if raw_name else f"Staff {raw_id}"
-                
-                try:
-                    supabase.table('employees').insert({
-                        "id": str(uuid.uuid4()),
-                        "name": display_name,
-                        "employee_id_code": raw_id,
-                        "finger_id": user.uid,
-                        "position": "STAFF",
-                        "status": "ACTIVE",
-                        "joined_date": datetime.now().strftime("%Y-%m-%d"),
-                        "xarun_id": xarun_id,
-                        "salary": 0,
-                        "avatar": f"https://api.dicebear.com/7.x/avataaars/svg?seed={raw_id}"
-                    }).execute()
-                    new_count += 1
-                except Exception as e:
-                    # Handle duplicate key if race condition occurred
-                    if "23505" in str(e) or "duplicate key" in str(e):
-                        logging.warning(f"⚠️ Skipping duplicate user insert for {raw_id}")
-                    else:
-                        logging.error(f"❌ Failed to insert user {raw_id}: {e}")
+        # Diff in memory, then bulk insert new users / batch-rename placeholder names
+        result = sync_user_diff(supabase, device_users, xarun_id, placeholder="Staff", only_placeholders=True)
+        new_count = result['inserted']
+        updates_count = result['renamed']
+        if result['failed']:
+            logging.error(f"❌ User Sync: {result['failed']} users could not be written.")
+        
+        if progress: progress(processed=len(device_users), written=new_count + updates_count)
         
         if new_count > 0 or updates_count > 0:
-            logging.info(f"✅ Sync: {new_count} New Users, {updates_count} Names Updated.")
+            logging.info(f"✅ Sync: {new_count} New Users, {updates_count} Names Updated ({result['requests']} requests).")
             refresh_employee_cache()
+        return result
 
     except Exception as e:
         logging.error(f"⚠️ User Sync Failed: {e}")
+        raise
 
-def run_auto_absent_check():
+def absent_off_days():
+    return parse_off_days(os.getenv('ABSENT_OFF_DAYS', 'Friday'))
+
+def run_auto_absent_check(force=False):
+    """Every minute: marks ABSENT the employees whose shift absent_threshold has passed (see absent_engine.py)."""
     if not supabase: return
-    logging.info("⏰ Running Auto-Absent Check...")
+    if force:
+        logging.info("⏰ Running Auto-Absent Check...")
+    if not len(employee_cache):
+        employee_cache.refresh()
     try:
-        now = datetime.now()
-        # 1. Check if today is Friday (4) - Skip if so
-        if now.weekday() == 4: # Python weekday: Mon=0, Fri=4
-             logging.info("📅 Today is Friday (Off Day). Skipping Absent Check.")
-             return
+        with span("absent.tick"):
+            marked = absent_engine.tick(supabase, employee_cache.data, open_day, absent_off_days(), force=force)
+        if force and marked is None:
+            logging.info("⏳ Auto-Absent Check already running.")
+    except Exception as e:
+        logging.error(f"❌ Auto-Absent Check Failed: {e}")
 
-        today_str = now.strftime("%Y-%m-%d")
-        
-        # 2. Get All Active Employees
-        emps_res = supabase.table('employees').select("id, name").eq('status', 'ACTIVE').execute()
-        all_emps = emps_res.data or []
-        if not all_emps: return
-
-        # 3. Get Today's Attendance
-        att_res = supabase.table('attendance').select("employee_id").eq('date', today_str).execute()
-        present_ids = {r['employee_id'] for r in att_res.data or []}
-        
-        # 4. Identify Missing
-        absent_list = []
-        for emp in all_emps:
-            if emp['id'] not in present_ids:
-                absent_list.append({
-                    "id": str(uuid.uuid4()),
-                    "employee_id": emp['id'],
-                    "date": today_str,
-                    "status": "ABSENT",
-                    "notes": "Auto-marked at 9:00 AM",
-                    "device_id": "SYSTEM-AUTO"
-                })
-        
-        # 5. Bulk Insert
-        if absent_list:
-            supabase.table('attendance').insert(absent_list).execute()
-            logging.info(f"✅ Marked {len(absent_list)} employees as ABSENT.")
+def scan_debounce_seconds():
+    return float(os.getenv('SCAN_DEBOUNCE_SECONDS', LIVE_DEBOUNCE_SECONDS))
+
+class LiveDevice:
+    """
+    Per-connection state of one monitored device, shared by the thread
+    monitor and the async engine: startup catch-up, live punches, the log
+    watermark and the hooks for manual jobs served on the connection.
+    """
+    def __init__(self, device):
+        self.device = device
+        self.name = device.get('name', 'Unknown')
+        self.watermark = None
+        self.live_pushed = 0
+        self.live_ok = False
+
+    def start(self, conn):
+        """Blocking: user sync + offline logs after (re)connecting."""
+        with span("live.start", device=self.device['ip_address']): # also tags the log records
+            self._start(conn)
+
+    def _start(self, conn):
+        self.watermark = None
+        self.live_pushed = 0
+        device_connects.inc(device=self.device['ip_address'])
+        if not supabase:
+            # Offline start: live punches queue in the outbox; the catch-up runs on this connection later
+            catchup_deferred[self.device['ip_address']] = self.device
+            self.live_ok = False
+            logging.info(f"📴 {self.name}: Supabase not connected yet. Listening now, offline logs follow once it is.")
+            startup.mark("first_device_live")
+            return
+        try:
+            sync_device_users(conn, self.device)
+        except Exception:
+            pass # logged; monitoring goes on, the next connect retries
+
+        logging.info(f"📥 Syncing offline logs for {self.name}...")
+        try:
+            started = time.perf_counter()
+            cutoff_date = datetime.now() - timedelta(days=7)
+            downloaded, new_count, written, self.watermark, _ = push_new_device_logs(conn, self.device, cutoff_date)
+            logging.info(f"📥 {self.name}: {downloaded} logs on device, {new_count} new, {written} written.",
+                         extra={"duration_ms": round((time.perf_counter() - started) * 1000)})
+        except Exception as e:
+            logging.error(f"Offline log sync failed for {self.name}: {e}")
+
+        # Live punches only go to the local outbox (the writer thread
+        # pushes them). Once queued they are safe, so the watermark moves
+        # and the next reconnect does not replay them. Not while the
+        # catch-up stopped at a failed write: moving it would skip those.
+        self.live_ok = self.caught_up()
+        logging.info(f"✅ MONITOR ACTIVE: {self.name} - Listening...")
+        startup.mark("first_device_live")
+
+    def handle(self, event):
+        if not (event and event.user_id):
+            return
+        ip = self.device['ip_address']
+        window = scan_debounce_seconds()
+        if not scan_debouncer.admit(event.user_id, event.timestamp, ip, window):
+            scans_debounced.inc(device=ip) # repeat within the window: nothing to write
         else:
-            logging.info("✅ Everyone is present! No absences marked.")
+            try:
+                outbox.append(event.user_id, event.timestamp, self.device)
+            except Exception as e:
+                logging.error(f"❌ Outbox write failed, pushing directly: {e}")
+                if push_live_attendance(event.user_id, event.timestamp, self.device) is None:
+                    self.live_ok = False
+                    return # not persisted: a re-scan must not count as its repeat
+            scan_debouncer.record(event.user_id, event.timestamp, ip, window)
+        if self.live_ok:
+            self.watermark = advance_watermark(self.watermark, [event])
+            self.live_pushed += 1
 
-    except Exception as e:
-        logging.error(f"❌ Auto-Absent Check Failed: {e}")
+    def lost(self, error):
+        logging.error(f"Link lost {self.name}: {error}", extra={"device": self.device['ip_address']})
+        device_link_lost.inc(device=self.device['ip_address'])
+
+    # Hooks for manual jobs served on this connection (see zk_session)
+    def on_pause(self, conn):
+        self.save() # the job starts from what live already queued
+
+    def on_gap(self, conn):
+        downloaded, new_count, written, _, _ = push_new_device_logs(conn, self.device)
+        logging.info(f"📥 {self.name}: {new_count} punches made during the manual job, {written} written.")
+
+    def on_resume(self, conn):
+        self.watermark = load_watermark(supabase, self.device)
+        self.live_ok = self.caught_up()
+
+    def caught_up(self):
+        """True if the watermark may follow live punches: it exists and no catch-up stopped short."""
+        return self.watermark is not None and self.device['ip_address'] not in catchup_pending
+
+    def save(self):
+        if self.live_pushed:
+            save_watermark(supabase, self.watermark)
+            self.live_pushed = 0
 
 def monitor_single_device(device):
     ip = device['ip_address']
     port = device.get('port', 4370)
-    zk = ZK(ip, port=port, timeout=30, force_udp=False, ommit_ping=True)
-    dev_name = device.get('name', 'Unknown')
+    zk = make_zk(ip, port)
+    owner = zk_sessions.owner(ip)
+    live = LiveDevice(device)
+    bind_log_context(device=ip) # this thread only serves this device
 
     while True:
-        if device_locks.get(ip, False):
-            time.sleep(2)
-            continue
-
         conn = None
-        try:
-            logging.info(f"🔌 Connecting to {dev_name} ({ip})...")
-            conn = zk.connect()
-            active_zk_connections[ip] = conn
-            
-            sync_device_users(conn, device)
-
-            logging.info(f"📥 Syncing offline logs for {dev_name}...")
+        session = None
+        link_lost = False
+        with owner: # a manual sync on its own connection holds this too
             try:
-                logs = conn.get_attendance()
-                cutoff_date = datetime.now() - timedelta(days=7)
-                for log in logs:
-                    if log.timestamp >= cutoff_date:
-                        push_attendance(log.user_id, log.timestamp, device)
-            except: pass
-
-            logging.info(f"✅ MONITOR ACTIVE: {dev_name} - Listening...")
-            
-            for event in conn.live_capture():
-                if device_locks.get(ip, False): break
-                if event and event.user_id:
-                    push_attendance(event.user_id, event.timestamp, device)
-        except Exception as e:
-            if not device_locks.get(ip, False):
-                logging.error(f"Link lost {dev_name}: {e}")
-                time.sleep(10)
-        finally:
-            if ip in active_zk_connections: del active_zk_connections[ip]
-            if conn: 
-                try: conn.disconnect()
-                except: pass
-        time.sleep(5)
+                logging.info(f"🔌 Connecting to {live.name} ({ip})...")
+                conn = zk.connect()
+                session = zk_sessions.attach(ip, conn)
+                live.start(conn)
+                for event in conn.live_capture(new_timeout=LIVE_POLL_SECONDS):
+                    live.handle(event)
+                    session.serve(live.on_pause, live.on_resume, live.on_gap)
+            except Exception as e:
+                live.lost(e)
+                link_lost = True
+            finally:
+                live.save()
+                if session: zk_sessions.detach(ip, session)
+                if conn: 
+                    try: conn.disconnect()
+                    except: pass
+        # Sleep without holding the device, so a manual sync can use it
+        time.sleep(15 if link_lost else 5)
+
+def load_active_devices():
+    if not supabase:
+        return device_snapshot.load() or [] # offline start: the last known list
+    res = supabase.table('devices').select("*").eq('is_active', True).execute()
+    devices = res.data or []
+    device_snapshot.save(devices)
+    
+    # If no devices in DB, default to config
+    if not devices and not active_devices and not async_engine:
+         devices = [{'name': 'Default', 'ip_address': '192.168.100.201', 'port': 4370, 'id': None, 'xarun_id': None}]
+    return devices
 
 def start_monitors():
-    if not supabase: 
-        if not init_supabase(): return 
+    if async_engine:
+        return # the engine re-reads the devices table itself
 
     try:
-        res = supabase.table('devices').select("*").eq('is_active', True).execute()
-        devices = res.data or []
-        
-        # If no devices in DB, default to config
-        if not devices and not active_devices:
-             devices = [{'name': 'Default', 'ip_address': '192.168.100.201', 'port': 4370, 'id': None, 'xarun_id': None}]
-
+        devices = load_active_devices()
         for dev in devices:
             if dev['ip_address'] in active_devices: continue
             t = threading.Thread(target=monitor_single_device, args=(dev,), name=f"Thread-{dev['name']}")
@@ -478,34 +880,146 @@ def start_monitors():
     except Exception as e:
         logging.error(f"Start Monitor Error: {e}")
 
-def main():
-    print("--- SMARTSTOCK SERVICE ---")
-    
-    # 1. DELAY FOR NETWORK (Important for Startup)
-    logging.info("⏳ Starting Up... Waiting 20s for Network/Wi-Fi...")
-    time.sleep(20)
-    
-    # 2. Init DB
-    if init_supabase():
-        refresh_employee_cache()
+# --- ASYNC ENGINE (MONITOR_ENGINE=async in .env) ---
+# All devices on one event loop instead of a thread per device (see async_engine)
+async_engine = None
+# --- SHARDS (MONITOR_SHARDS=N in .env): devices split across N processes ---
+shard_supervisor = None
+
+def start_async_engine(load_devices=None):
+    global async_engine
+    from async_engine import AsyncDeviceEngine
+    async_engine = AsyncDeviceEngine(
+        make_zk=lambda dev: make_zk(dev['ip_address'], dev.get('port', 4370)),
+        make_state=LiveDevice,
+        load_devices=load_devices or load_active_devices,
+        sessions=zk_sessions
+    )
+    async_engine.start_in_thread()
+    logging.info("⚡ Async device engine started.")
+
+def start_shard_supervisor(shards):
+    global shard_supervisor
+    from shard_supervisor import ShardSupervisor
+    shard_supervisor = ShardSupervisor(shards, load_active_devices, lambda: employee_cache.data)
+    shard_supervisor.start()
+    shard_supervisor.refresh()
+
+def refresh_devices():
+    """Scheduled: pick up added / deactivated devices."""
+    if shard_supervisor:
+        shard_supervisor.refresh()
+    else:
         start_monitors()
+
+def start_device_monitoring():
+    shards = int(os.getenv('MONITOR_SHARDS', '1') or 1)
+    if shards > 1:
+        if not shard_supervisor: start_shard_supervisor(shards)
+    elif os.getenv('MONITOR_ENGINE', 'threads') == 'async':
+        if not async_engine: start_async_engine()
     else:
-        logging.error("❌ Critical: Failed to connect to Database. Monitor will retry.")
+        start_monitors()
 
-    schedule.every(30).minutes.do(refresh_employee_cache)
-    schedule.every().day.at("09:00").do(run_auto_absent_check)
-    schedule.every(30).seconds.do(start_monitors)
-    
+def warm_open_day():
+    """Startup / midnight: load today's attendance rows into memory with one query."""
+    if not supabase: return
+    open_day.warm(supabase)
+
+def drain_outbox():
+    """Writer thread: pushes queued live punches to Supabase with retries."""
+    if ledger_enabled() or rpc_ingest_enabled():
+        drain_forever(outbox, push_live_attendance, batch_handler=lambda punches: write_punches(punches, 'live')[0])
+    else:
+        drain_forever(outbox, push_live_attendance)
+
+def catch_up_deferred():
+    """After Supabase connects: offline logs of devices that went live without it (on their live connection)."""
+    cutoff_date = datetime.now() - timedelta(days=7)
+    for ip, device in list(catchup_deferred.items()):
+        def catch_up(conn, device=device):
+            return push_new_device_logs(conn, device, cutoff_date)
+        try:
+            downloaded, new_count, written, _, _ = zk_sessions.run(
+                ip, catch_up, manual_connect(ip, device.get('port', 4370)), covers_logs=True)
+            catchup_deferred.pop(ip, None)
+            logging.info(f"📥 {device.get('name', ip)}: {downloaded} logs on device, {new_count} new, {written} written.")
+        except Exception as e:
+            logging.error(f"Offline log sync failed for {device.get('name', ip)}: {e}") # the next reconnect retries
+
+def on_supabase_connected():
+    threading.Thread(target=warm_caches, name="Thread-Warmup", daemon=True).start()
+    with startup.phase("devices"):
+        start_device_monitoring()
+    if catchup_deferred:
+        threading.Thread(target=catch_up_deferred, name="Thread-CatchUp", daemon=True).start()
+
+def connect_cloud():
+    """Startup thread: waits for the network, connects Supabase, then caches / devices / catch-ups."""
+    try:
+        # Only as long as Supabase is unreachable (was a fixed 20s sleep)
+        with startup.phase("network"):
+            wait_for_network(os.getenv('SUPABASE_URL'))
+        with startup.phase("supabase"):
+            connected = init_supabase()
+        if connected:
+            on_supabase_connected()
+        else:
+            logging.error("❌ Critical: Failed to connect to Database. Monitor will retry.")
+    finally:
+        cloud_attempted.set()
+
+def warm_caches():
+    """Employee directory + today's attendance, off the startup path (misses wait on the single-flight reload)."""
+    with startup.phase("employee_cache"):
+        refresh_employee_cache()
+    with startup.phase("open_day"):
+        warm_open_day()
+
+def start_api():
     # Run API on port 5050 to match React App config
-    threading.Thread(target=lambda: app.run(host='0.0.0.0', port=5050, debug=False, use_reloader=False), daemon=True).start()
+    threading.Thread(target=lambda: app.run(host='0.0.0.0', port=5050, debug=False, use_reloader=False),
+                     name="Thread-API", daemon=True).start()
+
+def main():
+    print("--- SMARTSTOCK SERVICE ---")
+
+    # 1. API first: the dashboard sees the service (and /logs) while it starts
+    with startup.phase("api"):
+        start_api()
+
+    with startup.phase("employee_snapshot"):
+        load_employee_snapshot()
+
+    # Start draining punches queued before the last shutdown
+    with startup.phase("outbox"):
+        open_outbox()
+    threading.Thread(target=drain_outbox, name="Thread-Outbox", daemon=True).start()
+
+    # 2. Devices from the last known list right away: punches queue in the outbox,
+    #    so a cold boot without network still captures
+    load_config()
+    with startup.phase("devices_offline"):
+        start_device_monitoring()
+
+    # 3. Network probe + Supabase in the background, then caches, new devices, catch-ups
+    threading.Thread(target=connect_cloud, name="Thread-Connect", daemon=True).start()
+    logging.info(f"🚀 Startup finished in {time.perf_counter() - process_started:.2f}s.")
+
+    schedule.every(30).minutes.do(refresh_employee_cache)
+    schedule.every(1).minutes.do(run_auto_absent_check)
+    schedule.every().day.at("00:00").do(warm_open_day)
+    schedule.every(30).seconds.do(refresh_devices)
+    schedule.every(5).minutes.do(apply_pending_ledger)
 
     while True: 
         schedule.run_pending()
         # Retry connection if failed initially
-        if not supabase:
-            init_supabase()
-            if supabase: start_monitors()
+        if not supabase and cloud_attempted.is_set():
+            if init_supabase():
+                on_supabase_connected()
         time.sleep(5)
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # shard workers in the frozen .exe
     main()
@@ -4,8 +4,12 @@ from flask_cors import CORS
 from zk import ZK
 from supabase import create_client, Client
 import os
-import uuid
 from datetime import datetime
+from attendance_fold import fold_punches, merge_days, reconcile_days
+from sync_watermark import load_watermark, save_watermark, check_buffer, WatermarkCursor
+from attendance_stream import stream_attendance
+from employee_directory import fetch_all
+from user_sync import sync_users as sync_user_diff
 
 # ==========================================
 # CONFIGURATION
@@ -83,51 +87,21 @@ def sync_users():
         device_users = conn.get_users()
         print(f"Found {len(device_users)} users on device.")
 
-        # 2. Get Existing Employees from Supabase (Fetch all for mapping)
-        # Note: Large tables might need pagination, but for < 1000 this works
-        existing_emps_res = supabase.table('employees').select("id, employee_id_code, name").execute()
-        existing_map = {e['employee_id_code']: e for e in existing_emps_res.data}
-
-        # 3. Sync
-        for user in device_users:
-            user_id_str = str(user.user_id)
-            device_name = user.name.strip() if user.name else f"Worker {user_id_str}"
-
-            if user_id_str not in existing_map:
-                # INSERT NEW
-                new_emp = {
-                    "id": str(uuid.uuid4()),
-                    "name": device_name,
-                    "employee_id_code": user_id_str,
-                    "finger_id": user.uid,
-                    "position": "STAFF",
-                    "status": "ACTIVE",
-                    "joined_date": datetime.now().strftime("%Y-%m-%d"),
-                    "xarun_id": valid_xarun_id,
-                    "avatar": f"https://api.dicebear.com/7.x/avataaars/svg?seed={user_id_str}",
-                    "salary": 0
-                }
-                try:
-                    supabase.table('employees').insert(new_emp).execute()
-                    new_count += 1
-                    print(f"Inserted: {device_name}")
-                except Exception as e:
-                    if "23505" in str(e) or "duplicate key" in str(e):
-                        print(f"Skipping duplicate ID {user_id_str} (Race Condition)")
-                    else:
-                        print(f"Insert Error for {user_id_str}: {e}")
-            else:
-                # UPDATE EXISTING if name changed
-                current_db_emp = existing_map[user_id_str]
-                if user.name and current_db_emp['name'] != device_name:
-                    supabase.table('employees').update({"name": device_name}).eq('id', current_db_emp['id']).execute()
-                    updated_count += 1
-                    print(f"Updated Name: {current_db_emp['name']} -> {device_name}")
+        # 2. Diff against the employees directory in memory, then write in bulk
+        # (one multi-row insert for new users, one batched upsert for renamed ones)
+        result = sync_user_diff(supabase, device_users, valid_xarun_id)
+        new_count = result['inserted']
+        updated_count = result['renamed']
+        for old_name, new_name in result['renames']:
+            print(f"Updated Name: {old_name} -> {new_name}")
+        print(f"User sync: {new_count} inserted, {updated_count} renamed, {result['unchanged']} unchanged, "
+              f"{result['failed']} failed ({result['requests']} requests).")
 
         conn.enable_device()
         return jsonify({
             "success": True, 
-            "message": f"Sync Complete! Added {new_count} new, Updated {updated_count} names."
+            "message": f"Sync Complete! Added {new_count} new, Updated {updated_count} names.",
+            "summary": {k: v for k, v in result.items() if k != 'renames'}
         })
 
     except Exception as e:
@@ -144,14 +118,12 @@ def sync_logs():
     ip = data.get('ip', DEFAULT_ZK_IP)
     port = int(data.get('port', DEFAULT_ZK_PORT))
 
-    # Get Device UUID from DB if possible
-    device_uuid = None
-    try:
-        dev_res = supabase.table('devices').select('id').eq('ip_address', ip).execute()
-        if dev_res.data:
-            device_uuid = dev_res.data[0]['id']
-    except Exception as e:
-        print(f"Device Lookup Error: {e}")
+    # Send "full": true to ignore the watermark and re-reconcile the whole buffer
+    full_sync = bool(data.get('full', False))
+
+    # Get Device UUID + log watermark from DB if possible
+    watermark = load_watermark(supabase, {'ip_address': ip})
+    device_uuid = watermark['device_id'] if watermark else None
 
     zk = ZK(ip, port=port, timeout=10)
     conn = None
@@ -162,110 +134,57 @@ def sync_logs():
         conn = zk.connect()
         conn.disable_device()
         
-        logs = conn.get_attendance()
-        print(f"Found {len(logs)} logs on device.")
-
         # Fetch employees for mapping ZK ID to Supabase UUID (using shift view)
-        employees_res = supabase.table('employee_shift_view').select("*").execute()
-        zk_id_to_emp = {e['employee_id_code']: e for e in employees_res.data}
-
-        # Fetch existing attendance for today to avoid duplicates and handle clock_out
-        # We might need to fetch more than just today if we want to sync historical logs
-        # For simplicity, let's fetch all attendance records that might be relevant
-        # or just handle them one by one. Handling one by one is safer for large datasets
-        # but slower. Let's optimize by grouping logs by date.
-        
-        inserted_count = 0
-        updated_count = 0
-
-        # Sort logs by timestamp to ensure we process them in order
-        sorted_logs = sorted(logs, key=lambda x: x.timestamp)
-
-        for log in sorted_logs:
-            user_id_str = str(log.user_id)
-            
-            if user_id_str not in zk_id_to_emp:
-                continue
-
-            emp = zk_id_to_emp[user_id_str]
-            emp_uuid = emp['id']
-            log_date = log.timestamp.strftime("%Y-%m-%d")
-            log_time_iso = log.timestamp.isoformat()
-            
-            # Check if record exists for this employee on this date
-            check = supabase.table('attendance') \
-                .select("*") \
-                .eq("employee_id", emp_uuid) \
-                .eq("date", log_date) \
-                .execute()
-
-            if not check.data:
-                # === CLOCK IN ===
-                check_in_time = log.timestamp.strftime("%H:%M:%S")
-                status = 'PRESENT'
-                notes = 'On Time'
-                
-                # Dynamic Thresholds
-                late_time = emp.get('late_threshold', '08:00:00')
-                absent_time = emp.get('absent_threshold', '09:00:00')
-
-                if check_in_time >= absent_time:
-                    status = 'LATE'
-                    notes = 'Very Late (After Absent Threshold)'
-                elif check_in_time >= late_time:
-                    status = 'LATE'
-                    notes = 'Late Arrival'
-
-                new_attendance = {
-                    "id": str(uuid.uuid4()),
-                    "employee_id": emp['employee_id'],
-                    "date": log_date,
-                    "status": status,
-                    "clock_in": log_time_iso,
-                    "device_id": f"ZK Device ({ip})",
-                    "device_uuid": device_uuid,
-                    "notes": notes
-                }
-                try:
-                    supabase.table('attendance').insert(new_attendance).execute()
-                    inserted_count += 1
-                    print(f"Clock In: {emp['name']} at {log.timestamp}")
-                except Exception as e:
-                    print(f"Error inserting log for {emp['name']}: {e}")
-            else:
-                # === CLOCK OUT (Update) ===
-                record = check.data[0]
-                record_id = record['id']
-                
-                # Update clock_out if this log is later than current clock_in
-                # and later than current clock_out (if any)
-                current_clock_in = record.get('clock_in')
-                current_clock_out = record.get('clock_out')
-                
-                should_update = False
-                if current_clock_in:
-                    # Convert to comparable format if needed, but isoformat is usually fine for string comparison if same timezone
-                    if log_time_iso > current_clock_in:
-                        if not current_clock_out or log_time_iso > current_clock_out:
-                            should_update = True
-                
-                if should_update:
-                    try:
-                        update_data = {
-                            "clock_out": log_time_iso,
-                            "device_id": f"ZK Device ({ip})",
-                            "device_uuid": device_uuid
-                        }
-                        supabase.table('attendance').update(update_data).eq('id', record_id).execute()
-                        updated_count += 1
-                        print(f"Clock Out Updated: {emp['name']} at {log.timestamp}")
-                    except Exception as e:
-                        print(f"Error updating clock_out for {emp['name']}: {e}")
+        employees = fetch_all(supabase, 'employee_shift_view', "*", key='employee_id')
+        zk_id_to_emp = {e['employee_id_code']: e for e in employees}
+
+        # Stream the buffer; punches before the watermark are dropped while
+        # downloading and every chunk is folded into one first-in / last-out
+        # map per (employee, date). It is reconciled once at the end: a buffer
+        # that is not in time order (clock reset, merged buffers) can hold an
+        # earlier punch of a day in a later chunk, and the clock-in of a row
+        # already written is never moved earlier
+        start = None if (full_sync or not watermark) else watermark['last_at']
+        base = dict(watermark, last_at=None, seq=0) if (full_sync and watermark) else watermark
+        cursor = WatermarkCursor(base)
+        stream_stats = {}
+        days = {}
+        first_new = None
+        unknown_count = 0
+        for chunk in stream_attendance(conn, start=start, stats=stream_stats):
+            new_logs = cursor.new_logs(chunk)
+            # Punches of users missing from employees are counted and passed
+            # over (only the monitor auto-registers users); they never hold
+            # the watermark, or one deleted user would pin it for good
+            known = [log for log in new_logs if str(log.user_id) in zk_id_to_emp]
+            unknown_count += len(new_logs) - len(known)
+            merge_days(days, fold_punches(known, zk_id_to_emp))
+            cursor.committed(new_logs)
+            if new_logs and (first_new is None or new_logs[0].timestamp < first_new.timestamp):
+                first_new = new_logs[0]
+        check_buffer(watermark, conn.records)
+        totals = reconcile_days(supabase, days, f"ZK Device ({ip})", device_uuid)
+        # Failed writes -> the watermark stays before every punch of this sync
+        if totals['failed'] and first_new:
+            cursor.blocked([first_new])
+        inserted_count = totals['inserted']
+        updated_count = totals['updated']
+        print(f"Found {stream_stats.get('records', 0)} logs on device ({stream_stats.get('scanned', 0)} downloaded, {cursor.new} new since last sync).")
+        print(f"Reconciled {len(days)} employee-days: {inserted_count} clock-ins, {updated_count} clock-outs, {totals['skipped']} unchanged.")
+        if unknown_count:
+            print(f"Skipped {unknown_count} punches of device users that are not in employees.")
+
+        new_watermark = cursor.result(conn.records)
+        if cursor.blocked_at is not None:
+            print(f"Watermark held at {cursor.blocked_at}: attendance writes failed, the next sync retries them.")
+        save_watermark(supabase, new_watermark)
 
         conn.enable_device()
         return jsonify({
             "success": True, 
-            "message": f"Processed {len(logs)} logs. Created {inserted_count} new, Updated {updated_count} clock-outs."
+            "new_logs": cursor.new,
+            "unknown_users": unknown_count,
+            "message": f"Processed {stream_stats.get('records', 0)} logs ({cursor.new} new). Created {inserted_count} new, Updated {updated_count} clock-outs."
         })
 
     except Exception as e:
@@ -0,0 +1,361 @@
+
+import asyncio
+import logging
+import threading
+import zlib
+from struct import unpack
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from zk import const
+from zk.attendance import Attendance
+from zk_session import LIVE_POLL_SECONDS
+
+# ==========================================
+# ASYNCIO MULTI-DEVICE ENGINE
+# ==========================================
+# One event loop runs every device session as a coroutine instead of one
+# OS thread per device:
+# - Blocking pyzk calls (connect, user sync, log download, manual jobs)
+#   run on a small shared executor (ZK_THREADS).
+# - Live capture does not park a thread in recv(): after reg_event the
+#   device socket is switched to non-blocking and read by the loop
+#   (loop.sock_recv). Events are parsed and acked here, the same way pyzk's
+#   live_capture does it (TCP only; UDP devices keep a blocking reader on
+#   the executor).
+# - Punches go through one shared async write path: per-device ordered
+#   asyncio queues drained by WRITERS consumers that run the (blocking)
+#   write handler on a separate small executor.
+#
+# Per-connection logic (startup catch-up, watermark, outbox) comes from the
+# caller through a state factory (advanced_monitor.LiveDevice).
+
+ZK_THREADS = 8
+WRITE_THREADS = 4
+WRITERS = 4
+WRITE_QUEUE_SIZE = 1000
+DEVICE_REFRESH_SECONDS = 60
+RECONNECT_DELAY = 5
+LINK_LOST_DELAY = 15
+TCP_TOP_SIZE = 8
+
+def ack_packet(conn):
+    """CMD_ACK_OK for a realtime event (pyzk ZK.__ack_ok, TCP framing)."""
+    buf = conn._ZK__create_header(const.CMD_ACK_OK, b'', conn._ZK__session_id, const.USHRT_MAX - 1)
+    return conn._ZK__create_tcp_top(buf)
+
+def decode_timehex(timehex):
+    year, month, day, hour, minute, second = unpack("6B", timehex)
+    return datetime(year + 2000, month, day, hour, minute, second)
+
+def parse_events(data, uid_by_user_id):
+    """Attendance records in one CMD_REG_EVENT payload (same layouts as pyzk live_capture)."""
+    events = []
+    while len(data) >= 12:
+        if len(data) == 12:
+            user_id, status, punch, timehex = unpack('<IBB6s', data)
+            data = data[12:]
+        elif len(data) == 32:
+            user_id, status, punch, timehex = unpack('<24sBB6s', data[:32])
+            data = data[32:]
+        elif len(data) == 36:
+            user_id, status, punch, timehex, _other = unpack('<24sBB6s4s', data[:36])
+            data = data[36:]
+        elif len(data) >= 52:
+            user_id, status, punch, timehex, _other = unpack('<24sBB6s20s', data[:52])
+            data = data[52:]
+        else:
+            logging.warning(f"⚠️ Unknown realtime event layout ({len(data)} bytes), skipped.")
+            break
+        if isinstance(user_id, int):
+            user_id = str(user_id)
+        else:
+            user_id = (user_id.split(b'\x00')[0]).decode(errors='ignore')
+        uid = uid_by_user_id.get(user_id)
+        if uid is None:
+            uid = int(user_id) if user_id.isdigit() else 0
+        events.append(Attendance(user_id, decode_timehex(timehex), status, punch, uid))
+    return events
+
+def split_frames(buffer):
+    """Cuts complete TCP frames off buffer. Returns (frames, rest)."""
+    frames = []
+    while len(buffer) >= TCP_TOP_SIZE:
+        length = unpack('<HHI', buffer[:TCP_TOP_SIZE])[2]
+        end = TCP_TOP_SIZE + length
+        if len(buffer) < end:
+            break
+        frames.append(buffer[TCP_TOP_SIZE:end])
+        buffer = buffer[end:]
+    return frames, buffer
+
+class AsyncPunchWriter:
+    """
+    Shared write path: per-key ordered queues, blocking handler on a small executor.
+    Queues are shared by keys, so idle(key) waits on a per-key pending count,
+    not on the queue (other devices keep it busy).
+    """
+    def __init__(self, handler, writers=WRITERS, queue_size=WRITE_QUEUE_SIZE, threads=WRITE_THREADS):
+        self.handler = handler
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="Async-Write")
+        self.queues = [asyncio.Queue(maxsize=queue_size) for _ in range(writers)]
+        self.tasks = []
+        self.pending = {} # key -> punches queued or being written
+        self.idle_events = {} # key -> asyncio.Event, set when its pending drops to 0
+        self.written = 0
+        self.errors = 0
+        self.max_depth = 0
+
+    def start(self):
+        self.tasks = [asyncio.ensure_future(self._drain(q)) for q in self.queues]
+
+    def queue_for(self, key):
+        return self.queues[zlib.crc32(str(key).encode()) % len(self.queues)]
+
+    async def put(self, key, *args):
+        q = self.queue_for(key)
+        self.pending[key] = self.pending.get(key, 0) + 1
+        event = self.idle_events.get(key)
+        if event is not None:
+            event.clear()
+        try:
+            await q.put((key, args)) # back-pressure on the device reader when full
+        except BaseException:
+            self._done(key)
+            raise
+        depth = self.depth()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def depth(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def _done(self, key):
+        left = self.pending.get(key, 1) - 1
+        if left > 0:
+            self.pending[key] = left
+            return
+        self.pending.pop(key, None)
+        event = self.idle_events.pop(key, None)
+        if event is not None:
+            event.set()
+
+    async def idle(self, key):
+        """Waits until every punch queued for key is written."""
+        if not self.pending.get(key):
+            return
+        event = self.idle_events.get(key)
+        if event is None:
+            event = self.idle_events[key] = asyncio.Event()
+        await event.wait()
+
+    async def _drain(self, q):
+        loop = asyncio.get_running_loop()
+        while True:
+            key, args = await q.get()
+            try:
+                await loop.run_in_executor(self.executor, self.handler, *args)
+                self.written += 1
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"Async write failed: {e}")
+            finally:
+                self._done(key)
+                q.task_done()
+
+    def stats(self):
+        return {"queue_depth": self.depth(), "max_depth": self.max_depth,
+                "written": self.written, "errors": self.errors}
+
+class AsyncDeviceEngine:
+    """
+    Runs all device sessions on one event loop (in its own thread).
+    make_zk(device) -> ZK, make_state(device) -> object with start(conn),
+    handle(event), lost(error), on_pause/on_resume/on_gap(conn) and save().
+    load_devices() -> list of device rows (blocking, called on the executor).
+    """
+    def __init__(self, make_zk, make_state, load_devices, sessions, zk_threads=ZK_THREADS):
+        self.make_zk = make_zk
+        self.make_state = make_state
+        self.load_devices = load_devices
+        self.sessions = sessions
+        self.zk_executor = ThreadPoolExecutor(max_workers=zk_threads, thread_name_prefix="Async-ZK")
+        self.loop = None
+        self.writer = None
+        self.tasks = {}   # ip -> asyncio.Task
+        self.stopping = {} # ip -> cancelled Task still closing its session
+        self.events = 0
+        self.connects = 0
+        self.thread = None
+        self.wakeup = None
+
+    # --- lifecycle ---
+    def start_in_thread(self):
+        self.thread = threading.Thread(target=self.run, name="Thread-AsyncEngine", daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def run(self):
+        asyncio.run(self.main())
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.writer = AsyncPunchWriter(lambda state, event: state.handle(event))
+        self.writer.start()
+        self.wakeup = asyncio.Event()
+        while True:
+            try:
+                devices = await self.blocking(self.load_devices)
+                self.sync_tasks(devices)
+            except Exception as e:
+                logging.error(f"Async engine device refresh failed: {e}")
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), DEVICE_REFRESH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+
+    def refresh_now(self):
+        """Thread-safe: re-read the device list without waiting for the next refresh."""
+        if self.loop and self.wakeup:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def sync_tasks(self, devices):
+        wanted = {d['ip_address']: d for d in devices}
+        for ip, task in list(self.tasks.items()):
+            if ip not in wanted or task.done():
+                task.cancel()
+                del self.tasks[ip]
+                if not task.done():
+                    self.stopping[ip] = task
+                    task.add_done_callback(lambda t, ip=ip: self.stopping.pop(ip, None) if self.stopping.get(ip) is t else None)
+                logging.info(f"⏹️ Async engine stopped session for {ip}.")
+        for ip, device in wanted.items():
+            if ip not in self.tasks:
+                self.tasks[ip] = asyncio.ensure_future(self.run_device(device))
+
+    def running(self, ip):
+        """Thread-safe enough for polling: True while a session task for ip exists or is still closing."""
+        return ip in self.tasks or ip in self.stopping
+
+    async def blocking(self, fn, *args):
+        return await self.loop.run_in_executor(self.zk_executor, fn, *args)
+
+    # --- one device ---
+    async def acquire_owner(self, owner):
+        while not owner.acquire(blocking=False):
+            await asyncio.sleep(1)
+
+    async def run_device(self, device):
+        ip = device['ip_address']
+        zk = self.make_zk(device)
+        state = self.make_state(device)
+        owner = self.sessions.owner(ip)
+        while True:
+            conn = None
+            session = None
+            link_lost = False
+            await self.acquire_owner(owner)
+            try:
+                logging.info(f"🔌 Connecting to {state.name} ({ip})...")
+                conn = await self.blocking(zk.connect)
+                self.connects += 1
+                session = self.sessions.attach(ip, conn)
+                await self.blocking(state.start, conn)
+                if conn.tcp:
+                    await self.capture_tcp(conn, session, state)
+                else:
+                    await self.capture_blocking(conn, session, state)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                state.lost(e)
+                link_lost = True
+            finally:
+                if session: self.sessions.detach(ip, session)
+                if conn:
+                    await self.writer_idle(ip)
+                    await self.loop.run_in_executor(self.zk_executor, self.close, conn, state)
+                owner.release()
+            await asyncio.sleep(LINK_LOST_DELAY if link_lost else RECONNECT_DELAY)
+
+    def close(self, conn, state):
+        try:
+            conn._ZK__sock.setblocking(True)
+        except Exception:
+            pass
+        state.save()
+        try: conn.disconnect()
+        except: pass
+
+    def begin_live(self, conn):
+        """Blocking part of pyzk live_capture: returns {user_id: uid}."""
+        users = conn.get_users()
+        conn.cancel_capture()
+        conn.verify_user()
+        if not conn.is_enabled:
+            conn.enable_device()
+        conn.reg_event(const.EF_ATTLOG)
+        return {u.user_id: u.uid for u in users}
+
+    def serve(self, session, state, sock):
+        """Blocking: runs borrowed jobs with the socket back in blocking mode."""
+        sock.setblocking(True)
+        try:
+            session.serve(state.on_pause, state.on_resume, state.on_gap)
+        finally:
+            sock.setblocking(False)
+
+    async def capture_tcp(self, conn, session, state):
+        uid_by_user_id = await self.blocking(self.begin_live, conn)
+        sock = conn._ZK__sock
+        sock.setblocking(False)
+        ack = ack_packet(conn)
+        buffer = b''
+        while True:
+            try:
+                chunk = await asyncio.wait_for(self.loop.sock_recv(sock, 4096), LIVE_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                chunk = None
+            if chunk == b'':
+                raise ConnectionError("Device closed the connection")
+            if chunk:
+                buffer += chunk
+                frames, buffer = split_frames(buffer)
+                for frame in frames:
+                    await self.loop.sock_sendall(sock, ack)
+                    header = unpack('<4H', frame[:8])
+                    if header[0] != const.CMD_REG_EVENT:
+                        continue
+                    for event in parse_events(frame[8:], uid_by_user_id):
+                        self.events += 1
+                        await self.writer.put(session.ip, state, event)
+            if session.pending:
+                await self.writer_idle(session.ip)
+                await self.blocking(self.serve, session, state, sock)
+
+    async def writer_idle(self, ip):
+        """Waits until this device's queued punches are written (watermark is current)."""
+        await self.writer.idle(ip)
+
+    async def capture_blocking(self, conn, session, state):
+        """UDP fallback: iterate pyzk's live_capture on the executor."""
+        capture = conn.live_capture(new_timeout=LIVE_POLL_SECONDS)
+        while True:
+            event = await self.blocking(next, capture, None)
+            if event:
+                self.events += 1
+                await self.writer.put(session.ip, state, event)
+            if session.pending:
+                await self.writer_idle(session.ip)
+                await self.blocking(session.serve, state.on_pause, state.on_resume, state.on_gap)
+
+    def stats(self):
+        return {
+            "devices": len(self.tasks),
+            "live_sessions": len(self.sessions.connected_ips()),
+            "events": self.events,
+            "connects": self.connects,
+            "zk_threads": self.zk_executor._max_workers,
+            "writer": self.writer.stats() if self.writer else None,
+            "threads_total": threading.active_count()
+        }
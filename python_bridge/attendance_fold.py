@@ -0,0 +1,318 @@
+
+import uuid
+import logging
+from datetime import datetime
+from itertools import repeat
+from operator import attrgetter
+
+# ==========================================
+# BATCHED ATTENDANCE RECONCILIATION
+# ==========================================
+# Instead of a SELECT + INSERT/UPDATE per punch, all punches are folded in
+# memory into first-in / last-out per (employee, date). The existing rows of
+# those employees for the date window are read with a few keyset-paged queries
+# and only the rows that actually change are written back in bulk.
+
+DEFAULT_LATE_THRESHOLD = '08:00:00'
+DEFAULT_ABSENT_THRESHOLD = '09:00:00'
+
+# Notes written on clock-in, per sync source (matches the old per-punch loops)
+LIVE_NOTES = {
+    'on_time': 'On Time',
+    'late': 'Late Arrival',
+    'very_late': 'Very Late (After Absent Threshold)'
+}
+
+HISTORY_NOTES = {
+    'on_time': 'Device History Sync',
+    'late': 'Late Arrival (History Sync)',
+    'very_late': 'Very Late (History Sync)'
+}
+
+CLOCK_IN_CLASSES = ('on_time', 'late', 'very_late')
+
+PAGE_SIZE = 1000   # PostgREST default max-rows
+ID_CHUNK = 100     # employee ids per in_() filter (keeps the request URL short)
+WRITE_CHUNK = 500  # Rows per bulk insert / upsert request
+COLUMNAR_MIN_LOGS = 5000 # Below this the plain loop is just as fast
+EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+def clock_in_class(check_in_time, emp):
+    """'on_time' / 'late' / 'very_late' for a first scan at check_in_time ('HH:MM:SS')."""
+    late_time = emp.get('late_threshold') or DEFAULT_LATE_THRESHOLD
+    absent_time = emp.get('absent_threshold') or DEFAULT_ABSENT_THRESHOLD
+
+    if check_in_time >= absent_time:
+        return 'very_late'
+    elif check_in_time >= late_time:
+        return 'late'
+    return 'on_time'
+
+def classify_clock_in(check_in_time, emp, notes=LIVE_NOTES):
+    """Returns (status, notes) for a first scan at check_in_time ('HH:MM:SS')."""
+    klass = clock_in_class(check_in_time, emp)
+    return ('PRESENT' if klass == 'on_time' else 'LATE'), notes[klass]
+
+def is_later(candidate_iso, clock_in, clock_out):
+    """Same rule the per-punch loops used: later than clock_in and any clock_out."""
+    if not clock_in:
+        return False
+    if candidate_iso <= clock_in:
+        return False
+    return not clock_out or candidate_iso > clock_out
+
+def fold_punches(logs, emp_map, start_date=None):
+    """
+    Folds raw device logs into { (employee_uuid, 'YYYY-MM-DD'): [emp, first_ts, last_ts] }.
+    Logs for unknown users or older than start_date are dropped.
+    """
+    days = {}
+    for log in logs:
+        ts = log.timestamp
+        if start_date and ts < start_date:
+            continue
+
+        emp = emp_map.get(str(log.user_id))
+        if not emp:
+            continue
+
+        key = (emp['employee_id'], ts.date().isoformat())
+        day = days.get(key)
+        if day is None:
+            days[key] = [emp, ts, ts]
+        elif ts < day[1]:
+            day[1] = ts
+        elif ts > day[2]:
+            day[2] = ts
+    return days
+
+def _threshold_secs(value, default):
+    parts = str(value or default).split(':')
+    hours = int(parts[0])
+    minutes = int(parts[1]) if len(parts) > 1 else 0
+    seconds = int(float(parts[2])) if len(parts) > 2 else 0
+    return hours * 3600 + minutes * 60 + seconds
+
+def fold_punches_columnar(logs, emp_map, start_date=None):
+    """
+    NumPy version of fold_punches for large dumps (All Time history).
+    Logs become columns (employee index, epoch seconds), are grouped per
+    (employee, day) with one sort + min/max reduceat, and the clock-in
+    threshold rule is applied to all groups at once. Returns the same dict
+    as fold_punches with the clock-in class as a 4th element.
+    """
+    import numpy as np
+
+    if not logs:
+        return {}
+
+    # 1. Employee index per ZK code (codes sharing an employee share an index)
+    emps = []
+    uuid_index = {}
+    code_index = {}
+    for code, emp in emp_map.items():
+        idx = uuid_index.get(emp['employee_id'])
+        if idx is None:
+            idx = uuid_index[emp['employee_id']] = len(emps)
+            emps.append(emp)
+        code_index[str(code)] = idx
+
+    # 2. Columns (map() keeps the per-record work in C; converting datetimes
+    #    through np.array(..., 'datetime64') is several times slower)
+    n = len(logs)
+    user_ids = map(str, map(attrgetter('user_id'), logs))
+    emp_idx = np.fromiter(map(code_index.get, user_ids, repeat(-1)), dtype=np.int64, count=n)
+    stamps = list(map(attrgetter('timestamp'), logs))
+    secs = (np.fromiter(map(datetime.toordinal, stamps), dtype=np.int64, count=n) - EPOCH_ORDINAL) * 86400
+    secs += np.fromiter(map(attrgetter('hour'), stamps), dtype=np.int64, count=n) * 3600
+    secs += np.fromiter(map(attrgetter('minute'), stamps), dtype=np.int64, count=n) * 60
+    secs += np.fromiter(map(attrgetter('second'), stamps), dtype=np.int64, count=n)
+    del stamps
+
+    mask = emp_idx >= 0
+    if start_date:
+        mask &= secs >= np.datetime64(start_date, 's').astype(np.int64)
+    emp_idx = emp_idx[mask]
+    secs = secs[mask]
+    if not len(secs):
+        return {}
+
+    # 3. Group by (employee, day) -> first / last punch
+    day = secs // 86400
+    first_day = day.min()
+    key = emp_idx * (day.max() - first_day + 1) + (day - first_day)
+    order = np.argsort(key, kind='stable')
+    key = key[order]
+    secs = secs[order]
+    starts = np.flatnonzero(np.concatenate(([True], key[1:] != key[:-1])))
+    first = np.minimum.reduceat(secs, starts)
+    last = np.maximum.reduceat(secs, starts)
+    group_emp = emp_idx[order][starts]
+    group_day = day[order][starts]
+
+    # 4. Threshold classification for every group at once
+    late_secs = np.array([_threshold_secs(e.get('late_threshold'), DEFAULT_LATE_THRESHOLD) for e in emps], dtype=np.int64)
+    absent_secs = np.array([_threshold_secs(e.get('absent_threshold'), DEFAULT_ABSENT_THRESHOLD) for e in emps], dtype=np.int64)
+    time_of_day = first - group_day * 86400
+    rank = np.where(time_of_day >= absent_secs[group_emp], 2,
+                    np.where(time_of_day >= late_secs[group_emp], 1, 0))
+
+    # 5. Back to the dict shape plan_changes expects
+    unique_days, day_pos = np.unique(group_day, return_inverse=True)
+    day_names = unique_days.astype('datetime64[D]').astype(str).tolist()
+    first_dt = first.astype('datetime64[s]').astype(object).tolist()
+    last_dt = last.astype('datetime64[s]').astype(object).tolist()
+    classes = [CLOCK_IN_CLASSES[r] for r in rank.tolist()]
+    days = {}
+    for e, d, f, l, c in zip(group_emp.tolist(), day_pos.tolist(), first_dt, last_dt, classes):
+        emp = emps[e]
+        days[(emp['employee_id'], day_names[d])] = [emp, f, l, c]
+    return days
+
+numpy_missing_logged = False
+
+def fold_punches_fast(logs, emp_map, start_date=None):
+    """Uses the NumPy fold for large inputs (numpy is in requirements.txt)."""
+    global numpy_missing_logged
+    if len(logs) >= COLUMNAR_MIN_LOGS:
+        try:
+            return fold_punches_columnar(logs, emp_map, start_date)
+        except ImportError:
+            if not numpy_missing_logged:
+                numpy_missing_logged = True
+                logging.warning("⚠️ NumPy not installed (pip install -r requirements.txt); folding punches in pure Python.")
+    return fold_punches(logs, emp_map, start_date)
+
+def merge_days(days, more):
+    """Merges a folded chunk into days (keeps the earliest first / latest last punch)."""
+    for key, day in more.items():
+        current = days.get(key)
+        if current is None:
+            days[key] = day
+            continue
+        if day[1] < current[1]:
+            current[1] = day[1]
+            if len(day) > 3:
+                current[3:] = day[3:] # clock-in class follows the first punch
+            elif len(current) > 3:
+                del current[3:]
+        if day[2] > current[2]:
+            current[2] = day[2]
+    return days
+
+def fetch_attendance_window(supabase, start_date, end_date, employee_ids=None):
+    """
+    Reads existing attendance for the date window, keyed by (employee_id, date).
+    employee_ids is filtered on the server (ID_CHUNK ids per in_()); pages go by
+    id (keyset, like employee_directory.fetch_pages), never by OFFSET.
+    """
+    existing = {}
+    if employee_ids is None:
+        chunks = [None]
+    else:
+        ids = sorted(employee_ids)
+        chunks = [ids[i:i + ID_CHUNK] for i in range(0, len(ids), ID_CHUNK)]
+    for chunk in chunks:
+        last = None
+        while True:
+            query = supabase.table('attendance') \
+                .select("id, employee_id, date, clock_in, clock_out") \
+                .gte("date", start_date) \
+                .lte("date", end_date)
+            if chunk is not None:
+                query = query.in_("employee_id", chunk)
+            if last is not None:
+                query = query.gt("id", last)
+            batch = query.order("id").limit(PAGE_SIZE).execute().data or []
+            for row in batch:
+                # Keep the first row per day, like the old `check.data[0]`
+                existing.setdefault((row['employee_id'], row['date']), row)
+            if len(batch) < PAGE_SIZE:
+                break
+            last = batch[-1]['id']
+    return existing
+
+def plan_changes(days, existing, device_label, device_uuid, notes=LIVE_NOTES):
+    """Splits folded days into (new rows to insert, clock-out rows to upsert, skipped count)."""
+    inserts = []
+    updates = []
+    skipped = 0
+
+    for (emp_uuid, date_str), day in days.items():
+        emp, first_ts, last_ts = day[0], day[1], day[2]
+        record = existing.get((emp_uuid, date_str))
+
+        if not record:
+            # === CLOCK IN (+ CLOCK OUT if there were later punches) ===
+            first_iso = first_ts.isoformat()
+            last_iso = last_ts.isoformat()
+            # Already classified in bulk by fold_punches_columnar?
+            klass = day[3] if len(day) > 3 else clock_in_class(first_ts.strftime("%H:%M:%S"), emp)
+            status, note = ('PRESENT' if klass == 'on_time' else 'LATE'), notes[klass]
+            inserts.append({
+                "id": str(uuid.uuid4()),
+                "employee_id": emp_uuid,
+                "date": date_str,
+                "status": status,
+                "clock_in": first_iso,
+                "clock_out": last_iso if last_iso > first_iso else None,
+                "device_id": device_label,
+                "device_uuid": device_uuid,
+                "notes": note
+            })
+        else:
+            # === CLOCK OUT (only if the last punch moves it forward) ===
+            last_iso = last_ts.isoformat()
+            if is_later(last_iso, record.get('clock_in'), record.get('clock_out')):
+                updates.append({
+                    "id": record['id'],
+                    "employee_id": emp_uuid,
+                    "date": date_str,
+                    "clock_out": last_iso,
+                    "device_id": device_label,
+                    "device_uuid": device_uuid
+                })
+            else:
+                skipped += 1
+
+    return inserts, updates, skipped
+
+def _write_chunks(supabase, rows, upsert=False):
+    """Returns (written, failed) row counts."""
+    written = 0
+    failed = 0
+    for i in range(0, len(rows), WRITE_CHUNK):
+        chunk = rows[i:i + WRITE_CHUNK]
+        try:
+            if upsert:
+                supabase.table('attendance').upsert(chunk, on_conflict='id').execute()
+            else:
+                supabase.table('attendance').insert(chunk).execute()
+            written += len(chunk)
+        except Exception as e:
+            failed += len(chunk)
+            action = "upsert" if upsert else "insert"
+            logging.error(f"❌ Bulk attendance {action} failed ({len(chunk)} rows): {e}")
+    return written, failed
+
+def reconcile_days(supabase, days, device_label, device_uuid, notes=LIVE_NOTES):
+    """
+    Writes folded days to Supabase with a keyset-paged read of those employees plus bulk writes.
+    Returns dict(inserted, updated, skipped, failed).
+    """
+    if not days:
+        return {"inserted": 0, "updated": 0, "skipped": 0, "failed": 0}
+
+    dates = [date_str for _, date_str in days]
+    employee_ids = {emp_uuid for emp_uuid, _ in days}
+    existing = fetch_attendance_window(supabase, min(dates), max(dates), employee_ids)
+
+    inserts, updates, skipped = plan_changes(days, existing, device_label, device_uuid, notes)
+    inserted, failed_inserts = _write_chunks(supabase, inserts)
+    updated, failed_updates = _write_chunks(supabase, updates, upsert=True)
+    return {
+        "inserted": inserted,
+        "updated": updated,
+        "skipped": skipped,
+        "failed": failed_inserts + failed_updates
+    }
@@ -0,0 +1,169 @@
+
+import logging
+from struct import pack, unpack, iter_unpack
+from datetime import datetime
+from zk import const
+from zk.attendance import Attendance
+from zk.exception import ZKErrorResponse
+
+# ==========================================
+# STREAMING ATTENDANCE DOWNLOAD
+# ==========================================
+# conn.get_attendance() pulls the whole device buffer, turns every record
+# into an Attendance object and only then lets us filter. This reader does
+# the same protocol steps as pyzk's read_with_buffer, but parses each
+# 64KB chunk as soon as it arrives, drops records outside the date range /
+# user set while they are still raw ints, and yields small lists. Peak
+# memory follows chunk_size, not the device buffer size.
+#
+# It relies on pyzk 0.9 internals (name-mangled ZK.__send_command etc.).
+# If they are missing it falls back to get_attendance() + filtering.
+
+READ_BUFFER_CMD = 1503 # ZK6 "read with buffer"
+RECORD_FORMATS = {
+    8: '<HBIB',        # uid, status, time, punch
+    16: '<IIBB2sI',    # user_id, time, status, punch, reserved, workcode
+    40: '<H24sBIB8s'   # uid, user_id, status, time, punch, reserved
+}
+
+def encode_time(t):
+    """Same packing the device uses (pyzk ZK.__encode_time); ordering is preserved."""
+    return (
+        ((t.year % 100) * 12 * 31 + ((t.month - 1) * 31) + t.day - 1) *
+        (24 * 60 * 60) + (t.hour * 60 + t.minute) * 60 + t.second
+    )
+
+def decode_time(t):
+    second = t % 60
+    t = t // 60
+    minute = t % 60
+    t = t // 60
+    hour = t % 24
+    t = t // 24
+    day = t % 31 + 1
+    t = t // 31
+    month = t % 12 + 1
+    t = t // 12
+    return datetime(t + 2000, month, day, hour, minute, second)
+
+def can_stream(conn):
+    return all(hasattr(conn, name) for name in (
+        '_ZK__send_command', '_ZK__read_chunk', '_ZK__recieve_raw_data', '_ZK__data'
+    ))
+
+def _raw_chunks(conn, command):
+    """read_with_buffer, one chunk at a time."""
+    max_chunk = 0xFFc0 if conn.tcp else 16 * 1024
+    cmd_response = conn._ZK__send_command(READ_BUFFER_CMD, pack('<bhii', 1, command, 0, 0), 1024)
+    if not cmd_response.get('status'):
+        raise ZKErrorResponse("RWB Not supported")
+
+    if cmd_response['code'] == const.CMD_DATA:
+        # Small buffer: it all came back with the first reply
+        data = conn._ZK__data
+        if conn.tcp and len(data) < (conn._ZK__tcp_length - 8):
+            data = data + conn._ZK__recieve_raw_data((conn._ZK__tcp_length - 8) - len(data))
+        yield data
+        return
+
+    size = unpack('I', conn._ZK__data[1:5])[0]
+    start = 0
+    while start < size:
+        step = min(max_chunk, size - start)
+        yield conn._ZK__read_chunk(start, step)
+        start += step
+    conn.free_data()
+
+def _fallback(conn, chunk_size, lo, hi, user_ids, stats):
+    logs = conn.get_attendance()
+    stats['scanned'] += len(logs)
+    out = []
+    for log in logs:
+        raw = encode_time(log.timestamp)
+        if (lo is not None and raw < lo) or (hi is not None and raw > hi):
+            continue
+        if user_ids is not None and str(log.user_id) not in user_ids:
+            continue
+        out.append(log)
+        if len(out) >= chunk_size:
+            stats['kept'] += len(out)
+            yield out
+            out = []
+    if out:
+        stats['kept'] += len(out)
+        yield out
+
+def stream_attendance(conn, chunk_size=5000, start=None, end=None, user_ids=None, stats=None):
+    """
+    Yields lists (<= chunk_size) of Attendance records between start and end
+    (datetimes, inclusive) for user_ids (set of ZK user id strings, None = all).
+    stats, if given, receives 'records' (device count), 'scanned' and 'kept'.
+    """
+    stats = stats if stats is not None else {}
+    stats.update({'records': 0, 'scanned': 0, 'kept': 0})
+    lo = encode_time(start) if start else None
+    hi = encode_time(end) if end else None
+
+    conn.read_sizes()
+    stats['records'] = conn.records
+    if conn.records == 0:
+        return
+
+    if not can_stream(conn):
+        logging.warning("⚠️ pyzk internals changed; streaming download unavailable, using get_attendance().")
+        yield from _fallback(conn, chunk_size, lo, hi, user_ids, stats)
+        return
+
+    # 8/16-byte records need the user list to map uid <-> user_id (pyzk does the same)
+    users = conn.get_users()
+    user_id_by_uid = {u.uid: u.user_id for u in users}
+    uid_by_user_id = {u.user_id: u.uid for u in users}
+
+    pending = b''
+    record_size = None
+    fmt = None
+    out = []
+    for raw in _raw_chunks(conn, const.CMD_ATTLOG_RRQ):
+        pending += raw
+        if record_size is None:
+            if len(pending) < 4:
+                continue
+            total_size = unpack('I', pending[:4])[0]
+            record_size = total_size / conn.records
+            record_size = int(record_size) if record_size in (8, 16) else 40
+            fmt = RECORD_FORMATS[record_size]
+            pending = pending[4:]
+
+        usable = len(pending) - (len(pending) % record_size)
+        if not usable:
+            continue
+        block, pending = pending[:usable], pending[usable:]
+        stats['scanned'] += usable // record_size
+
+        for fields in iter_unpack(fmt, block):
+            if record_size == 8:
+                uid, status, t, punch = fields
+                user_id = user_id_by_uid.get(uid, str(uid))
+            elif record_size == 16:
+                user_id, t, status, punch, _, _ = fields
+                user_id = str(user_id)
+                uid = uid_by_user_id.get(user_id, user_id)
+            else:
+                uid, user_id, status, t, punch, _ = fields
+                user_id = (user_id.split(b'\x00')[0]).decode(errors='ignore')
+
+            # Filter while still a raw int / string
+            if (lo is not None and t < lo) or (hi is not None and t > hi):
+                continue
+            if user_ids is not None and user_id not in user_ids:
+                continue
+
+            out.append(Attendance(user_id, decode_time(t), status, punch, uid))
+            if len(out) >= chunk_size:
+                stats['kept'] += len(out)
+                yield out
+                out = []
+
+    if out:
+        stats['kept'] += len(out)
+        yield out
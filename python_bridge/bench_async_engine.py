@@ -0,0 +1,186 @@
+
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import threading
+from struct import pack
+from datetime import datetime
+from zk import ZK, const
+from zk_session import DeviceSession, LIVE_POLL_SECONDS
+from async_engine import AsyncDeviceEngine, AsyncPunchWriter
+
+# ==========================================
+# BENCHMARK: THREAD-PER-DEVICE vs ASYNC ENGINE
+# ==========================================
+# Simulates N idle-ish scanners over socketpairs (no network, no Supabase):
+# every device sends a realtime punch every 1/rate seconds and the bridge
+# side either parks one thread per device in recv() (old monitor) or reads
+# all of them from one event loop (async_engine.capture_tcp).
+# Reports threads, RSS growth per device and event latency.
+#
+#   python bench_async_engine.py --devices 300 --seconds 20 --rate 0.2
+
+def rss_kb():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss // 1024
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def event_frame(user_id):
+    now = datetime.now()
+    timehex = pack('6B', now.year - 2000, now.month, now.day, now.hour, now.minute, now.second)
+    payload = pack('<24sBB6s4s', str(user_id).encode(), 1, 0, timehex, b'\x00' * 4)
+    packet = pack('<4H', const.CMD_REG_EVENT, 0, 0, 0) + payload
+    return pack('<HHI', const.MACHINE_PREPARE_DATA_1, const.MACHINE_PREPARE_DATA_2, len(packet)) + packet
+
+class BenchState:
+    """Stands in for advanced_monitor.LiveDevice; records latency instead of writing."""
+    def __init__(self, name, sent_at, latencies):
+        self.name = name
+        self.sent_at = sent_at
+        self.latencies = latencies
+
+    def handle(self, event):
+        sent = self.sent_at.pop(event.user_id, None)
+        if sent is not None:
+            self.latencies.append(time.perf_counter() - sent)
+
+    def on_pause(self, conn): pass
+    def on_resume(self, conn): pass
+    def on_gap(self, conn): pass
+    def save(self): pass
+
+def device_side(sock, index, rate, stop, sent_at):
+    """The 'scanner': sends a punch every 1/rate s and swallows the ACKs."""
+    sock.settimeout(0.2)
+    seq = 0
+    next_at = time.perf_counter() + (index % 100) / 100.0 / max(rate, 0.001)
+    while not stop.is_set():
+        if time.perf_counter() >= next_at:
+            user_id = f"{index}{seq:04d}"
+            sent_at[user_id] = time.perf_counter()
+            sock.sendall(event_frame(user_id))
+            seq += 1
+            next_at += 1.0 / rate
+        try:
+            sock.recv(64)
+        except (socket.timeout, OSError):
+            pass
+
+def make_conn(sock):
+    conn = ZK('127.0.0.1')
+    conn._ZK__sock = sock
+    conn._ZK__session_id = 0
+    return conn
+
+def bench_threads(pairs, states, stop):
+    """Old model: one thread per device blocked in recv(LIVE_POLL_SECONDS)."""
+    from async_engine import split_frames, parse_events, ack_packet
+    def reader(sock, state):
+        sock.settimeout(LIVE_POLL_SECONDS)
+        ack = ack_packet(make_conn(sock))
+        buffer = b''
+        while not stop.is_set():
+            try:
+                chunk = sock.recv(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            buffer += chunk
+            frames, buffer = split_frames(buffer)
+            for frame in frames:
+                sock.sendall(ack)
+                for event in parse_events(frame[8:], {}):
+                    state.handle(event)
+    for (bridge, _), state in zip(pairs, states):
+        threading.Thread(target=reader, args=(bridge, state), daemon=True).start()
+
+def bench_async(pairs, states, stop, ready):
+    engine = AsyncDeviceEngine(None, None, None, None)
+    engine.begin_live = lambda conn: {}
+
+    async def main():
+        engine.loop = asyncio.get_running_loop()
+        engine.writer = AsyncPunchWriter(lambda state, event: state.handle(event))
+        engine.writer.start()
+        tasks = []
+        for i, ((bridge, _), state) in enumerate(zip(pairs, states)):
+            conn = make_conn(bridge)
+            session = DeviceSession(f"10.0.0.{i}", conn)
+            tasks.append(asyncio.ensure_future(engine.capture_tcp(conn, session, state)))
+        ready.set()
+        while not stop.is_set():
+            await asyncio.sleep(0.2)
+        for task in tasks:
+            task.cancel()
+
+    threading.Thread(target=lambda: asyncio.run(main()), daemon=True).start()
+    ready.wait()
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def run(mode, devices, seconds, rate):
+    pairs = [socket.socketpair() for _ in range(devices)]
+    stop = threading.Event()
+    latencies = []
+    sent_maps = [{} for _ in range(devices)]
+    states = [BenchState(f"dev{i}", sent_maps[i], latencies) for i in range(devices)]
+
+    rss_before = rss_kb()
+    threads_before = threading.active_count()
+    if mode == 'threads':
+        bench_threads(pairs, states, stop)
+    else:
+        bench_async(pairs, states, stop, threading.Event())
+    time.sleep(0.5)
+    threads_bridge = threading.active_count() - threads_before
+    rss_bridge = rss_kb()
+
+    for i, (_, device) in enumerate(pairs):
+        threading.Thread(target=device_side, args=(device, i, rate, stop, sent_maps[i]), daemon=True).start()
+    time.sleep(seconds)
+    stop.set()
+    time.sleep(0.5)
+
+    per_device = None
+    if rss_before is not None and rss_bridge is not None:
+        per_device = (rss_bridge - rss_before) / devices
+    print(f"{mode:8} devices={devices:5} bridge_threads={threads_bridge:5} "
+          f"rss/device={per_device if per_device is None else round(per_device, 1)} KB "
+          f"events={len(latencies):6} p50={percentile(latencies, 0.5) * 1000:.2f}ms "
+          f"p99={percentile(latencies, 0.99) * 1000:.2f}ms")
+    for a, b in pairs:
+        a.close()
+        b.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-device overhead: thread monitor vs async engine")
+    parser.add_argument('--devices', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--rate', type=float, default=0.5, help="punches per second per device")
+    parser.add_argument('--mode', choices=['threads', 'async', 'both'], default='both')
+    args = parser.parse_args()
+    if args.mode == 'both':
+        # Separate processes so the second run does not inherit the first one's memory
+        import subprocess
+        for mode in ('threads', 'async'):
+            subprocess.run([sys.executable, __file__, '--mode', mode, '--devices', str(args.devices),
+                            '--seconds', str(args.seconds), '--rate', str(args.rate)])
+    else:
+        run(args.mode, args.devices, args.seconds, args.rate)
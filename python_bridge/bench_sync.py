@@ -0,0 +1,295 @@
+
+import io
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import tempfile
+import threading
+import contextlib
+from collections import Counter
+from datetime import datetime, timedelta
+from tests.conftest import FakeSupabase, FakeZK, make_users, make_employees
+
+# ==========================================
+# BENCHMARK: SYNC + LIVE PATHS WITH FAKES
+# ==========================================
+# No scanner and no Supabase project needed: the benches run on the same
+# fakes as the tests (tests/conftest.py). FakeZK serves a synthetic device
+# buffer through the protocol calls attendance_stream uses; FakeSupabase
+# keeps tables in memory, counts every request per table/op and sleeps
+# `latency` per request (a round trip to the cloud).
+#
+# Benchmarks:
+#   sync_logs   - app.py POST /sync-logs (stream, fold, reconcile)
+#   sync_users  - advanced_monitor.sync_device_users (diff + bulk writes)
+#   history     - history_sync's chunked stream + fold_punches_fast + reconcile
+#   live        - advanced_monitor.push_attendance throughput / latency
+#   ingest      - the same punches through ingest_punches (INGEST_MODE=rpc);
+#                 FakeSupabase runs a Python copy of the SQL function
+#   ledger      - the same punches through punch_ledger (PUNCH_LEDGER=on), then replayed
+#
+#   python bench_sync.py --scale 100k --latency 40
+#   python bench_sync.py --scale 1m --only history
+#
+# The request counts are the number to watch: a change that makes a path
+# chattier shows up there even with --latency 0.
+
+SCALES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+BENCH_IP = '10.9.9.9'
+
+# --- SYNTHETIC DATA ---
+def make_punches(users, count, days, end=None):
+    """count punches over the last `days` days (working hours), oldest first."""
+    end = end or datetime.now().replace(microsecond=0)
+    start = (end - timedelta(days=days)).replace(hour=0, minute=0, second=0)
+    punches = []
+    for _ in range(count):
+        day = start + timedelta(days=random.randrange(days))
+        ts = day.replace(hour=random.randint(6, 18), minute=random.randrange(60), second=random.randrange(60))
+        punches.append((random.choice(users).user_id, min(ts, end)))
+    punches.sort(key=lambda p: p[1])
+    return punches
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def report(name, seconds, items, db, zk=None, extra=""):
+    rate = items / seconds if seconds else 0
+    print(f"{name:11} {items:>9} items {seconds:8.2f}s {rate:>10.0f}/s  "
+          f"db_requests={db.requests():<6} rows_written={db.rows_written:<8} "
+          f"zk_round_trips={zk.round_trips if zk else 0:<5} {extra}")
+    print(f"{'':11} {db.breakdown()}")
+
+def import_monitor():
+    """
+    advanced_monitor for a bench. Refuses to run unless its log / outbox /
+    employee snapshot point somewhere else than the service's own files.
+    """
+    if 'advanced_monitor' not in sys.modules and not os.environ.get('SMARTSTOCK_STATE_DIR'):
+        raise SystemExit("Set SMARTSTOCK_STATE_DIR to a scratch directory before running benches against advanced_monitor.")
+    import advanced_monitor as am
+    if am.state_dir.resolve() == am.base_dir.resolve():
+        raise SystemExit(f"advanced_monitor uses the service's state files in {am.base_dir}; refusing to run the bench.")
+    return am
+
+# --- BENCHMARKS ---
+def bench_sync_logs(args, users, punches):
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app # (prints its banner)
+    db = FakeSupabase(args.latency)
+    db.seed('employees', make_employees(users))
+    db.seed('devices', [{"id": "dev-1", "ip_address": BENCH_IP, "last_log_at": None}])
+    zk = FakeZK(users, punches, args.zk_latency)
+    app.supabase = db
+    app.ZK = lambda *a, **kw: zk
+    db.reset_counts()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = app.app.test_client().post('/sync-logs', json={'ip': BENCH_IP})
+    elapsed = time.perf_counter() - started
+    report("sync_logs", elapsed, len(punches), db, zk, f"http={response.status_code}")
+
+def bench_sync_users(args, users):
+    am = import_monitor()
+    from metrics import InstrumentedClient
+    db = FakeSupabase(args.latency)
+    # Half already known (a third of those still "Staff N"), half new on the device
+    db.seed('employees', make_employees(users[:len(users) // 2], placeholder_ratio=0.33))
+    am.supabase = InstrumentedClient(db)
+    zk = FakeZK(users, [], args.zk_latency)
+    db.reset_counts()
+    started = time.perf_counter()
+    am.sync_device_users(zk, {'xarun_id': 'x1', 'name': 'bench', 'ip_address': BENCH_IP})
+    elapsed = time.perf_counter() - started
+    report("sync_users", elapsed, len(users), db, zk, "(includes the cache reload)")
+
+def bench_history(args, users, punches):
+    from attendance_stream import stream_attendance
+    from attendance_fold import fold_punches_fast, merge_days, reconcile_days, HISTORY_NOTES
+    from employee_directory import fetch_all
+    db = FakeSupabase(args.latency)
+    db.seed('employees', make_employees(users))
+    zk = FakeZK(users, punches, args.zk_latency)
+    start_date = datetime(2000, 1, 1)
+
+    # Same steps as history_sync.sync_device_logs (which is interactive)
+    started = time.perf_counter()
+    emp_map = {e['employee_id_code']: e for e in fetch_all(db, 'employee_shift_view', "*", key='employee_id')}
+    days = {}
+    stream_stats = {}
+    for chunk in stream_attendance(zk, chunk_size=50000, start=start_date,
+                                   user_ids={str(k) for k in emp_map}, stats=stream_stats):
+        merge_days(days, fold_punches_fast(chunk, emp_map, start_date))
+    folded = time.perf_counter()
+    result = reconcile_days(db, days, f"ZK-{BENCH_IP} (History)", None, HISTORY_NOTES)
+    elapsed = time.perf_counter() - started
+    report("history", elapsed, len(punches), db, zk,
+           f"fold={folded - started:.2f}s days={len(days)} inserted={result['inserted']}")
+
+def live_setup(args, users):
+    """advanced_monitor on a fresh FakeSupabase, plus today's punches a few
+    minutes apart per employee (so clock-outs are not debounced)."""
+    am = import_monitor()
+    from metrics import InstrumentedClient
+    db = FakeSupabase(args.latency)
+    db.seed('employees', make_employees(users))
+    am.supabase = InstrumentedClient(db)
+    am.employee_cache.refresh(force=True)
+    am.open_day.warm(am.supabase)
+
+    now = datetime.now().replace(microsecond=0)
+    base = now.replace(hour=0, minute=0, second=0)
+    per_user = Counter()
+    punches = []
+    for _ in range(args.live):
+        user = random.choice(users)
+        per_user[user.user_id] += 1
+        punches.append((user.user_id, min(base + timedelta(minutes=3 * per_user[user.user_id]), now)))
+    punches.sort(key=lambda p: p[1])
+    return am, db, punches
+
+def bench_live(args, users):
+    am, db, punches = live_setup(args, users)
+    device = {'id': 'dev-1', 'name': 'bench', 'ip_address': BENCH_IP, 'xarun_id': 'x1'}
+
+    latencies = []
+    lock = threading.Lock()
+    def worker(share):
+        for user_id, ts in share:
+            t0 = time.perf_counter()
+            am.push_attendance(user_id, ts, device)
+            with lock:
+                latencies.append(time.perf_counter() - t0)
+
+    db.reset_counts()
+    threads = [threading.Thread(target=worker, args=(punches[i::args.workers], )) for i in range(args.workers)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    report("live", elapsed, len(punches), db, None,
+           f"workers={args.workers} p50={percentile(latencies, 0.5) * 1000:.2f}ms "
+           f"p99={percentile(latencies, 0.99) * 1000:.2f}ms req/punch={db.requests() / max(len(punches), 1):.2f}")
+
+def bench_ingest(args, users):
+    """The same live punches through ingest_punches (INGEST_MODE=rpc), --batch per request."""
+    from punch_ingest import batches
+    am, db, punches = live_setup(args, users)
+    device = {'id': 'dev-1', 'name': 'bench', 'ip_address': BENCH_IP, 'xarun_id': 'x1'}
+    db.reset_counts()
+    written = 0
+    latencies = []
+    started = time.perf_counter()
+    for batch in batches(punches, args.batch):
+        t0 = time.perf_counter()
+        _, batch_written = am.ingest_punches([(user_id, ts, device) for user_id, ts in batch], 'live')
+        latencies.append(time.perf_counter() - t0)
+        written += batch_written
+    elapsed = time.perf_counter() - started
+    report("ingest", elapsed, len(punches), db, None,
+           f"batch={args.batch} written={written} p50/batch={percentile(latencies, 0.5) * 1000:.2f}ms "
+           f"req/punch={db.requests() / max(len(punches), 1):.3f}")
+
+def bench_ledger(args, users):
+    """PUNCH_LEDGER=on: the live punches once, then the same batches replayed (should write nothing)."""
+    from punch_ingest import batches
+    am, db, punches = live_setup(args, users)
+    device = {'id': 'dev-1', 'name': 'bench', 'ip_address': BENCH_IP, 'xarun_id': 'x1'}
+    os.environ['PUNCH_LEDGER'] = 'on'
+    try:
+        for label in ("ledger", "replay"):
+            db.reset_counts()
+            written = 0
+            started = time.perf_counter()
+            for batch in batches(punches, args.batch):
+                _, batch_written = am.write_punches([(user_id, ts, device) for user_id, ts in batch])
+                written += batch_written
+            report(label, time.perf_counter() - started, len(punches), db, None,
+                   f"batch={args.batch} attendance_writes={written} ledger_rows={len(db.rows('punch_ledger'))}")
+    finally:
+        os.environ.pop('PUNCH_LEDGER', None)
+
+def bench_absent(args, users):
+    """Auto-absent ticks through one day: 3 xarumo x 3 shift thresholds, ~60% clocked in
+    (most through the bridge, some written elsewhere so only the DB knows them)."""
+    am = import_monitor()
+    from metrics import InstrumentedClient
+    from absent_engine import AbsentEngine
+    thresholds = ("08:30:00", "09:00:00", "14:00:00")
+    db = FakeSupabase(args.latency)
+    employees = make_employees(users)
+    for i, row in enumerate(employees):
+        row["xarun_id"] = f"x{i % 3 + 1}"
+        row["absent_threshold"] = thresholds[(i // 3) % 3]
+    db.seed('employees', employees)
+    am.supabase = InstrumentedClient(db)
+    am.employee_cache.refresh(force=True)
+
+    day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    date_str = day.strftime("%Y-%m-%d")
+    def attendance(e):
+        return {"id": f"att-{e['id']}", "employee_id": e['id'], "date": date_str,
+                "status": "PRESENT", "clock_in": day.replace(hour=7).isoformat()}
+    present = [e for e in employees if random.random() < 0.6]
+    db.seed('attendance', [attendance(e) for e in present[:len(present) * 5 // 6]])
+    am.open_day.warm(am.supabase)
+    db.seed('attendance', [attendance(e) for e in present[len(present) * 5 // 6:]])
+
+    engine = AbsentEngine()
+    db.reset_counts()
+    started = time.perf_counter()
+    for hour, minute in ((8, 0), (8, 31), (9, 1), (9, 2), (14, 1), (17, 0)):
+        requests = db.requests()
+        t0 = time.perf_counter()
+        marked = engine.tick(am.supabase, am.employee_cache.data, am.open_day, off_days=(),
+                             now=day.replace(hour=hour, minute=minute))
+        print(f"  tick {hour:02}:{minute:02} marked={marked:<6} requests={db.requests() - requests:<4} "
+              f"{(time.perf_counter() - t0) * 1000:.1f}ms")
+    report("absent", time.perf_counter() - started, len(users), db, None,
+           f"marked={engine.marked_total} reads={engine.reads} writes={engine.writes} "
+           f"max_rows/insert={engine.write_chunk}")
+
+BENCHES = ('sync_logs', 'sync_users', 'history', 'live', 'ingest', 'ledger', 'absent')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync / live path benchmarks against in-process fakes")
+    parser.add_argument('--scale', choices=sorted(SCALES), default='1k', help="punches in the device buffer")
+    parser.add_argument('--users', type=int, default=3000, help="users on the device")
+    parser.add_argument('--days', type=int, default=60, help="days the punches are spread over")
+    parser.add_argument('--latency', type=float, default=0.0, help="ms per Supabase request")
+    parser.add_argument('--zk-latency', type=float, default=0.0, help="ms per device round trip")
+    parser.add_argument('--live', type=int, default=2000, help="punches pushed in the live benchmark")
+    parser.add_argument('--workers', type=int, default=4, help="threads pushing live punches (devices)")
+    parser.add_argument('--batch', type=int, default=100, help="punches per ingest_punches request")
+    parser.add_argument('--only', choices=BENCHES, action='append', help="run only these (repeatable)")
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+    args.latency /= 1000.0
+    args.zk_latency /= 1000.0
+    random.seed(args.seed)
+    logging.disable(logging.WARNING) # the services log every write
+
+    users = make_users(args.users)
+    punches = make_punches(users, SCALES[args.scale], args.days)
+    print(f"scale={args.scale} punches={len(punches)} users={len(users)} "
+          f"db_latency={args.latency * 1000:.0f}ms zk_latency={args.zk_latency * 1000:.0f}ms")
+    selected = args.only or BENCHES
+    # advanced_monitor's log / outbox / employee snapshot go to a throwaway dir, never the real ones
+    state = tempfile.TemporaryDirectory(prefix="bench_state_", ignore_cleanup_errors=True)
+    os.environ['SMARTSTOCK_STATE_DIR'] = state.name
+    if 'sync_logs' in selected: bench_sync_logs(args, users, punches)
+    if 'sync_users' in selected: bench_sync_users(args, users)
+    if 'history' in selected: bench_history(args, users, punches)
+    if 'live' in selected: bench_live(args, users)
+    if 'ingest' in selected: bench_ingest(args, users)
+    if 'ledger' in selected: bench_ledger(args, users)
+    if 'absent' in selected: bench_absent(args, users)
+    sys.exit(0)
@@ -0,0 +1,142 @@
+
+import time
+import logging
+import threading
+
+# ==========================================
+# EMPLOYEE CACHE (SINGLE-FLIGHT REFRESH)
+# ==========================================
+# - Only one full reload runs at a time; concurrent misses wait for it
+#   instead of each re-reading employee_shift_view.
+# - Reloads triggered by misses are rate-limited (min_interval).
+# - IDs still unknown after a reload go into a negative cache for
+#   negative_ttl seconds, so a scanner full of unenrolled IDs cannot keep
+#   forcing reloads.
+
+class EmployeeCache:
+    def __init__(self, loader, min_interval=30, negative_ttl=300):
+        self.loader = loader # () -> { zk_id: employee dict }
+        self.min_interval = min_interval
+        self.negative_ttl = negative_ttl
+        self.data = {}
+        self.negative = {} # zk_id -> expiry time
+        self.cond = threading.Condition()
+        self.refreshing = False
+        self.generation = 0
+        self.last_refresh = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+        self.last_load_seconds = None
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, zk_id):
+        return zk_id in self.data
+
+    def get(self, zk_id):
+        emp = self.data.get(zk_id)
+        if emp is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return emp
+
+    def put(self, zk_id, emp):
+        """Adds/updates one employee without a full reload."""
+        with self.cond:
+            new_data = dict(self.data)
+            new_data[zk_id] = emp
+            self.data = new_data
+            self.negative.pop(zk_id, None)
+
+    def load_snapshot(self, data):
+        """Installs a directory loaded elsewhere (e.g. by the shard supervisor)."""
+        with self.cond:
+            self.data = dict(data)
+            self.negative.clear()
+            self.generation += 1
+            self.last_refresh = time.time()
+
+    def is_known_missing(self, zk_id):
+        expiry = self.negative.get(zk_id)
+        if expiry is None:
+            return False
+        if expiry < time.time():
+            self.negative.pop(zk_id, None)
+            return False
+        self.negative_hits += 1
+        return True
+
+    def mark_missing(self, zk_id):
+        self.negative[zk_id] = time.time() + self.negative_ttl
+
+    def refresh(self, force=False):
+        """
+        Reloads the whole directory. If a reload is already running, waits for
+        it instead of starting another. Returns True if fresh data is in place.
+        """
+        with self.cond:
+            if self.refreshing:
+                generation = self.generation
+                while self.refreshing:
+                    self.cond.wait()
+                self.coalesced += 1
+                return self.generation != generation
+            if not force and time.time() - self.last_refresh < self.min_interval:
+                self.rate_limited += 1
+                return False
+            self.refreshing = True
+
+        new_data = None
+        started = time.time()
+        try:
+            new_data = self.loader()
+        except Exception as e:
+            logging.error(f"Cache Error: {e}")
+        load_seconds = time.time() - started
+
+        with self.cond:
+            if new_data is not None:
+                self.data = new_data
+                self.negative.clear()
+                self.generation += 1
+                self.refreshes += 1
+                self.last_load_seconds = round(load_seconds, 3)
+            else:
+                self.refresh_errors += 1
+            self.last_refresh = time.time()
+            self.refreshing = False
+            self.cond.notify_all()
+        return new_data is not None
+
+    def resolve(self, zk_id):
+        """Cache lookup that falls back to one (shared, rate-limited) reload on a miss."""
+        emp = self.get(zk_id)
+        if emp is not None or self.is_known_missing(zk_id):
+            return emp
+        self.refresh()
+        emp = self.data.get(zk_id)
+        if emp is None:
+            self.mark_missing(zk_id)
+        return emp
+
+    def stats(self):
+        return {
+            "size": len(self.data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "negative_hits": self.negative_hits,
+            "negative_size": len(self.negative),
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "coalesced": self.coalesced,
+            "rate_limited": self.rate_limited,
+            "last_refresh": self.last_refresh,
+            "last_load_seconds": self.last_load_seconds
+        }
@@ -0,0 +1,97 @@
+
+import sys
+import time
+import logging
+
+# ==========================================
+# EMPLOYEE DIRECTORY (KEYSET PAGINATION)
+# ==========================================
+# PostgREST silently stops at 1000 rows, so a plain select() on employees /
+# employee_shift_view misses everyone after that. fetch_pages() walks the
+# table with keyset pagination (order by key, key > last seen key), which
+# stays fast on later pages unlike OFFSET.
+#
+# The live cache keeps one EmployeeEntry (__slots__, no per-row dict) per
+# ZK id; threshold / xarun / status strings are interned so staff on the same
+# shift share them.
+
+PAGE_SIZE = 1000
+
+def fetch_pages(supabase, table, columns="*", key="id", page_size=PAGE_SIZE, filters=None):
+    """Yields pages (lists of rows) of table ordered by key. filters: [(column, value)] eq filters."""
+    last = None
+    while True:
+        query = supabase.table(table).select(columns)
+        for column, value in (filters or []):
+            query = query.eq(column, value)
+        if last is not None:
+            query = query.gt(key, last)
+        rows = query.order(key).limit(page_size).execute().data or []
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        last = rows[-1][key]
+
+def fetch_all(supabase, table, columns="*", key="id", page_size=PAGE_SIZE, filters=None):
+    rows = []
+    for page in fetch_pages(supabase, table, columns, key, page_size, filters):
+        rows.extend(page)
+    return rows
+
+class EmployeeEntry:
+    """One cached employee. Supports emp['name'] / emp.get('late_threshold') like the old dicts."""
+    __slots__ = ('uuid', 'name', 'late_threshold', 'absent_threshold', 'xarun_id', 'status')
+
+    def __init__(self, uuid, name, late_threshold, absent_threshold, xarun_id=None, status='ACTIVE'):
+        self.uuid = uuid
+        self.name = name
+        self.late_threshold = late_threshold
+        self.absent_threshold = absent_threshold
+        self.xarun_id = xarun_id
+        self.status = status
+
+    @classmethod
+    def from_row(cls, row):
+        late = row.get('late_threshold') or '08:00:00'
+        absent = row.get('absent_threshold') or '09:00:00'
+        xarun_id = row.get('xarun_id')
+        status = row.get('status', 'ACTIVE') # views older than section 4 of database_updates_sync.sql
+        return cls(row['employee_id'], row['name'], sys.intern(str(late)), sys.intern(str(absent)),
+                   sys.intern(xarun_id) if xarun_id else None, sys.intern(status) if status else None)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def __repr__(self):
+        return f"EmployeeEntry({self.uuid!r}, {self.name!r})"
+
+def directory_size(directory):
+    """Rough memory use of {zk_id: EmployeeEntry} in bytes (dict + keys + entries + names)."""
+    total = sys.getsizeof(directory)
+    for zk_id, emp in directory.items():
+        total += sys.getsizeof(zk_id) + sys.getsizeof(emp) + sys.getsizeof(emp.uuid) + sys.getsizeof(emp.name)
+    return total
+
+def load_directory(supabase, page_size=PAGE_SIZE):
+    """Streams employee_shift_view page by page into { zk_id: EmployeeEntry }."""
+    started = time.time()
+    directory = {}
+    pages = 0
+    for page in fetch_pages(supabase, 'employee_shift_view', "*", key='employee_id', page_size=page_size):
+        pages += 1
+        for row in page:
+            directory[str(row.get('employee_id_code'))] = EmployeeEntry.from_row(row)
+    elapsed = time.time() - started
+    logging.info(
+        f"🔄 Cache Refreshed: {len(directory)} employees in {pages} pages, "
+        f"{elapsed:.2f}s, ~{directory_size(directory) / 1024:.0f} KB.",
+        extra={"duration_ms": round(elapsed * 1000)}
+    )
+    return directory
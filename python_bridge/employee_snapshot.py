@@ -0,0 +1,171 @@
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from employee_directory import EmployeeEntry
+
+# ==========================================
+# ON-DISK SNAPSHOT OF THE EMPLOYEE CACHE
+# ==========================================
+# The cache used to start empty and needed a full employee_shift_view fetch
+# before the first scan could be resolved. After every successful reload the
+# directory is written to a small SQLite file next to the exe, and at startup
+# it is loaded back before the network is even up. The background reload
+# then replaces it with fresh data.
+#
+# - Written to a temp file and os.replace()d, so a crash mid-write leaves
+#   the previous snapshot intact.
+# - meta holds the version stamp: format, the stored fields, a
+#   fingerprint of the rows and when they were saved. A snapshot from another
+#   format / field set is ignored, and an unchanged directory is not rewritten.
+#
+# DeviceSnapshot does the same for the active devices list (a small JSON
+# file), so monitoring can start before Supabase is reachable.
+
+SNAPSHOT_FORMAT = 1 # bump when FIELDS changes
+FIELDS = ('uuid', 'name', 'late_threshold', 'absent_threshold', 'xarun_id', 'status')
+
+def fingerprint(rows):
+    digest = hashlib.sha1()
+    for row in rows:
+        digest.update("\x1f".join("" if v is None else str(v) for v in row).encode('utf-8'))
+        digest.update(b"\x1e")
+    return digest.hexdigest()
+
+class EmployeeSnapshot:
+    def __init__(self, path):
+        self.path = str(path)
+        self.lock = threading.Lock()
+        self.version = None # fingerprint of the snapshot on disk
+        self.saved_at = None
+        self.count = 0
+        self.saves = 0
+        self.unchanged = 0
+        self.errors = 0
+        self.loaded = False
+        self.last_load_ms = None
+
+    def load(self):
+        """Returns { zk_id: EmployeeEntry } from disk, or None if there is no usable snapshot."""
+        if not os.path.exists(self.path):
+            return None
+        started = time.perf_counter()
+        try:
+            conn = sqlite3.connect(self.path)
+            try:
+                meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+                if meta.get('format') != str(SNAPSHOT_FORMAT) or meta.get('fields') != ",".join(FIELDS):
+                    logging.warning(f"⚠️ Employee snapshot {self.path} has another format. Ignoring it.")
+                    return None
+                rows = conn.execute(f"SELECT zk_id, {', '.join(FIELDS)} FROM employees").fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            self.errors += 1
+            logging.error(f"❌ Employee snapshot unreadable: {e}")
+            return None
+
+        intern = sys.intern
+        directory = {}
+        for zk_id, emp_uuid, name, late, absent, xarun_id, status in rows:
+            directory[zk_id] = EmployeeEntry(emp_uuid, name, intern(late), intern(absent),
+                                             intern(xarun_id) if xarun_id else None, intern(status) if status else None)
+        self.version = meta.get('version')
+        self.saved_at = float(meta.get('saved_at') or 0)
+        self.count = len(directory)
+        self.loaded = True
+        self.last_load_ms = round((time.perf_counter() - started) * 1000, 1)
+        age = time.time() - self.saved_at
+        logging.info(f"💾 Employee snapshot loaded: {self.count} employees in {self.last_load_ms:.0f}ms (saved {age / 3600:.1f}h ago).")
+        return directory
+
+    def save(self, directory):
+        """Writes the directory unless it matches the snapshot on disk. Returns True if written."""
+        rows = sorted((zk_id, *(getattr(emp, field) for field in FIELDS)) for zk_id, emp in directory.items())
+        version = fingerprint(rows)
+        with self.lock:
+            if version == self.version:
+                self.unchanged += 1
+                return False
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                conn = sqlite3.connect(tmp_path)
+                try:
+                    conn.execute("PRAGMA journal_mode=OFF")
+                    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+                    conn.execute(f"CREATE TABLE employees (zk_id TEXT PRIMARY KEY, {', '.join(f + ' TEXT' for f in FIELDS)})")
+                    conn.executemany(f"INSERT INTO employees VALUES ({', '.join('?' * (len(FIELDS) + 1))})", rows)
+                    saved_at = time.time()
+                    conn.executemany("INSERT INTO meta VALUES (?, ?)", [
+                        ("format", str(SNAPSHOT_FORMAT)), ("fields", ",".join(FIELDS)),
+                        ("version", version), ("saved_at", str(saved_at)), ("count", str(len(rows)))
+                    ])
+                    conn.commit()
+                finally:
+                    conn.close()
+                os.replace(tmp_path, self.path)
+            except (sqlite3.Error, OSError) as e:
+                self.errors += 1
+                logging.error(f"❌ Employee snapshot write failed: {e}")
+                return False
+            self.version = version
+            self.saved_at = saved_at
+            self.count = len(rows)
+            self.saves += 1
+        return True
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "version": self.version[:12] if self.version else None,
+            "saved_at": self.saved_at,
+            "count": self.count,
+            "loaded_at_startup": self.loaded,
+            "last_load_ms": self.last_load_ms,
+            "saves": self.saves,
+            "unchanged": self.unchanged,
+            "errors": self.errors
+        }
+
+class DeviceSnapshot:
+    def __init__(self, path):
+        self.path = str(path)
+        self.lock = threading.Lock()
+        self.version = None
+
+    def load(self):
+        """Returns the device rows saved last, or None."""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                devices = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.error(f"❌ Device snapshot unreadable: {e}")
+            return None
+        logging.info(f"💾 Device snapshot loaded: {len(devices)} devices.")
+        return devices
+
+    def save(self, devices):
+        """Writes the rows unless they match the file on disk. Returns True if written."""
+        data = json.dumps(devices, sort_keys=True, default=str)
+        with self.lock:
+            if data == self.version:
+                return False
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(data)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logging.error(f"❌ Device snapshot write failed: {e}")
+                return False
+            self.version = data
+        return True
@@ -1,12 +1,15 @@
 
 import os
 import sys
-import uuid
+import time
 from datetime import datetime, timedelta
 from zk import ZK
 from supabase import create_client, Client
 from dotenv import load_dotenv
 from pathlib import Path
+from attendance_fold import fold_punches_fast, merge_days, reconcile_days, HISTORY_NOTES
+from attendance_stream import stream_attendance
+from employee_directory import fetch_all
 
 # 1. SETUP & CONFIGURATION
 base_dir = Path(__file__).resolve().parent
@@ -31,8 +34,8 @@ def get_employee_map():
     """
     print("⏳ Soo aqrinaya shaqaalaha database-ka...")
     try:
-        response = supabase.table('employee_shift_view').select("*").execute()
-        return {e['employee_id_code']: e for e in response.data}
+        rows = fetch_all(supabase, 'employee_shift_view', "*", key='employee_id')
+        return {e['employee_id_code']: e for e in rows}
     except Exception as e:
         print(f"❌ Cilad Database: {e}")
         return {}
@@ -67,7 +70,13 @@ def sync_device_logs():
         print("❌ Doorasho qaldan.")
         return
 
-    # 1. Connect to ZK
+    # 1. Get Employee Map (kahor download-ka si loo sifeeyo inta la soo dajinayo)
+    emp_map = get_employee_map()
+    if not emp_map:
+        print("⚠️ Lama helin shaqaale diiwaangashan. Fadlan marka hore 'Sync Users' samee.")
+        return
+
+    # 2. Connect to ZK
     zk = ZK(ZK_IP, port=ZK_PORT, timeout=20, force_udp=False, ommit_ping=False)
     conn = None
     
@@ -76,15 +85,18 @@ def sync_device_logs():
         conn = zk.connect()
         conn.disable_device() # Device-ka xir inta aqrinta socoto
         
+        # Logs-ka waxaa loo soo dajiyaa qeyb-qeyb (chunks); wixii ka horeeya
+        # taariikhda ama aan shaqaale lahayn halkaas ayaa lagaga tagaa,
+        # qeyb walbana isla markiiba waa la isku ururiyaa (fold).
         print("📥 Soo dajinaya logs-ka (wuu yara daahi karaa)...")
-        logs = conn.get_attendance()
-        print(f"✅ Lasoo helay {len(logs)} record aaladda gudaheeda.")
-
-        # 2. Get Employee Map
-        emp_map = get_employee_map()
-        if not emp_map:
-            print("⚠️ Lama helin shaqaale diiwaangashan. Fadlan marka hore 'Sync Users' samee.")
-            return
+        print(f"🔍 Sifeynaya wixii ka dambeeyay: {start_filter_date.strftime('%Y-%m-%d')}")
+        stream_stats = {}
+        days = {}
+        fold_start = time.time()
+        for chunk in stream_attendance(conn, chunk_size=50000, start=start_filter_date,
+                                       user_ids={str(k) for k in emp_map}, stats=stream_stats):
+            merge_days(days, fold_punches_fast(chunk, emp_map, start_filter_date))
+        print(f"✅ Aaladda: {stream_stats['records']} record | La eegay: {stream_stats['scanned']} | La qaatay: {stream_stats['kept']}")
 
         # Get Device UUID
         device_uuid = None
@@ -94,97 +106,15 @@ def sync_device_logs():
                 device_uuid = dev_res.data[0]['id']
         except: pass
 
-        print(f"🔍 Sifeynaya wixii ka dambeeyay: {start_filter_date.strftime('%Y-%m-%d')}")
-        
-        # Sort logs by timestamp for Smart In/Out
-        sorted_logs = sorted(logs, key=lambda x: x.timestamp)
-        
-        count_inserted = 0
-        count_updated = 0
-        count_skipped = 0
-        
-        for log in sorted_logs:
-            # Filter by Date
-            if log.timestamp < start_filter_date:
-                continue
-                
-            user_id_str = str(log.user_id)
-            
-            # Check if user exists in Supabase
-            if user_id_str not in emp_map:
-                continue
-
-            emp = emp_map[user_id_str]
-            emp_uuid = emp['employee_id']
-            log_date_str = log.timestamp.strftime("%Y-%m-%d")
-            log_time_iso = log.timestamp.isoformat()
-            
-            # Logic: Check Duplicate in DB for this day
-            try:
-                check = supabase.table('attendance') \
-                    .select("*") \
-                    .eq("employee_id", emp_uuid) \
-                    .eq("date", log_date_str) \
-                    .execute()
-
-                if not check.data:
-                    # === CLOCK IN ===
-                    check_in_time = log.timestamp.strftime("%H:%M:%S")
-                    status = "PRESENT"
-                    notes = "Device History Sync"
-                    
-                    # Dynamic Thresholds
-                    late_time = emp.get('late_threshold', '08:00:00')
-                    absent_time = emp.get('absent_threshold', '09:00:00')
-
-                    if check_in_time >= absent_time:
-                        status = 'LATE'
-                        notes = 'Very Late (History Sync)'
-                    elif check_in_time >= late_time:
-                        status = 'LATE'
-                        notes = 'Late Arrival (History Sync)'
-
-                    # Insert
-                    new_record = {
-                        "id": str(uuid.uuid4()),
-                        "employee_id": emp_uuid,
-                        "date": log_date_str,
-                        "status": status,
-                        "clock_in": log_time_iso,
-                        "device_id": f"ZK-{ZK_IP} (History)",
-                        "device_uuid": device_uuid,
-                        "notes": notes
-                    }
-                    supabase.table('attendance').insert(new_record).execute()
-                    count_inserted += 1
-                    print(f"✅ Clock In: {user_id_str} @ {log.timestamp}")
-                else:
-                    # === CLOCK OUT (Update) ===
-                    record = check.data[0]
-                    record_id = record['id']
-                    
-                    current_clock_in = record.get('clock_in')
-                    current_clock_out = record.get('clock_out')
-                    
-                    should_update = False
-                    if current_clock_in:
-                        if log_time_iso > current_clock_in:
-                            if not current_clock_out or log_time_iso > current_clock_out:
-                                should_update = True
-                    
-                    if should_update:
-                        update_data = {
-                            "clock_out": log_time_iso,
-                            "device_id": f"ZK-{ZK_IP} (History)",
-                            "device_uuid": device_uuid
-                        }
-                        supabase.table('attendance').update(update_data).eq('id', record_id).execute()
-                        count_updated += 1
-                        print(f"👋 Clock Out Updated: {user_id_str} @ {log.timestamp}")
-                    else:
-                        count_skipped += 1
-            except Exception as db_err:
-                print(f"❌ Error processing log: {db_err}")
+        # first-in / last-out qof walba maalin walba, kadibna hal mar la
+        # barbar dhig database-ka (bulk)
+        # (NumPy ayaa la isticmaalaa haddii uu rakiban yahay - aad ayuu u dhaqsiyaa)
+        print(f"📊 {len(days)} maalmood-shaqaale ayaa la helay ({time.time() - fold_start:.1f}s). Database-ka ayaa la cusbooneysiinayaa...")
+
+        result = reconcile_days(supabase, days, f"ZK-{ZK_IP} (History)", device_uuid, HISTORY_NOTES)
+        count_inserted = result['inserted']
+        count_updated = result['updated']
+        count_skipped = result['skipped']
 
         print("\n----------------------------------------")
         print(f"🎉 SHAQADU WAA DHAMAATAY!")
@@ -0,0 +1,127 @@
+
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+
+# ==========================================
+# BACKGROUND JOB REGISTRY
+# ==========================================
+# /sync-users and /sync-logs become tracked jobs:
+# - one active job per (operation, device); a second request while it runs
+#   gets the same job id back instead of starting another full download
+# - progress counters (downloaded / processed / written) and throughput
+# - GET /jobs/<id>; finished jobs are kept in a bounded history
+
+JOB_HISTORY = 100
+
+class Job:
+    def __init__(self, op, device, params):
+        self.id = uuid.uuid4().hex[:12]
+        self.op = op
+        self.device = device
+        self.params = params
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.progress = {"downloaded": 0, "processed": 0, "written": 0}
+        self.coalesced = 0
+        self.result = None
+        self.error = None
+        self.lock = threading.Lock()
+
+    def update(self, **counters):
+        """Progress callback handed to the sync functions."""
+        with self.lock:
+            self.progress.update(counters)
+
+    def to_dict(self):
+        with self.lock:
+            progress = dict(self.progress)
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        return {
+            "id": self.id,
+            "op": self.op,
+            "device": self.device,
+            "params": self.params,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed_seconds": round(elapsed, 2),
+            "progress": progress,
+            "throughput_per_sec": round(progress["processed"] / elapsed, 1) if elapsed > 0 else 0.0,
+            "coalesced_requests": self.coalesced,
+            "result": self.result,
+            "error": self.error
+        }
+
+class JobRegistry:
+    def __init__(self, history=JOB_HISTORY):
+        self.history = history
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict() # id -> Job (active + finished, oldest first)
+        self.active = {}          # (op, device) -> Job
+        self.coalesced = 0
+
+    def submit(self, op, device, fn, params=None):
+        """
+        Starts fn(job) in the background, or returns the job already running
+        for (op, device). Returns (job, created).
+        """
+        with self.lock:
+            running = self.active.get((op, device))
+            if running is not None:
+                running.coalesced += 1
+                self.coalesced += 1
+                return running, False
+            job = Job(op, device, params or {})
+            self.jobs[job.id] = job
+            self.active[(op, device)] = job
+            self._trim()
+
+        threading.Thread(target=self._run, args=(job, fn), name=f"Job-{op}-{job.id}", daemon=True).start()
+        return job, True
+
+    def _run(self, job, fn):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            job.result = fn(job)
+            job.status = "done"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+            logging.error(f"Job {job.op} {job.device} failed: {e}")
+        finally:
+            job.finished_at = time.time()
+            with self.lock:
+                if self.active.get((job.op, job.device)) is job:
+                    del self.active[(job.op, job.device)]
+                self._trim()
+
+    def _trim(self):
+        # Drop the oldest finished jobs beyond the history size
+        excess = len(self.jobs) - self.history
+        for job_id in list(self.jobs):
+            if excess <= 0:
+                break
+            if self.jobs[job_id].finished_at is not None:
+                del self.jobs[job_id]
+                excess -= 1
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return [job.to_dict() for job in reversed(jobs)]
+
+    def stats(self):
+        with self.lock:
+            return {"active": len(self.active), "kept": len(self.jobs), "coalesced": self.coalesced}
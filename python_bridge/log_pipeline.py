@@ -0,0 +1,160 @@
+
+import os
+import time
+import gzip
+import queue
+import atexit
+import shutil
+import logging
+import threading
+import logging.handlers
+from collections import deque
+from datetime import datetime
+import tracing
+
+# ==========================================
+# ASYNC STRUCTURED LOGGING
+# ==========================================
+# logging.info() used to write monitor_service.log synchronously (FileHandler)
+# on whatever thread called it, including the device threads mid-capture,
+# and the file never stopped growing. Now:
+# - The calling thread only puts the record on a bounded queue. A listener
+#   thread formats it and does the file / console writes and rotation. When
+#   the queue is full the record is dropped and counted; the capture loop
+#   never waits on the disk.
+# - The file rotates at MAX_BYTES and keeps BACKUPS gzip-compressed
+#   generations (monitor_service.log.1.gz, .2.gz ...).
+# - Every record also goes into a ring buffer as a dict (seq, time, level,
+#   message, device, employee, duration_ms, thread). /logs filters it by
+#   level / device and pages it with a cursor (seq). seq restarts at 1 in
+#   every process, so /logs also returns the process epoch (pid + start
+#   time); a client that sees it change drops its cursor.
+#
+# device / employee come from extra={...}, else from the innermost tracing
+# span, else from what the thread bound with bind(device=...).
+
+MAX_BYTES = 5 * 1024 * 1024
+BACKUPS = 5
+QUEUE_SIZE = 10000
+BUFFER_SIZE = 2000
+CONTEXT_FIELDS = ('device', 'employee', 'duration_ms')
+LOG_FORMAT = '%(asctime)s - %(message)s'
+
+bound = threading.local()
+
+def bind(**context):
+    """Default device / employee for this thread's records (e.g. a device's monitor thread)."""
+    bound.context = {k: v for k, v in context.items() if v is not None}
+
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        stack = getattr(tracing.local, 'stack', None)
+        span_context = stack[-1]['context'] if stack else {}
+        thread_context = getattr(bound, 'context', {})
+        for field in CONTEXT_FIELDS:
+            if getattr(record, field, None) is None:
+                setattr(record, field, span_context.get(field, thread_context.get(field)))
+        return True
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def gzip_namer(name):
+    return name + ".gz"
+
+def gzip_rotator(source, dest):
+    with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+class RecordBuffer(logging.Handler):
+    """Last BUFFER_SIZE records as dicts, numbered by seq (the /logs cursor)."""
+    def __init__(self, size=BUFFER_SIZE):
+        super().__init__()
+        self.records = deque(maxlen=size)
+        self.seq = 0
+
+    def emit(self, record):
+        try:
+            self.seq += 1
+            self.records.append({
+                "seq": self.seq,
+                "time": datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+                "level": record.levelname,
+                "levelno": record.levelno,
+                "message": record.getMessage(),
+                "device": getattr(record, 'device', None),
+                "employee": getattr(record, 'employee', None),
+                "duration_ms": getattr(record, 'duration_ms', None),
+                "thread": record.threadName,
+                "text": self.format(record)
+            })
+        except Exception:
+            self.handleError(record)
+
+    def query(self, after=None, level=None, device=None, limit=50):
+        """Newest first: records with seq > after, at least `level`, from `device`. Returns (records, cursor, truncated)."""
+        minimum = logging.getLevelName(level.upper()) if level else 0
+        if not isinstance(minimum, int):
+            minimum = 0
+        cursor = self.seq
+        out = []
+        truncated = False
+        for rec in reversed(list(self.records)):
+            if after is not None and rec["seq"] <= after:
+                break
+            if rec["levelno"] < minimum or (device and rec["device"] != device):
+                continue
+            if len(out) >= limit:
+                truncated = True
+                break
+            out.append(rec)
+        return out, cursor, truncated
+
+class LogPipeline:
+    def __init__(self, log_path, stream=None, max_bytes=MAX_BYTES, backups=BACKUPS, level=logging.INFO):
+        self.log_path = str(log_path)
+        self.epoch = f"{os.getpid()}-{int(time.time())}"
+        formatter = logging.Formatter(LOG_FORMAT)
+        file_handler = logging.handlers.RotatingFileHandler(
+            self.log_path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8', delay=True)
+        file_handler.namer = gzip_namer
+        file_handler.rotator = gzip_rotator
+        self.buffer = RecordBuffer()
+        handlers = [file_handler, self.buffer]
+        if stream is not None:
+            handlers.append(logging.StreamHandler(stream))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.queue_handler = DroppingQueueHandler(self.queue)
+        self.queue_handler.setFormatter(logging.Formatter('%(message)s')) # prepare() merges args (+ traceback) only
+        self.queue_handler.addFilter(ContextFilter())
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.listener.stop) # flush what is still queued
+        logging.basicConfig(level=level, handlers=[self.queue_handler])
+
+    def query(self, after=None, level=None, device=None, limit=50):
+        return self.buffer.query(after, level, device, limit)
+
+    def stats(self):
+        try:
+            size = os.path.getsize(self.log_path)
+        except OSError:
+            size = 0
+        return {
+            "queued": self.queue.qsize(),
+            "dropped": self.queue_handler.dropped,
+            "records": self.buffer.seq,
+            "file_bytes": size
+        }
@@ -1,8 +1,7 @@
 
 from zk import ZK
 from supabase import create_client
-import uuid
-from datetime import datetime
+from user_sync import sync_users as sync_user_diff
 
 # ==========================================
 # CONFIGURATION
@@ -56,44 +55,21 @@ def sync_users_from_device():
         # 3. Get Valid Xarun ID (Fixes Foreign Key Error)
         valid_xarun_id = get_valid_xarun_id(supabase)
         
-        count_new = 0
-        count_updated = 0
-        
-        for user in device_users:
-            user_id = str(user.user_id) # ID-ga (e.g. "23")
-            name = user.name.strip() if user.name else f"Worker {user_id}"
-            
-            # Hubi haddii shaqaalahan uu horey u jiray
-            res = supabase.table('employees').select("*").eq('employee_id_code', user_id).execute()
-            
-            if not res.data:
-                # HADDII UUSAN JIRIN: Abuur mid cusub
-                new_emp = {
-                    "id": str(uuid.uuid4()),
-                    "name": name,
-                    "employee_id_code": user_id,
-                    "position": "STAFF",
-                    "status": "ACTIVE",
-                    "joined_date": datetime.now().strftime("%Y-%m-%d"),
-                    "xarun_id": valid_xarun_id, # Uses valid ID now
-                    "salary": 0,
-                    "avatar": f"https://api.dicebear.com/7.x/avataaars/svg?seed={user_id}"
-                }
-                supabase.table('employees').insert(new_emp).execute()
-                print(f"🆕 Inserted: {name} (ID: {user_id})")
-                count_new += 1
-            else:
-                # HADDII UU JIRO: Cusbooneysii magaca haddii uu is bedelay
-                existing_emp = res.data[0]
-                if existing_emp['name'] != name and user.name: # Only update if ZK has a real name
-                    supabase.table('employees').update({"name": name}).eq('id', existing_emp['id']).execute()
-                    print(f"🔄 Updated Name: {existing_emp['name']} -> {name}")
-                    count_updated += 1
+        # 4. Isku barbar dhig (diff) xusuusta gudaheeda, kadibna hal mar qor:
+        #    shaqaalaha cusub (bulk insert) iyo magacyada is bedelay (bulk upsert)
+        result = sync_user_diff(supabase, device_users, valid_xarun_id, with_finger_id=False)
+        for old_name, new_name in result['renames']:
+            print(f"🔄 Updated Name: {old_name} -> {new_name}")
+        count_new = result['inserted']
+        count_updated = result['renamed']
         
         print("-" * 30)
         print(f"🎉 SYNC COMPLETED!")
         print(f"   - New Users Added: {count_new}")
         print(f"   - Names Updated:   {count_updated}")
+        print(f"   - Unchanged:       {result['unchanged']}")
+        print(f"   - Failed:          {result['failed']}")
+        print(f"   - DB Requests:     {result['requests']}")
         print("-" * 30)
 
     except Exception as e:
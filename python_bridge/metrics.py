@@ -0,0 +1,213 @@
+
+import time
+import threading
+
+# ==========================================
+# METRICS (PROMETHEUS TEXT FORMAT)
+# ==========================================
+# A small in-process registry (no extra dependency): counters, gauges and
+# histograms with labels, plus collectors that read existing stats() at
+# scrape time. render() returns the text exposition format for /metrics.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SCAN_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 900, 3600)
+DOWNLOAD_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list(extra or [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, '')) for n in self.label_names)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        with self.lock:
+            items = list(self.values.items())
+        return self.header() + [f"{self.name}{_labels(self.label_names, k)} {_number(v)}" for k, v in items]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        with self.lock:
+            items = [(k, (list(s[0]), s[1], s[2])) for k, s in self.values.items()]
+        lines = self.header()
+        for key, (counts, total, count) in items:
+            for bound, c in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, [('le', _number(float(bound)))])} {c}")
+            lines.append(f"{self.name}_bucket{_labels(self.label_names, key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {round(total, 6)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {count}")
+        return lines
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = [] # () -> [(name, kind, help, {labels}, value)]
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._add(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        self.collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        seen = set()
+        for fn in self.collectors:
+            try:
+                samples = fn()
+            except Exception:
+                continue
+            for name, kind, help_text, labels, value in samples:
+                if value is None:
+                    continue
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# HELP {name} {help_text}")
+                    lines.append(f"# TYPE {name} {kind}")
+                label_names = tuple(labels)
+                lines.append(f"{name}{_labels(label_names, [labels[n] for n in label_names])} {_number(value)}")
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+# --- Supabase instrumentation ---
+supabase_requests = registry.counter(
+    "supabase_requests_total", "Supabase/PostgREST requests by table and operation.", ("table", "op"))
+supabase_errors = registry.counter(
+    "supabase_errors_total", "Failed Supabase/PostgREST requests by table and operation.", ("table", "op"))
+supabase_latency = registry.histogram(
+    "supabase_request_seconds", "Supabase/PostgREST request latency.", ("table", "op"))
+
+QUERY_OPS = {"select", "insert", "update", "upsert", "delete"}
+
+class InstrumentedQuery:
+    """Wraps a postgrest builder chain; execute() is timed and counted."""
+    def __init__(self, builder, table, op):
+        self._builder = builder
+        self._table = table
+        self._op = op
+
+    def __getattr__(self, name):
+        attr = getattr(self._builder, name)
+        if not callable(attr):
+            # e.g. the .not_ property returns the builder itself
+            return InstrumentedQuery(attr, self._table, self._op) if hasattr(attr, 'execute') else attr
+        op = name if name in QUERY_OPS else self._op
+
+        if name == 'execute':
+            return lambda *args, **kwargs: self._execute(attr, *args, **kwargs)
+        return lambda *args, **kwargs: InstrumentedQuery(attr(*args, **kwargs), self._table, op)
+
+    def _execute(self, execute, *args, **kwargs):
+        from tracing import span # (tracing itself registers a histogram here)
+        started = time.perf_counter()
+        try:
+            with span("supabase.execute", table=self._table, op=self._op):
+                return execute(*args, **kwargs)
+        except Exception:
+            supabase_errors.inc(table=self._table, op=self._op)
+            raise
+        finally:
+            supabase_requests.inc(table=self._table, op=self._op)
+            supabase_latency.observe(time.perf_counter() - started, table=self._table, op=self._op)
+
+class InstrumentedClient:
+    """Drop-in wrapper for a supabase Client: client.table(...)/rpc(...) are measured."""
+    def __init__(self, client):
+        self._client = client
+
+    def table(self, name):
+        return InstrumentedQuery(self._client.table(name), name, "query")
+
+    def rpc(self, fn, *args, **kwargs):
+        return InstrumentedQuery(self._client.rpc(fn, *args, **kwargs), f"rpc:{fn}", "rpc")
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
@@ -0,0 +1,124 @@
+
+import logging
+import threading
+from datetime import datetime, timedelta
+from attendance_fold import fetch_attendance_window
+
+# ==========================================
+# OPEN-DAY ATTENDANCE STATE
+# ==========================================
+# Keeps today's attendance row per employee in memory ({employee_uuid:
+# {id, clock_in, clock_out}}), warmed with one ranged query at startup and
+# again when the date rolls over. A clock-out scan is then answered locally
+# and costs a single UPDATE.
+#
+# The map is only a hint: app.py /sync-logs, other shards and the dashboard
+# write the same rows without telling this process.
+# - In-process writers go through lock_for(employee) and remember().
+# - "No row yet" is confirmed with one read before a clock-in INSERT, so a
+#   row written by another process is never duplicated.
+# - clock_out() is a conditional UPDATE: the database only takes the scan
+#   if the row's clock_in / clock_out are still earlier, so a stale entry
+#   can never overwrite a later clock_out written elsewhere. When it matches
+#   nothing (newer row, or row deleted) the entry is dropped and the caller
+#   reads the row again.
+
+class OpenDayState:
+    def __init__(self):
+        self.date = None
+        self.records = {}
+        self.lock = threading.Lock()
+        self.employee_locks = {}
+        self.hits = 0
+        self.reads = 0
+        self.warms = 0
+        self.stale = 0
+
+    def lock_for(self, emp_uuid):
+        """Serializes decide-and-write for one employee across threads."""
+        with self.lock:
+            lock = self.employee_locks.get(emp_uuid)
+            if lock is None:
+                lock = self.employee_locks[emp_uuid] = threading.Lock()
+            return lock
+
+    def warm(self, supabase, date_str=None):
+        date_str = date_str or datetime.now().strftime("%Y-%m-%d")
+        try:
+            rows = fetch_attendance_window(supabase, date_str, date_str)
+        except Exception as e:
+            logging.error(f"Open-day warm failed: {e}")
+            return False
+        with self.lock:
+            self.records = {emp_uuid: row for (emp_uuid, _), row in rows.items()}
+            self.date = date_str
+        self.warms += 1
+        logging.info(f"📅 Open-day state warmed for {date_str}: {len(self.records)} records.")
+        return True
+
+    def get_record(self, supabase, emp_uuid, date_str):
+        """Returns the attendance row for (employee, date), or None if there is none yet."""
+        today = datetime.now().strftime("%Y-%m-%d")
+        if date_str == today and self.date != today:
+            self.warm(supabase, today) # midnight rollover (first scan of the day)
+
+        if date_str == self.date:
+            record = self.records.get(emp_uuid)
+            if record is not None:
+                self.hits += 1
+                return record
+
+        # Past dates (replays) and unconfirmed misses go to the DB
+        self.reads += 1
+        res = supabase.table('attendance').select("id, clock_in, clock_out") \
+            .eq("employee_id", emp_uuid).eq("date", date_str).execute()
+        record = res.data[0] if res.data else None
+        if record is not None:
+            self.remember(emp_uuid, date_str, record)
+        return record
+
+    def remember(self, emp_uuid, date_str, record):
+        if date_str != self.date:
+            return
+        with self.lock:
+            current = self.records.get(emp_uuid)
+            if current is not None and current.get('id') == record.get('id'):
+                current.update(record)
+            else:
+                self.records[emp_uuid] = dict(record)
+
+    def clock_out(self, supabase, emp_uuid, date_str, record_id, payload, debounce=0):
+        """
+        UPDATE payload (with its clock_out) on record_id, only where clock_in and
+        any clock_out are earlier than the scan (by at least `debounce` seconds).
+        True if the row took it; False drops the entry (re-read with get_record).
+        """
+        if debounce:
+            op = 'lte'
+            cutoff = (datetime.fromisoformat(payload['clock_out']) - timedelta(seconds=debounce)).isoformat()
+        else:
+            op, cutoff = 'lt', payload['clock_out']
+        query = supabase.table('attendance').update(payload).eq('id', record_id)
+        res = getattr(query, op)('clock_in', cutoff).or_(f"clock_out.is.null,clock_out.{op}.{cutoff}").execute()
+        if res.data:
+            self.remember(emp_uuid, date_str, {"id": record_id, "clock_out": payload['clock_out']})
+            return True
+        self.forget(emp_uuid, date_str)
+        return False
+
+    def forget(self, emp_uuid, date_str):
+        if date_str != self.date:
+            return
+        with self.lock:
+            self.records.pop(emp_uuid, None)
+        self.stale += 1
+
+    def stats(self):
+        return {
+            "date": self.date,
+            "open_records": len(self.records),
+            "hits": self.hits,
+            "db_reads": self.reads,
+            "warms": self.warms,
+            "stale": self.stale
+        }
@@ -0,0 +1,61 @@
+
+import sys
+import time
+import threading
+from collections import Counter
+
+# ==========================================
+# SAMPLING PROFILER (COLLAPSED STACKS)
+# ==========================================
+# Samples every thread's stack with sys._current_frames() every
+# `interval` seconds, without stopping the service. Output is one line per
+# distinct stack, "thread;outer (file:line);...;inner (file:line) count" -
+# the collapsed format flamegraph.pl / speedscope read directly.
+
+MAX_SECONDS = 120
+DEFAULT_INTERVAL = 0.01
+profile_lock = threading.Lock() # one profile at a time
+
+def _frame_label(frame):
+    code = frame.f_code
+    filename = code.co_filename.replace('\\', '/').rsplit('/', 1)[-1]
+    return f"{code.co_name} ({filename}:{frame.f_lineno})"
+
+def _stack(frame):
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+def sample(seconds, interval=DEFAULT_INTERVAL):
+    """Returns (Counter of collapsed stacks, number of samples)."""
+    seconds = max(0.1, min(float(seconds), MAX_SECONDS))
+    interval = max(0.001, float(interval))
+    me = threading.get_ident()
+    names = {}
+    stacks = Counter()
+    samples = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        if len(names) != threading.active_count():
+            names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            thread = names.get(ident, str(ident)).replace(';', ':').replace(' ', '_')
+            stacks[';'.join([thread] + _stack(frame))] += 1
+        samples += 1
+        time.sleep(interval)
+    return stacks, samples
+
+def collapsed(seconds, interval=DEFAULT_INTERVAL):
+    """Profiles the process for `seconds` and returns collapsed-stack text, or None if busy."""
+    if not profile_lock.acquire(blocking=False):
+        return None
+    try:
+        stacks, _ = sample(seconds, interval)
+    finally:
+        profile_lock.release()
+    return '\n'.join(f"{stack} {count}" for stack, count in stacks.most_common()) + '\n'
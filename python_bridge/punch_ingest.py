@@ -0,0 +1,51 @@
+
+from collections import Counter
+
+# ==========================================
+# SERVER-SIDE PUNCH INGESTION (RPC)
+# ==========================================
+# INGEST_MODE=rpc in .env: punches are not read-decided-written from Python
+# any more. A batch of raw punches (employee code, timestamp, device) goes to
+# the Postgres function public.ingest_punches (database_updates_sync.sql),
+# which folds them, classifies the clock-in and inserts / updates in one
+# transaction, and returns one outcome per punch. One request per batch.
+
+INGEST_FUNCTION = 'ingest_punches'
+BATCH_SIZE = 1000
+WRITTEN = ('clock_in', 'clock_out')
+LIVE_DEBOUNCE_SECONDS = 120 # same as push_attendance
+
+def punch_payload(user_id, timestamp, device_info):
+    name = device_info.get('name', 'Device')
+    ip = device_info.get('ip_address', 'Unknown')
+    return {
+        "code": str(user_id),
+        "ts": timestamp.isoformat(),
+        "device_uuid": device_info.get('id'),
+        "device_label": f"{name} ({ip})"
+    }
+
+def ingest_batch(supabase, punches, source='live', debounce_seconds=0):
+    """
+    punches: [(user_id, timestamp, device_info)], at most BATCH_SIZE.
+    Returns the outcome rows {idx, outcome, employee_id, date, attendance_id} in input order.
+    Raises if the request fails (nothing was written then: it is one transaction).
+    """
+    if not punches:
+        return []
+    res = supabase.rpc(INGEST_FUNCTION, {
+        "p_punches": [punch_payload(*punch) for punch in punches],
+        "p_source": source,
+        "p_debounce_seconds": debounce_seconds
+    }).execute()
+    rows = sorted(res.data or [], key=lambda row: row['idx'])
+    if len(rows) != len(punches):
+        raise RuntimeError(f"{INGEST_FUNCTION} returned {len(rows)} outcomes for {len(punches)} punches")
+    return rows
+
+def batches(items, size=BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def summarize(outcomes):
+    return dict(Counter(row['outcome'] for row in outcomes))
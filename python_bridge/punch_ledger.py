@@ -0,0 +1,91 @@
+
+import logging
+from datetime import datetime, timedelta, timezone
+
+# ==========================================
+# RAW PUNCH LEDGER (IDEMPOTENT APPEND)
+# ==========================================
+# PUNCH_LEDGER=on in .env: every punch is first appended to punch_ledger
+# (database_updates_sync.sql), keyed by (device_ip, device_user_id,
+# punched_at), with ON CONFLICT DO NOTHING. PostgREST only returns the rows
+# that were actually inserted, and attendance is derived from those alone:
+# a replayed sync, a manual sync overlapping the live capture or a second
+# bridge pushing the same buffer costs one upsert and changes nothing.
+#
+# applied_at marks ledger rows whose attendance was derived. If the bridge
+# fails between the two steps, apply_pending picks the rows up later.
+
+LEDGER_TABLE = 'punch_ledger'
+LEDGER_KEY = 'device_ip,device_user_id,punched_at'
+WRITE_CHUNK = 500
+PENDING_GRACE_SECONDS = 120 # leave rows a bridge is deriving right now alone
+PENDING_BATCH = 1000
+
+def ledger_row(user_id, timestamp, device_info, source):
+    return {
+        "device_ip": device_info.get('ip_address'),
+        "device_user_id": str(user_id),
+        "punched_at": timestamp.isoformat(),
+        "device_uuid": device_info.get('id'),
+        "device_name": device_info.get('name'),
+        "source": source
+    }
+
+def append(supabase, punches, source='live'):
+    """
+    Appends [(user_id, timestamp, device_info)] to the ledger.
+    Returns [(ledger_id, punch)] for the punches that were not there yet, in input order.
+    Raises if a request fails.
+    """
+    fresh = []
+    for i in range(0, len(punches), WRITE_CHUNK):
+        chunk = punches[i:i + WRITE_CHUNK]
+        rows = [ledger_row(*punch, source) for punch in chunk]
+        res = supabase.table(LEDGER_TABLE).upsert(rows, on_conflict=LEDGER_KEY, ignore_duplicates=True).execute()
+        inserted = {
+            (r['device_ip'], r['device_user_id'], datetime.fromisoformat(r['punched_at'])): r['id']
+            for r in (res.data or [])
+        }
+        for punch, row in zip(chunk, rows):
+            ledger_id = inserted.get((row['device_ip'], row['device_user_id'], punch[1]))
+            if ledger_id is not None:
+                fresh.append((ledger_id, punch))
+    return fresh
+
+def mark_applied(supabase, ledger_ids):
+    now = datetime.now(timezone.utc).isoformat()
+    for i in range(0, len(ledger_ids), WRITE_CHUNK):
+        supabase.table(LEDGER_TABLE).update({"applied_at": now}).in_('id', ledger_ids[i:i + WRITE_CHUNK]).execute()
+
+def fetch_pending(supabase, limit=PENDING_BATCH, grace=PENDING_GRACE_SECONDS):
+    """Ledger rows whose attendance was never derived, oldest punch first: [(ledger_id, punch)]."""
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=grace)).isoformat()
+    res = supabase.table(LEDGER_TABLE) \
+        .select("id, device_ip, device_user_id, punched_at, device_uuid, device_name") \
+        .is_('applied_at', 'null') \
+        .lt('received_at', cutoff) \
+        .order('punched_at') \
+        .limit(limit) \
+        .execute()
+    pending = []
+    for row in res.data or []:
+        device = {'ip_address': row['device_ip'], 'id': row.get('device_uuid'), 'name': row.get('device_name') or 'Device'}
+        pending.append((row['id'], (row['device_user_id'], datetime.fromisoformat(row['punched_at']), device)))
+    return pending
+
+def apply_pending(supabase, derive):
+    """
+    Derives attendance for unapplied ledger rows with derive(punches) -> (done, written).
+    Returns how many rows were applied.
+    """
+    try:
+        pending = fetch_pending(supabase)
+    except Exception as e:
+        logging.error(f"Ledger pending lookup failed: {e}")
+        return 0
+    if not pending:
+        return 0
+    done, written = derive([punch for _, punch in pending])
+    mark_applied(supabase, [ledger_id for ledger_id, _ in pending[:done]])
+    logging.info(f"🧾 Ledger: derived {done}/{len(pending)} pending punches ({written} attendance writes).")
+    return done
@@ -0,0 +1,220 @@
+
+import json
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+
+# ==========================================
+# DURABLE LOCAL OUTBOX FOR LIVE PUNCHES
+# ==========================================
+# The live capture loop only appends punches to a local SQLite file (WAL
+# mode), so a scan costs one local write no matter how slow the cloud is.
+# A writer thread drains the file to Supabase in order, retrying with
+# backoff. (device, user, timestamp) is unique, so the same punch queued
+# twice is stored once, and a punch re-sent after a crash is absorbed by
+# push_attendance's own debounce.
+#
+# A punch that keeps failing while others go through (bad data, a trigger
+# rejecting it) must not hold up the whole queue: each failure defers it
+# (retry_at, growing backoff) and fetch_batch() moves on to other employees'
+# punches. Later punches of the same employee wait behind it, to keep the
+# clock-in / clock-out order. After MAX_ATTEMPTS failures, with other
+# punches delivered since it first failed, it moves to dead_punches. During
+# an outage nothing is delivered, so nothing is dead-lettered.
+
+MAX_BACKOFF = 300 # seconds
+MAX_ATTEMPTS = 10
+
+class PunchOutbox:
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS punches (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                device_ip TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                punch_time TEXT NOT NULL,
+                device_json TEXT,
+                attempts INTEGER DEFAULT 0,
+                last_error TEXT,
+                created_at REAL,
+                UNIQUE(device_ip, user_id, punch_time)
+            )
+        """)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(punches)")}
+        for column in ('first_failed_at', 'retry_at'): # outboxes created before these existed
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE punches ADD COLUMN {column} REAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS dead_punches (
+                id INTEGER PRIMARY KEY,
+                device_ip TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                punch_time TEXT NOT NULL,
+                device_json TEXT,
+                attempts INTEGER,
+                last_error TEXT,
+                created_at REAL,
+                dead_at REAL
+            )
+        """)
+        self.appended = 0
+        self.duplicates = 0
+        self.delivered = 0
+        self.failures = 0
+        self.dead_lettered = 0
+        self.last_error = None
+        self.last_delivered_at = 0.0
+
+    def append(self, user_id, timestamp, device_info):
+        """Queues a punch. Returns False if it was already queued."""
+        device = {k: device_info.get(k) for k in ('id', 'name', 'ip_address', 'xarun_id')}
+        with self.lock:
+            cur = self.conn.execute(
+                "INSERT OR IGNORE INTO punches (device_ip, user_id, punch_time, device_json, created_at) VALUES (?, ?, ?, ?, ?)",
+                (device.get('ip_address') or '', str(user_id), timestamp.isoformat(), json.dumps(device), time.time())
+            )
+        if cur.rowcount:
+            self.appended += 1
+            self.wakeup.set()
+            return True
+        self.duplicates += 1
+        return False
+
+    def fetch_batch(self, limit=100):
+        """Oldest punches that are due, skipping employees with a deferred (failing) punch."""
+        now = time.time()
+        with self.lock:
+            rows = self.conn.execute(
+                """SELECT id, user_id, punch_time, device_json FROM punches
+                   WHERE COALESCE(retry_at, 0) <= ?
+                     AND user_id NOT IN (SELECT user_id FROM punches WHERE retry_at > ?)
+                   ORDER BY id LIMIT ?""", (now, now, limit)
+            ).fetchall()
+        return [(row_id, user_id, datetime.fromisoformat(punch_time), json.loads(device_json or '{}'))
+                for row_id, user_id, punch_time, device_json in rows]
+
+    def mark_done(self, row_ids):
+        if not row_ids: return
+        with self.lock:
+            self.conn.executemany("DELETE FROM punches WHERE id = ?", [(i,) for i in row_ids])
+        self.delivered += len(row_ids)
+        self.last_delivered_at = time.time()
+
+    def mark_failed(self, row_id, error):
+        """Defers the punch (backoff per attempt). Returns True if it was moved to dead_punches."""
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT attempts, first_failed_at FROM punches WHERE id = ?", (row_id,)).fetchone()
+            if row is None:
+                return False
+            attempts = (row[0] or 0) + 1
+            first_failed_at = row[1] or now
+            dead = attempts >= MAX_ATTEMPTS and self.last_delivered_at > first_failed_at
+            if dead:
+                self.conn.execute("BEGIN")
+                try:
+                    self.conn.execute(
+                        """INSERT OR REPLACE INTO dead_punches
+                           SELECT id, device_ip, user_id, punch_time, device_json, ?, ?, created_at, ? FROM punches WHERE id = ?""",
+                        (attempts, str(error), now, row_id))
+                    self.conn.execute("DELETE FROM punches WHERE id = ?", (row_id,))
+                    self.conn.execute("COMMIT")
+                except sqlite3.Error:
+                    self.conn.execute("ROLLBACK")
+                    raise
+            else:
+                self.conn.execute(
+                    "UPDATE punches SET attempts = ?, last_error = ?, first_failed_at = ?, retry_at = ? WHERE id = ?",
+                    (attempts, str(error), first_failed_at, now + min(2 ** attempts, MAX_BACKOFF), row_id))
+        self.failures += 1
+        self.last_error = str(error)
+        if dead:
+            self.dead_lettered += 1
+            logging.error(f"☠️ Outbox: punch {row_id} failed {attempts} times while others went through. Moved to dead_punches: {error}")
+        return dead
+
+    def stats(self):
+        with self.lock:
+            pending, oldest, deferred = self.conn.execute(
+                "SELECT COUNT(*), MIN(created_at), COUNT(retry_at) FROM punches").fetchone()
+            dead = self.conn.execute("SELECT COUNT(*) FROM dead_punches").fetchone()[0]
+        return {
+            "pending": pending,
+            "deferred": deferred,
+            "dead_letters": dead,
+            "oldest_age_sec": round(time.time() - oldest, 1) if oldest else 0,
+            "appended": self.appended,
+            "duplicates": self.duplicates,
+            "delivered": self.delivered,
+            "failures": self.failures,
+            "dead_lettered": self.dead_lettered,
+            "last_error": self.last_error
+        }
+
+def drain_forever(outbox, handler, batch_size=100, idle_sleep=1.0, batch_handler=None):
+    """
+    Writer loop. handler(user_id, timestamp, device_info) returns None when the
+    write failed; the batch then stops (keeps per-employee order), the punch
+    is deferred (see mark_failed) and the writer backs off before the next batch.
+    batch_handler([(user_id, timestamp, device_info)]), if given, writes the
+    whole batch at once and returns how many leading punches are done.
+    """
+    backoff = 1
+    while True:
+        try:
+            batch = outbox.fetch_batch(batch_size)
+        except Exception as e:
+            logging.error(f"❌ Outbox read failed: {e}")
+            time.sleep(idle_sleep)
+            continue
+
+        if not batch:
+            outbox.wakeup.wait(idle_sleep)
+            outbox.wakeup.clear()
+            continue
+
+        done = []
+        failed = False
+        if batch_handler is not None:
+            error = "cloud write failed"
+            try:
+                count = batch_handler([(user_id, timestamp, device_info) for _, user_id, timestamp, device_info in batch])
+            except Exception as e:
+                count = 0
+                error = str(e)
+                logging.error(f"❌ Outbox batch handler error: {e}")
+            done = [row[0] for row in batch[:count]]
+            if count < len(batch):
+                outbox.mark_failed(batch[count][0], error)
+                failed = True
+        else:
+            for row_id, user_id, timestamp, device_info in batch:
+                error = "cloud write failed"
+                try:
+                    result = handler(user_id, timestamp, device_info)
+                except Exception as e:
+                    result = None
+                    error = str(e)
+                    logging.error(f"❌ Outbox handler error: {e}")
+                if result is None:
+                    outbox.mark_failed(row_id, error)
+                    failed = True
+                    break
+                done.append(row_id)
+
+        outbox.mark_done(done)
+
+        if failed:
+            logging.warning(f"⏳ Outbox: cloud write failed, retrying in {backoff}s ({outbox.stats()['pending']} pending)")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+        else:
+            backoff = 1
@@ -0,0 +1,78 @@
+
+import threading
+from collections import Counter
+
+# ==========================================
+# IN-MEMORY SCAN DEBOUNCER (ALL DEVICES)
+# ==========================================
+# People scan twice, or scan again on the next gate. push_attendance only
+# caught repeats on the DB side: read the row, parse clock_in / clock_out,
+# compare. admit() answers the same question from memory for every live
+# event, keyed by employee (ZK user id), across all devices of this process.
+# A repeat is dropped before it reaches the outbox or Supabase.
+#
+# - The window is measured from the last *admitted* scan, like the DB rule,
+#   using device timestamps (abs(), gates' clocks are never quite equal).
+# - The same punch seen again (same device, same timestamp) is admitted, so
+#   a re-delivered event still reaches the outbox.
+# - admit() only checks; the caller record()s the scan once it is persisted
+#   (outbox or direct push). A scan whose writes all failed leaves no trace,
+#   so the person's next scan is not dropped as its repeat.
+# - The window never spans midnight: 23:59:30 then 00:00:30 is the new
+#   day's clock-in, not a repeat.
+# - Sharded bridges (MONITOR_SHARDS) debounce per shard: gates on different
+#   shards still meet the DB-side check.
+
+PRUNE_EVERY = 10000 # admits between sweeps of expired keys
+
+class ScanDebouncer:
+    def __init__(self):
+        self.last = {} # user_id -> (timestamp, device_ip) of the last admitted scan
+        self.lock = threading.Lock()
+        self.admitted = 0
+        self.dropped = 0
+        self.cross_device = 0
+        self.dropped_by_device = Counter()
+        self.since_prune = 0
+
+    def admit(self, user_id, timestamp, device_ip, window):
+        """True if the scan should be written, False if it repeats a recorded one within window seconds (same day)."""
+        if window <= 0:
+            return True
+        with self.lock:
+            previous = self.last.get(str(user_id))
+            if previous is not None and previous != (timestamp, device_ip):
+                last_ts, last_ip = previous
+                if last_ts.date() == timestamp.date() and abs((timestamp - last_ts).total_seconds()) < window:
+                    self.dropped += 1
+                    self.dropped_by_device[device_ip] += 1
+                    if last_ip != device_ip:
+                        self.cross_device += 1
+                    return False
+        return True
+
+    def record(self, user_id, timestamp, device_ip, window):
+        """Call once an admitted scan is persisted: later repeats are measured from it."""
+        if window <= 0:
+            return
+        with self.lock:
+            self.last[str(user_id)] = (timestamp, device_ip)
+            self.admitted += 1
+            self.since_prune += 1
+            if self.since_prune >= PRUNE_EVERY:
+                self._prune(timestamp, window)
+
+    def _prune(self, now, window):
+        self.since_prune = 0
+        self.last = {k: v for k, v in self.last.items() if abs((now - v[0]).total_seconds()) < window}
+
+    def stats(self):
+        seen = self.admitted + self.dropped
+        return {
+            "admitted": self.admitted,
+            "dropped": self.dropped,
+            "dropped_cross_device": self.cross_device,
+            "drop_ratio": round(self.dropped / seen, 3) if seen else 0.0,
+            "tracked_employees": len(self.last),
+            "dropped_by_device": dict(self.dropped_by_device)
+        }
@@ -0,0 +1,304 @@
+
+import time
+import bisect
+import hashlib
+import logging
+import threading
+import multiprocessing as mp
+
+# ==========================================
+# MULTI-PROCESS DEVICE SHARDING
+# ==========================================
+# MONITOR_SHARDS=N (N > 1) in .env: the main process keeps the API, the
+# schedules and the device table, and N worker processes each run the
+# async engine for their shard of the devices. A device belongs to a shard
+# by consistent hashing on ip_address, so adding / losing a worker only
+# moves that worker's devices.
+#
+# Supervisor -> worker (inbox):  ('devices', [rows]) | ('cache', snapshot)
+#                                ('job', job_id, op, args) | ('stop',)
+# Worker -> supervisor (events): ('heartbeat', shard, stats)
+#                                ('job_done', job_id, result, error)
+#                                ('released', shard, [ip])
+#
+# A worker that dies or stops sending heartbeats is taken off the ring at
+# once (its devices move to the others) and restarted. It heartbeats from
+# the start ("starting" while Supabase / open-day load) and joins the ring
+# with its first "ready" heartbeat.
+#
+# Owner locks only work inside one process, so when the ring moves a device
+# between two live workers the new one only gets it after the old one
+# reports it 'released' (session closed, punches written, watermark saved).
+
+RING_REPLICAS = 64
+HEARTBEAT_SECONDS = 10
+HEARTBEAT_TIMEOUT = 60
+JOB_TIMEOUT = 900
+HANDOVER_TIMEOUT = 120 # the old owner releases a device after this even if its session is still closing
+
+def _hash(key):
+    return int(hashlib.md5(str(key).encode()).hexdigest()[:8], 16)
+
+class HashRing:
+    def __init__(self, nodes=(), replicas=RING_REPLICAS):
+        self.replicas = replicas
+        self.points = [] # sorted (hash, node)
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        for i in range(self.replicas):
+            bisect.insort(self.points, (_hash(f"{node}#{i}"), node))
+
+    def remove(self, node):
+        self.points = [p for p in self.points if p[1] != node]
+
+    def nodes(self):
+        return sorted({node for _, node in self.points})
+
+    def node_for(self, key):
+        if not self.points:
+            return None
+        i = bisect.bisect(self.points, (_hash(key), ))
+        return self.points[i % len(self.points)][1]
+
+def worker_main(shard, inbox, events):
+    """Entry point of a shard process: the monitor, without the API and schedules."""
+    import advanced_monitor as am
+
+    assigned = {'devices': []}
+    state = {'value': 'starting'}
+
+    def heartbeat():
+        while True:
+            stats = {
+                "state": state['value'],
+                "devices": len(assigned['devices']),
+                "engine": am.async_engine.stats() if am.async_engine else None,
+                "outbox": am.outbox.stats() if am.outbox else None,
+                "employee_cache": am.employee_cache.stats()
+            }
+            events.put(('heartbeat', shard, stats))
+            time.sleep(HEARTBEAT_SECONDS)
+
+    # Heartbeat first: a slow Supabase must not get the worker killed as silent
+    threading.Thread(target=heartbeat, name="Thread-Heartbeat", daemon=True).start()
+
+    # Own outbox per shard, so two drain threads never push the same rows
+    am.open_outbox(am.state_dir / f"punch_outbox_shard{shard}.db")
+    logging.info(f"🧩 Shard {shard} worker started.")
+    threading.Thread(target=am.drain_outbox, name="Thread-Outbox", daemon=True).start()
+
+    if am.init_supabase():
+        am.warm_open_day()
+    state['value'] = 'ready'
+
+    def handle_job(job_id, op, args):
+        result, error = None, None
+        try:
+            if op == 'sync_users':
+                result = am.run_manual_user_sync(*args)
+            elif op == 'sync_logs':
+                result = am.run_manual_log_sync(*args)
+            else:
+                error = f"Unknown job {op}"
+        except Exception as e:
+            error = str(e)
+        events.put(('job_done', job_id, result, error))
+
+    def release(ips):
+        """Reports ips once their sessions here are closed (see ShardSupervisor.rebalance)."""
+        deadline = time.time() + HANDOVER_TIMEOUT
+        while am.async_engine and any(am.async_engine.running(ip) for ip in ips):
+            if time.time() > deadline:
+                logging.warning(f"⚠️ Shard {shard}: {ips} still closing after {HANDOVER_TIMEOUT}s. Releasing anyway.")
+                break
+            time.sleep(0.5)
+        events.put(('released', shard, ips))
+
+    while True:
+        message = inbox.get()
+        kind = message[0]
+        if kind == 'stop':
+            break
+        if kind == 'cache':
+            am.employee_cache.load_snapshot(message[1])
+        elif kind == 'devices':
+            removed = sorted({d['ip_address'] for d in assigned['devices']} - {d['ip_address'] for d in message[1]})
+            assigned['devices'] = message[1]
+            if not am.async_engine:
+                am.start_async_engine(load_devices=lambda: assigned['devices'])
+            else:
+                am.async_engine.refresh_now()
+            if removed:
+                threading.Thread(target=release, args=(removed,), name="Thread-Release", daemon=True).start()
+        elif kind == 'job':
+            threading.Thread(target=handle_job, args=message[1:], daemon=True).start()
+
+class ShardSupervisor:
+    def __init__(self, shards, load_devices, cache_snapshot):
+        self.shards = shards
+        self.load_devices = load_devices     # () -> device rows (main process)
+        self.cache_snapshot = cache_snapshot # () -> employee cache data
+        self.ctx = mp.get_context('spawn')   # same behaviour on Windows and Linux
+        self.events = self.ctx.Queue()
+        self.workers = {}    # shard -> {'process', 'inbox', 'last_seen', 'stats'}
+        self.ring = HashRing()
+        self.lock = threading.Lock()
+        self.devices = []
+        self.assigned = {}   # shard -> [ip]
+        self.held = {}       # ip -> shard that was given it and has not released it yet
+        self.jobs = {}       # job_id -> {'done': Event, 'result', 'error'}
+        self.job_seq = 0
+        self.restarts = 0
+
+    # --- workers ---
+    def start(self):
+        for shard in range(self.shards):
+            self._spawn(shard)
+        threading.Thread(target=self._read_events, name="Thread-ShardEvents", daemon=True).start()
+        threading.Thread(target=self._watch, name="Thread-ShardWatch", daemon=True).start()
+        logging.info(f"🧩 Shard supervisor started {self.shards} workers.")
+
+    def _spawn(self, shard):
+        inbox = self.ctx.Queue()
+        process = self.ctx.Process(target=worker_main, args=(shard, inbox, self.events),
+                                   name=f"Shard-{shard}", daemon=True)
+        process.start()
+        self.workers[shard] = {'process': process, 'inbox': inbox, 'last_seen': time.time(),
+                               'stats': None, 'joined': False}
+
+    def _read_events(self):
+        while True:
+            message = self.events.get()
+            kind = message[0]
+            if kind == 'heartbeat':
+                _, shard, stats = message
+                worker = self.workers.get(shard)
+                if not worker:
+                    continue
+                worker['last_seen'] = time.time()
+                worker['stats'] = stats
+                if not worker['joined'] and stats.get('state') != 'starting':
+                    worker['joined'] = True
+                    worker['inbox'].put(('cache', self.cache_snapshot()))
+                    with self.lock:
+                        self.ring.add(shard)
+                    self.rebalance()
+            elif kind == 'job_done':
+                _, job_id, result, error = message
+                job = self.jobs.get(job_id)
+                if job:
+                    job['result'], job['error'] = result, error
+                    job['done'].set()
+            elif kind == 'released':
+                _, shard, ips = message
+                with self.lock:
+                    for ip in ips:
+                        if self.held.get(ip) == shard:
+                            del self.held[ip]
+                self.rebalance() # hands them to their new shard
+
+    def _watch(self):
+        while True:
+            time.sleep(HEARTBEAT_SECONDS)
+            for shard, worker in list(self.workers.items()):
+                dead = not worker['process'].is_alive()
+                silent = time.time() - worker['last_seen'] > HEARTBEAT_TIMEOUT
+                if not (dead or silent):
+                    continue
+                logging.error(f"💀 Shard {shard} {'died' if dead else 'stopped responding'}; moving its devices.")
+                if not dead:
+                    worker['process'].terminate()
+                    worker['process'].join(5) # its sessions are gone before others take the devices
+                with self.lock:
+                    self.ring.remove(shard)
+                    self.held = {ip: s for ip, s in self.held.items() if s != shard}
+                self.rebalance()
+                self.restarts += 1
+                self._spawn(shard) # rejoins the ring with its first heartbeat
+
+    # --- devices ---
+    def refresh(self):
+        """Scheduled: re-reads the devices table and pushes each shard its devices."""
+        try:
+            self.devices = self.load_devices()
+        except Exception as e:
+            logging.error(f"Shard refresh failed: {e}")
+            return
+        self.rebalance()
+
+    def owner_of(self, ip):
+        with self.lock:
+            return self.ring.node_for(ip)
+
+    def rebalance(self):
+        """
+        Pushes each shard its devices. A device moving between two live
+        shards is first taken from the old one; the new one gets it after the
+        old one reports it released.
+        """
+        with self.lock:
+            plan = {shard: [] for shard in self.ring.nodes()}
+            for device in self.devices:
+                ip = device['ip_address']
+                shard = self.ring.node_for(ip)
+                if shard is None:
+                    continue
+                holder = self.held.get(ip)
+                if holder is not None and holder != shard and holder in plan:
+                    continue # waiting for the old shard to release it
+                self.held[ip] = shard
+                plan[shard].append(device)
+        for shard, devices in plan.items():
+            ips = sorted(d['ip_address'] for d in devices)
+            if self.assigned.get(shard) == ips:
+                continue
+            self.assigned[shard] = ips
+            self.workers[shard]['inbox'].put(('devices', devices))
+            logging.info(f"🧩 Shard {shard}: {len(ips)} devices.")
+        for shard in list(self.assigned):
+            if shard not in plan:
+                del self.assigned[shard]
+
+    def broadcast_cache(self):
+        snapshot = self.cache_snapshot()
+        for worker in self.workers.values():
+            if worker['joined']:
+                worker['inbox'].put(('cache', snapshot))
+
+    # --- manual jobs (run in the process that owns the device) ---
+    def run_job(self, ip, op, args, timeout=JOB_TIMEOUT):
+        shard = self.owner_of(ip)
+        if shard is None:
+            raise RuntimeError("No shard worker is running")
+        with self.lock:
+            self.job_seq += 1
+            job_id = self.job_seq
+            job = self.jobs[job_id] = {'done': threading.Event(), 'result': None, 'error': None}
+        self.workers[shard]['inbox'].put(('job', job_id, op, args))
+        try:
+            if not job['done'].wait(timeout):
+                raise TimeoutError(f"Shard {shard} did not finish {op} for {ip}")
+            if job['error']:
+                raise RuntimeError(job['error'])
+            return job['result']
+        finally:
+            self.jobs.pop(job_id, None)
+
+    def stats(self):
+        return {
+            "shards": self.shards,
+            "ring": self.ring.nodes(),
+            "restarts": self.restarts,
+            "handovers_pending": len([ip for ip, s in self.held.items() if s != self.ring.node_for(ip)]),
+            "workers": {
+                shard: {
+                    "pid": w['process'].pid,
+                    "alive": w['process'].is_alive(),
+                    "devices": len(self.assigned.get(shard, [])),
+                    "last_seen": round(time.time() - w['last_seen'], 1),
+                    "stats": w['stats']
+                } for shard, w in self.workers.items()
+            }
+        }
@@ -0,0 +1,85 @@
+
+import time
+import socket
+import logging
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+# ==========================================
+# STARTUP: REACHABILITY PROBE & PHASE TIMINGS
+# ==========================================
+# The service used to sleep a fixed 20s "for network" before doing anything,
+# so branch PCs that reboot at night missed the first scans of the morning.
+# wait_for_network() probes the Supabase host with a TCP connect and backs
+# off (0.5s, 1s, 2s ... max 10s) only while it is unreachable. On a PC whose
+# network is already up it returns after one connect.
+#
+# StartupTimer records how long each phase took (api, network, supabase,
+# caches, devices ...) and when the first device went live, counted from
+# process start. They are logged and shown in the / status.
+
+PROBE_TIMEOUT = 3
+FIRST_BACKOFF = 0.5
+MAX_BACKOFF = 10
+NETWORK_DEADLINE = 120 # then start anyway; the main loop keeps retrying Supabase
+
+def probe(host, port=443, timeout=PROBE_TIMEOUT):
+    """True if a TCP connection to host:port opens (DNS + route + listener)."""
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+def target_of(url):
+    parsed = urlparse(url or '')
+    if not parsed.hostname:
+        return None, None
+    return parsed.hostname, parsed.port or (80 if parsed.scheme == 'http' else 443)
+
+def wait_for_network(url, deadline=None):
+    """Blocks until the host of url accepts connections or deadline seconds pass. Returns True if reachable."""
+    deadline = NETWORK_DEADLINE if deadline is None else deadline
+    host, port = target_of(url)
+    if not host:
+        return False
+    started = time.monotonic()
+    delay = FIRST_BACKOFF
+    attempts = 0
+    while True:
+        attempts += 1
+        if probe(host, port):
+            if attempts > 1:
+                logging.info(f"🌐 Network up: {host} reachable after {attempts} probes ({time.monotonic() - started:.1f}s).")
+            return True
+        if time.monotonic() - started + delay > deadline:
+            logging.warning(f"⚠️ {host}:{port} still unreachable after {time.monotonic() - started:.0f}s. Starting offline.")
+            return False
+        if attempts == 1:
+            logging.info(f"⏳ Waiting for network ({host}:{port} unreachable)...")
+        time.sleep(delay)
+        delay = min(delay * 2, MAX_BACKOFF)
+
+class StartupTimer:
+    def __init__(self, started=None):
+        self.started = started or time.perf_counter()
+        self.phases = {} # name -> seconds
+        self.marks = {} # name -> seconds since process start
+
+    @contextmanager
+    def phase(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(time.perf_counter() - t0, 3)
+            logging.info(f"⏱️ Startup {name}: {self.phases[name]:.2f}s")
+
+    def mark(self, name):
+        """Records the first time something happened (e.g. first_device_live)."""
+        if name not in self.marks:
+            self.marks[name] = round(time.perf_counter() - self.started, 3)
+            logging.info(f"⏱️ Startup {name} at +{self.marks[name]:.2f}s")
+
+    def stats(self):
+        return {"phases": dict(self.phases), "marks": dict(self.marks)}
@@ -0,0 +1,137 @@
+
+import logging
+from datetime import datetime, timezone
+
+# ==========================================
+# PER-DEVICE LOG WATERMARK
+# ==========================================
+# Each `devices` row remembers the newest punch that was already committed
+# (timestamp + how many punches share that timestamp). A sync only pushes
+# what comes after it instead of replaying the whole device buffer.
+# Columns: see database_updates_sync.sql
+
+WATERMARK_COLUMNS = "id, last_log_at, last_log_seq, last_log_records"
+
+def load_watermark(supabase, device):
+    """
+    Reads the watermark for a device dict ({'id'} or {'ip_address'}).
+    Returns None if the device has no row (everything counts as new).
+    """
+    try:
+        query = supabase.table('devices').select(WATERMARK_COLUMNS)
+        if device.get('id'):
+            query = query.eq('id', device['id'])
+        else:
+            query = query.eq('ip_address', device.get('ip_address'))
+        res = query.limit(1).execute()
+    except Exception as e:
+        logging.warning(f"⚠️ Watermark lookup failed for {device.get('ip_address')}: {e}")
+        return None
+
+    if not res.data:
+        return None
+
+    row = res.data[0]
+    last_at = row.get('last_log_at')
+    return {
+        'device_id': row['id'],
+        'last_at': datetime.fromisoformat(last_at) if last_at else None,
+        'seq': row.get('last_log_seq') or 0,
+        'records': row.get('last_log_records') or 0
+    }
+
+def filter_new_logs(logs, watermark, cutoff=None):
+    """Returns the logs after the watermark (and after cutoff), sorted by timestamp."""
+    return WatermarkCursor(watermark, cutoff).new_logs(logs)
+
+def advance_watermark(watermark, committed_logs, records=None):
+    """Moves the watermark past committed_logs (a sorted prefix of filter_new_logs)."""
+    wm = {'device_id': None, 'last_at': None, 'seq': 0, 'records': 0}
+    wm.update(watermark or {})
+    for log in committed_logs:
+        if wm['last_at'] == log.timestamp:
+            wm['seq'] += 1
+        else:
+            wm['last_at'] = log.timestamp
+            wm['seq'] = 1
+    if records is not None:
+        wm['records'] = records
+    return wm
+
+class WatermarkCursor:
+    """
+    filter_new_logs + advance_watermark for a buffer that is processed chunk
+    by chunk as it streams, so the whole buffer is never held in memory.
+    - new_logs(chunk): the chunk's punches after the watermark, sorted.
+    - committed(logs) / blocked(logs): what was written / left for next time.
+    result() never lands past a blocked punch: if the device buffer was not
+    in time order and the watermark already moved beyond one, it falls back to
+    just before it (those punches are pushed again, the DB debounce skips them).
+    """
+    def __init__(self, watermark, cutoff=None):
+        self.cutoff = cutoff
+        self.last_at = watermark['last_at'] if watermark else None
+        self.skip_same = watermark['seq'] if watermark else 0
+        self.watermark = advance_watermark(watermark, [])
+        self.blocked_at = None
+        self.new = 0
+
+    def new_logs(self, chunk):
+        new_logs = []
+        for log in sorted(chunk, key=lambda x: x.timestamp):
+            ts = log.timestamp
+            if self.cutoff and ts < self.cutoff:
+                continue
+            if self.last_at:
+                if ts < self.last_at:
+                    continue
+                if ts == self.last_at and self.skip_same > 0:
+                    self.skip_same -= 1
+                    continue
+            new_logs.append(log)
+        self.new += len(new_logs)
+        return new_logs
+
+    def committed(self, logs):
+        wm = self.watermark
+        for log in logs:
+            if wm['last_at'] and log.timestamp < wm['last_at']:
+                continue # an earlier chunk already moved past it
+            if wm['last_at'] == log.timestamp:
+                wm['seq'] += 1
+            else:
+                wm['last_at'] = log.timestamp
+                wm['seq'] = 1
+
+    def blocked(self, logs):
+        for log in logs:
+            if self.blocked_at is None or log.timestamp < self.blocked_at:
+                self.blocked_at = log.timestamp
+
+    def result(self, records=None):
+        wm = dict(self.watermark)
+        if self.blocked_at is not None and wm['last_at'] and wm['last_at'] >= self.blocked_at:
+            wm['last_at'], wm['seq'] = self.blocked_at, 0
+        if records is not None:
+            wm['records'] = records
+        return wm
+
+def save_watermark(supabase, watermark):
+    if not watermark or not watermark.get('device_id'):
+        return False
+    try:
+        supabase.table('devices').update({
+            "last_log_at": watermark['last_at'].isoformat() if watermark['last_at'] else None,
+            "last_log_seq": watermark['seq'],
+            "last_log_records": watermark['records'],
+            "last_log_synced_at": datetime.now(timezone.utc).isoformat()
+        }).eq('id', watermark['device_id']).execute()
+        return True
+    except Exception as e:
+        logging.warning(f"⚠️ Could not save watermark for device {watermark['device_id']}: {e}")
+        return False
+
+def check_buffer(watermark, records):
+    """Logs when the device buffer shrank since the last sync (cleared / replaced)."""
+    if watermark and records is not None and records < watermark['records']:
+        logging.warning(f"⚠️ Device buffer shrank ({watermark['records']} -> {records}). Was it cleared?")
@@ -0,0 +1,486 @@
+
+import os
+import sys
+import time
+import random
+import tempfile
+import threading
+from struct import pack
+from pathlib import Path
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+import pytest
+
+# ==========================================
+# SHARED FIXTURES
+# ==========================================
+# The bridge modules are flat scripts next to this folder. advanced_monitor
+# is imported with SMARTSTOCK_STATE_DIR pointing at a scratch directory, so
+# its log / outbox / employee snapshot never touch the service's own files.
+# FakeSupabase / FakeZK below are also what bench_sync and zk_simulator run on.
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from zk import const
+from zk.user import User
+from zk.attendance import Attendance
+from attendance_stream import encode_time
+
+DEVICE_IP = '10.9.9.9'
+
+def pytest_configure(config):
+    state = tempfile.TemporaryDirectory(prefix="bridge_tests_", ignore_cleanup_errors=True)
+    config.add_cleanup(state.cleanup)
+    os.environ['SMARTSTOCK_STATE_DIR'] = state.name
+
+# --- FAKE SUPABASE ---
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+class FakeQuery:
+    """Enough of the postgrest builder for this repo: filters, order, limit/range, writes."""
+    def __init__(self, db, table, op='select', payload=None):
+        self.db = db
+        self.table = table
+        self.op = op
+        self.payload = payload
+        self.filters = [] # (kind, column, value, negated)
+        self.order_key = None
+        self.descending = False
+        self.limit_count = None
+        self.range_bounds = None
+        self.on_conflict = 'id'
+        self.ignore_duplicates = False
+        self.negate = False
+
+    def select(self, columns="*", **kwargs):
+        self.op = 'select'
+        return self
+
+    def insert(self, rows, **kwargs):
+        self.op, self.payload = 'insert', rows
+        return self
+
+    def upsert(self, rows, on_conflict='id', ignore_duplicates=False, **kwargs):
+        self.op, self.payload = 'upsert', rows
+        self.on_conflict = on_conflict
+        self.ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, values, **kwargs):
+        self.op, self.payload = 'update', values
+        return self
+
+    def delete(self, **kwargs):
+        self.op = 'delete'
+        return self
+
+    @property
+    def not_(self):
+        self.negate = True
+        return self
+
+    def _filter(self, kind, column, value):
+        self.filters.append((kind, column, value, self.negate))
+        self.negate = False
+        return self
+
+    def eq(self, column, value): return self._filter('eq', column, value)
+    def neq(self, column, value): return self._filter('neq', column, value)
+    def gt(self, column, value): return self._filter('gt', column, value)
+    def gte(self, column, value): return self._filter('gte', column, value)
+    def lt(self, column, value): return self._filter('lt', column, value)
+    def lte(self, column, value): return self._filter('lte', column, value)
+    def in_(self, column, values): return self._filter('in', column, set(values))
+    def is_(self, column, value): return self._filter('is', column, value)
+
+    def or_(self, filters, **kwargs):
+        # "clock_out.is.null,clock_out.lt.<ts>" -> any of the (kind, column, value) clauses
+        clauses = [tuple(clause.split('.', 2)) for clause in filters.split(',')]
+        return self._filter('or', None, [(kind, column, value) for column, kind, value in clauses])
+
+    def order(self, column, desc=False, **kwargs):
+        self.order_key, self.descending = column, desc
+        return self
+
+    def limit(self, count, **kwargs):
+        self.limit_count = count
+        return self
+
+    def range(self, start, end, **kwargs):
+        self.range_bounds = (start, end)
+        return self
+
+    def execute(self):
+        return FakeResponse(self.db.execute(self))
+
+OPS = {
+    'eq': lambda a, b: a == b,
+    'neq': lambda a, b: a != b,
+    'gt': lambda a, b: a is not None and a > b,
+    'gte': lambda a, b: a is not None and a >= b,
+    'lt': lambda a, b: a is not None and a < b,
+    'lte': lambda a, b: a is not None and a <= b,
+    'in': lambda a, b: a in b,
+    'is': lambda a, b: a is None if b in (None, 'null') else a == b
+}
+
+def matches(row, kind, column, value):
+    if kind == 'or':
+        return any(matches(row, *clause) for clause in value)
+    return OPS[kind](row.get(column), value)
+
+class FakeSupabase:
+    UNIQUE = {'employees': ('id', 'employee_id_code'), 'attendance': ('id', ), 'devices': ('id', ),
+              'punch_ledger': ('id', ('device_ip', 'device_user_id', 'punched_at'))}
+    LOOKUP = {'attendance': ('employee_id', )} # non-unique indexes (column -> rows)
+    SERIAL = {'punch_ledger'} # BIGSERIAL id + received_at default
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.tables = {}
+        self.index = {}  # (table, column) -> {value: row}
+        self.calls = Counter()
+        self.rows_written = 0
+        self.lock = threading.Lock()
+        self.view_cache = None
+        self.serial = 0
+
+    # --- client API ---
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def rpc(self, fn, params=None, **kwargs):
+        return FakeQuery(self, f"rpc:{fn}", op='rpc', payload=params)
+
+    # --- data ---
+    def seed(self, table, rows):
+        for row in rows:
+            self._add(table, dict(row))
+
+    @staticmethod
+    def _key(row, column):
+        return tuple(row.get(c) for c in column) if isinstance(column, tuple) else row.get(column)
+
+    def _add(self, table, row):
+        if table in self.SERIAL and row.get('id') is None:
+            self.serial += 1
+            row['id'] = self.serial
+            row.setdefault('received_at', datetime.now(timezone.utc).isoformat())
+        self.tables.setdefault(table, []).append(row)
+        for column in self.UNIQUE.get(table, ()):
+            self.index.setdefault((table, column), {})[self._key(row, column)] = row
+        for column in self.LOOKUP.get(table, ()):
+            self.index.setdefault((table, column), {}).setdefault(row.get(column), []).append(row)
+        if table == 'employees':
+            self.view_cache = None
+
+    def rows(self, table):
+        if table != 'employee_shift_view':
+            return self.tables.get(table, [])
+        if self.view_cache is None:
+            self.view_cache = [{
+                "employee_id": e['id'], "employee_id_code": e['employee_id_code'], "name": e['name'],
+                "status": e.get('status'), "xarun_id": e.get('xarun_id'),
+                "late_threshold": "08:00:00", "absent_threshold": e.get('absent_threshold', "09:00:00")
+            } for e in self.tables.get('employees', [])]
+        return self.view_cache
+
+    def _match(self, query):
+        # Single eq on a unique column -> index lookup (like the real primary key)
+        if len(query.filters) == 1 and query.filters[0][0] == 'eq' and not query.filters[0][3]:
+            _, column, value, _ = query.filters[0]
+            index = self.index.get((query.table, column))
+            if index is not None:
+                row = index.get(value)
+                return [row] if row is not None else []
+        candidates = self.rows(query.table)
+        for kind, column, value, negate in query.filters:
+            if kind == 'eq' and not negate and column in self.LOOKUP.get(query.table, ()):
+                candidates = self.index.get((query.table, column), {}).get(value, [])
+                break
+            if kind == 'in' and not negate and column in self.LOOKUP.get(query.table, ()):
+                index = self.index.get((query.table, column), {})
+                candidates = [row for v in value for row in index.get(v, [])]
+                break
+        out = []
+        for row in candidates:
+            if all(matches(row, kind, column, value) != negate for kind, column, value, negate in query.filters):
+                out.append(row)
+        return out
+
+    def execute(self, query):
+        with self.lock:
+            self.calls[(query.table, query.op)] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            return getattr(self, f"_do_{query.op}")(query)
+
+    def _do_rpc(self, query):
+        if query.table == 'rpc:ingest_punches':
+            return self._ingest_punches(**query.payload)
+        return []
+
+    def _ingest_punches(self, p_punches, p_source='live', p_debounce_seconds=0):
+        """Stand-in for public.ingest_punches (database_updates_sync.sql): same folding and rules."""
+        from attendance_fold import clock_in_class, LIVE_NOTES, HISTORY_NOTES
+        view = {row['employee_id_code']: row for row in self.rows('employee_shift_view')}
+        parsed = []
+        days = {} # (employee_id, date) -> [emp, (first_ts, i), (last_ts, i), punch of the last]
+        for i, punch in enumerate(p_punches):
+            ts = datetime.fromisoformat(punch['ts']) if punch.get('ts') else None
+            emp = view.get(punch.get('code')) if ts else None
+            key = (emp['employee_id'], ts.date().isoformat()) if emp else None
+            parsed.append((i, ts, key))
+            if key is None:
+                continue
+            day = days.setdefault(key, [emp, (ts, i), (ts, i), punch])
+            day[1] = min(day[1], (ts, i))
+            if (ts, i) > day[2]:
+                day[2], day[3] = (ts, i), punch
+
+        def stored(value):
+            return datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=None) if value else None
+
+        results = {}
+        notes = HISTORY_NOTES if p_source == 'history' else LIVE_NOTES
+        for key in sorted(days):
+            emp, (first, _), (last, _), punch = days[key]
+            rows = [r for r in self.index.get(('attendance', 'employee_id'), {}).get(key[0], []) if r.get('date') == key[1]]
+            if not rows:
+                klass = clock_in_class(first.strftime("%H:%M:%S"), emp)
+                row = {
+                    "id": f"att-{len(self.tables.get('attendance', [])) + 1}", "employee_id": key[0], "date": key[1],
+                    "status": 'PRESENT' if klass == 'on_time' else 'LATE',
+                    "clock_in": first.isoformat(), "clock_out": last.isoformat() if last > first else None,
+                    "device_id": punch.get('device_label'), "device_uuid": punch.get('device_uuid'), "notes": notes[klass]
+                }
+                self._add('attendance', row)
+                self.rows_written += 1
+                results[key] = (row['id'], True, last > first)
+                continue
+            current = rows[0]
+            clock_in, clock_out = stored(current.get('clock_in')), stored(current.get('clock_out'))
+            moved = (clock_in is not None and last > clock_in and (clock_out is None or last > clock_out)
+                     and last >= (clock_out or clock_in) + timedelta(seconds=p_debounce_seconds))
+            if moved:
+                current.update({"clock_out": last.isoformat(), "device_id": punch.get('device_label'),
+                                "device_uuid": punch.get('device_uuid')})
+                self.rows_written += 1
+            results[key] = (current['id'], False, moved)
+
+        # One outcome per punch, like the function's final SELECT
+        firsts = {key: day[1][1] for key, day in days.items()}
+        lasts = {key: day[2][1] for key, day in days.items()}
+        out = []
+        for i, ts, key in parsed:
+            row = {"idx": i, "outcome": 'folded', "employee_id": key[0] if key else None,
+                   "date": key[1] if key else None, "attendance_id": results[key][0] if key else None}
+            if ts is None:
+                row["outcome"] = 'invalid'
+            elif key is None:
+                row["outcome"] = 'unknown_employee'
+            elif results[key][1] and firsts[key] == i:
+                row["outcome"] = 'clock_in'
+            elif results[key][2] and lasts[key] == i:
+                row["outcome"] = 'clock_out'
+            elif not results[key][1] and lasts[key] == i:
+                row["outcome"] = 'skipped'
+            out.append(row)
+        return out
+
+    def _do_select(self, query):
+        rows = self._match(query)
+        if query.order_key:
+            rows = sorted(rows, key=lambda r: r.get(query.order_key) or '', reverse=query.descending)
+        if query.range_bounds:
+            rows = rows[query.range_bounds[0]:query.range_bounds[1] + 1]
+        if query.limit_count is not None:
+            rows = rows[:query.limit_count]
+        return [dict(r) for r in rows]
+
+    def _conflict(self, table, row):
+        for column in self.UNIQUE.get(table, ()):
+            existing = self.index.get((table, column), {}).get(self._key(row, column))
+            if existing is not None:
+                return existing
+        return None
+
+    def _do_insert(self, query):
+        rows = query.payload if isinstance(query.payload, list) else [query.payload]
+        for row in rows:
+            if self._conflict(query.table, row) is not None:
+                raise Exception("duplicate key value violates unique constraint (23505)")
+        for row in rows:
+            self._add(query.table, dict(row))
+        self.rows_written += len(rows)
+        return [dict(r) for r in rows]
+
+    def _do_upsert(self, query):
+        rows = query.payload if isinstance(query.payload, list) else [query.payload]
+        columns = tuple(c.strip() for c in query.on_conflict.split(','))
+        column = columns[0] if len(columns) == 1 else columns
+        out = []
+        for row in rows:
+            existing = self.index.get((query.table, column), {}).get(self._key(row, column))
+            if existing is None:
+                row = dict(row)
+                self._add(query.table, row)
+                out.append(dict(row))
+            elif not query.ignore_duplicates:
+                existing.update(row)
+                out.append(dict(existing))
+                if query.table == 'employees':
+                    self.view_cache = None
+        self.rows_written += len(out)
+        return out
+
+    def _do_update(self, query):
+        rows = self._match(query)
+        for row in rows:
+            row.update(query.payload)
+        if query.table == 'employees' and rows:
+            self.view_cache = None
+        self.rows_written += len(rows)
+        return [dict(r) for r in rows]
+
+    def _do_delete(self, query):
+        rows = self._match(query)
+        doomed = {id(r) for r in rows}
+        kept = [r for r in self.rows(query.table) if id(r) not in doomed]
+        self.tables[query.table] = []
+        for column in self.UNIQUE.get(query.table, ()) + self.LOOKUP.get(query.table, ()):
+            self.index.pop((query.table, column), None)
+        for row in kept:
+            self._add(query.table, row)
+        return [dict(r) for r in rows]
+
+    def reset_counts(self):
+        self.calls.clear()
+        self.rows_written = 0
+
+    def requests(self):
+        return sum(self.calls.values())
+
+    def breakdown(self):
+        return ', '.join(f"{table}:{op}={n}" for (table, op), n in sorted(self.calls.items()))
+
+# --- FAKE ZK DEVICE ---
+class FakeZK:
+    """
+    A connected scanner: get_users() plus the read-with-buffer calls that
+    attendance_stream makes (40-byte records). Each device round trip sleeps
+    `latency`; round_trips counts them.
+    """
+    tcp = True
+
+    def __init__(self, users, punches, latency=0.0):
+        self.users = users
+        self.punches = punches
+        self.latency = latency
+        self.records = len(punches)
+        self.round_trips = 0
+        self.buffer = None
+        self._ZK__data = b''
+        self._ZK__tcp_length = 0
+
+    def _trip(self):
+        self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def connect(self): self._trip(); return self
+    def disconnect(self): self._trip()
+    def disable_device(self): self._trip()
+    def enable_device(self): self._trip()
+    def free_data(self): self._trip()
+
+    def read_sizes(self):
+        self._trip()
+        self.records = len(self.punches)
+        return True
+
+    def get_users(self):
+        self._trip()
+        return self.users
+
+    def get_attendance(self):
+        self._trip()
+        return [Attendance(user_id, ts, 1, 0, 0) for user_id, ts in self.punches]
+
+    def _pack(self):
+        if self.buffer is None:
+            body = b''.join(
+                pack('<H24sBIB8s', 0, user_id.encode(), 1, encode_time(ts), 0, b'') for user_id, ts in self.punches
+            )
+            self.buffer = pack('I', len(body)) + body
+        return self.buffer
+
+    def _ZK__send_command(self, command, command_string=b'', response_size=8):
+        self._trip()
+        self._ZK__data = b'\x00' + pack('I', len(self._pack()))
+        return {'status': True, 'code': const.CMD_PREPARE_DATA}
+
+    def _ZK__read_chunk(self, start, size):
+        self._trip()
+        return self._pack()[start:start + size]
+
+    def _ZK__recieve_raw_data(self, size):
+        return b''
+
+# --- SYNTHETIC DATA ---
+def make_users(count):
+    return [User(i, f"Shaqaale {i}", 0, '', '', str(1000 + i)) for i in range(1, count + 1)]
+
+def make_employees(users, placeholder_ratio=0.0, xarun_id='x1'):
+    rows = []
+    for user in users:
+        placeholder = random.random() < placeholder_ratio
+        rows.append({
+            "id": f"emp-{user.user_id:0>8}", "employee_id_code": user.user_id,
+            "name": f"Staff {user.user_id}" if placeholder else user.name,
+            "status": "ACTIVE", "xarun_id": xarun_id
+        })
+    return rows
+
+
+# --- FIXTURES ---
+
+@pytest.fixture
+def users():
+    return make_users(5)
+
+@pytest.fixture
+def db(users):
+    db = FakeSupabase()
+    db.seed('employees', make_employees(users))
+    db.seed('devices', [{"id": "dev-1", "ip_address": DEVICE_IP, "last_log_at": None}])
+    return db
+
+@pytest.fixture
+def device():
+    return {'id': 'dev-1', 'name': 'test', 'ip_address': DEVICE_IP, 'xarun_id': 'x1'}
+
+@pytest.fixture
+def am(db, tmp_path, monkeypatch):
+    """advanced_monitor on a fresh FakeSupabase, row-by-row writes, its own outbox."""
+    import advanced_monitor as am
+    from metrics import InstrumentedClient
+    from open_day import OpenDayState
+    from employee_snapshot import DeviceSnapshot
+    from punch_outbox import PunchOutbox
+    from scan_debounce import ScanDebouncer
+    assert am.state_dir.resolve() != am.base_dir.resolve()
+    for flag in ('INGEST_MODE', 'PUNCH_LEDGER', 'SCAN_DEBOUNCE_SECONDS'):
+        monkeypatch.delenv(flag, raising=False)
+    monkeypatch.setattr(am, 'supabase', InstrumentedClient(db))
+    monkeypatch.setattr(am, 'open_day', OpenDayState())
+    monkeypatch.setattr(am, 'scan_debouncer', ScanDebouncer())
+    monkeypatch.setattr(am, 'catchup_pending', set())
+    monkeypatch.setattr(am, 'catchup_deferred', {})
+    monkeypatch.setattr(am, 'device_snapshot', DeviceSnapshot(tmp_path / "device_snapshot.json"))
+    monkeypatch.setattr(am, 'outbox', PunchOutbox(tmp_path / "punch_outbox.db"))
+    am.employee_cache.refresh(force=True)
+    return am
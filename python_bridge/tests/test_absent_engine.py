@@ -0,0 +1,80 @@
+
+from datetime import datetime
+import pytest
+from absent_engine import AbsentEngine, parse_off_days
+from conftest import FakeSupabase
+from employee_directory import EmployeeEntry
+from open_day import OpenDayState
+
+DAY = datetime(2024, 5, 6) # a Monday
+
+def at(hour, minute=0):
+    return DAY.replace(hour=hour, minute=minute)
+
+@pytest.fixture
+def directory():
+    # Two shifts in x1, one in x2; e6 is inactive
+    return {
+        '1': EmployeeEntry('e1', 'A', '08:00:00', '08:30:00', 'x1'),
+        '2': EmployeeEntry('e2', 'B', '08:00:00', '08:30:00', 'x1'),
+        '3': EmployeeEntry('e3', 'C', '13:30:00', '14:00:00', 'x1'),
+        '4': EmployeeEntry('e4', 'D', '08:30:00', '09:00:00', 'x2'),
+        '5': EmployeeEntry('e5', 'E', '08:30:00', '09:00:00', 'x2'),
+        '6': EmployeeEntry('e6', 'F', '08:00:00', '08:30:00', 'x1', 'INACTIVE'),
+    }
+
+@pytest.fixture
+def open_day():
+    state = OpenDayState()
+    state.date = DAY.strftime("%Y-%m-%d")
+    return state
+
+def absent(db):
+    return sorted(r['employee_id'] for r in db.rows('attendance') if r['status'] == 'ABSENT')
+
+def test_groups_are_marked_when_their_threshold_passes(directory, open_day):
+    db = FakeSupabase()
+    engine = AbsentEngine()
+    assert engine.tick(db, directory, open_day, now=at(8, 29)) == 0
+    assert engine.tick(db, directory, open_day, now=at(8, 30)) == 2
+    assert absent(db) == ['e1', 'e2']
+    assert engine.tick(db, directory, open_day, now=at(9, 0)) == 2
+    assert engine.tick(db, directory, open_day, now=at(14, 0)) == 1
+    assert absent(db) == ['e1', 'e2', 'e3', 'e4', 'e5'] # never the inactive one
+
+def test_present_in_memory_or_db_is_not_marked(directory, open_day):
+    db = FakeSupabase()
+    db.seed('attendance', [{"id": "a1", "employee_id": "e2", "date": "2024-05-06", "status": "PRESENT"}])
+    open_day.remember('e1', open_day.date, {"id": "a0", "clock_in": at(8).isoformat(), "clock_out": None})
+    engine = AbsentEngine()
+    assert engine.tick(db, directory, open_day, now=at(8, 45)) == 0
+    assert absent(db) == []
+
+def test_decided_employees_are_not_read_again(directory, open_day):
+    db = FakeSupabase()
+    engine = AbsentEngine()
+    engine.tick(db, directory, open_day, now=at(8, 30))
+    db.reset_counts()
+    assert engine.tick(db, directory, open_day, now=at(8, 31)) == 0
+    assert db.requests() == 0
+
+def test_restart_does_not_insert_twice(directory, open_day):
+    db = FakeSupabase()
+    AbsentEngine().tick(db, directory, open_day, now=at(8, 30))
+    assert AbsentEngine().tick(db, directory, OpenDayState(), now=at(8, 31)) == 0
+    assert absent(db) == ['e1', 'e2']
+
+def test_force_ignores_thresholds(directory, open_day):
+    db = FakeSupabase()
+    assert AbsentEngine().tick(db, directory, open_day, now=at(7), force=True) == 5
+
+def test_off_day_marks_nobody(directory, open_day):
+    db = FakeSupabase()
+    assert AbsentEngine().tick(db, directory, open_day, off_days=parse_off_days('mon'), now=at(15)) == 0
+    assert absent(db) == []
+
+def test_parse_off_days():
+    assert parse_off_days('Friday') == {4}
+    assert parse_off_days('fri, sat') == {4, 5}
+    assert parse_off_days('6') == {6}
+    assert parse_off_days('') == set()
@@ -0,0 +1,73 @@
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+import attendance_fold
+from attendance_fold import fold_punches, plan_changes, reconcile_days, fetch_attendance_window, LIVE_NOTES
+from conftest import FakeSupabase
+
+Log = namedtuple('Log', 'user_id timestamp')
+DAY = datetime(2024, 5, 6)
+EMP_MAP = {
+    '1': {'employee_id': 'e1', 'late_threshold': '08:00:00', 'absent_threshold': '09:00:00'},
+    '2': {'employee_id': 'e2', 'late_threshold': '08:00:00', 'absent_threshold': '09:00:00'},
+}
+
+def at(hour, minute=0, day=0):
+    return DAY + timedelta(days=day, hours=hour, minutes=minute)
+
+def test_fold_keeps_first_and_last_per_employee_day():
+    logs = [Log(1, at(12)), Log(1, at(8)), Log(1, at(17)), Log(2, at(9, 5)), Log(1, at(8, 30, day=1)), Log(99, at(8))]
+    days = fold_punches(logs, EMP_MAP)
+    assert {key: (first, last) for key, (_, first, last) in days.items()} == {
+        ('e1', '2024-05-06'): (at(8), at(17)),
+        ('e2', '2024-05-06'): (at(9, 5), at(9, 5)),
+        ('e1', '2024-05-07'): (at(8, 30, day=1), at(8, 30, day=1)),
+    }
+
+def test_fold_drops_logs_before_start_date():
+    days = fold_punches([Log(1, at(8)), Log(1, at(8, day=1))], EMP_MAP, start_date=at(0, day=1))
+    assert list(days) == [('e1', '2024-05-07')]
+
+def test_plan_changes_inserts_updates_and_skips():
+    days = fold_punches([Log(1, at(7, 50)), Log(1, at(17)), Log(2, at(9, 30)), Log(2, at(16))], EMP_MAP)
+    days.update(fold_punches([Log(1, at(8, day=1))], EMP_MAP))
+    existing = {
+        ('e2', '2024-05-06'): {'id': 'a2', 'clock_in': at(8).isoformat(), 'clock_out': at(18).isoformat()},
+        ('e1', '2024-05-07'): {'id': 'a3', 'clock_in': at(7, day=1).isoformat(), 'clock_out': None},
+    }
+    inserts, updates, skipped = plan_changes(days, existing, 'Gate', 'dev-1')
+    assert [(r['employee_id'], r['status'], r['clock_in'], r['clock_out'], r['notes']) for r in inserts] == [
+        ('e1', 'PRESENT', at(7, 50).isoformat(), at(17).isoformat(), LIVE_NOTES['on_time'])]
+    assert [(r['id'], r['clock_out']) for r in updates] == [('a3', at(8, day=1).isoformat())]
+    assert skipped == 1 # e2's 16:00 does not move the 18:00 clock-out back
+
+def test_single_punch_day_has_no_clock_out():
+    inserts, _, _ = plan_changes(fold_punches([Log(2, at(9, 15))], EMP_MAP), {}, 'Gate', None)
+    assert (inserts[0]['status'], inserts[0]['clock_out']) == ('LATE', None)
+
+def seeded_db():
+    db = FakeSupabase()
+    rows = [{"id": f"a{i:02}", "employee_id": f"x{i}", "date": "2024-05-06"} for i in range(10)]
+    rows += [{"id": f"b{i}", "employee_id": "e1", "date": f"2024-05-0{i + 5}"} for i in range(3)]
+    db.seed('attendance', rows)
+    return db
+
+def test_window_read_is_filtered_and_keyset_paged(monkeypatch):
+    monkeypatch.setattr(attendance_fold, 'PAGE_SIZE', 2)
+    db = seeded_db()
+    existing = fetch_attendance_window(db, "2024-05-05", "2024-05-07", {'e1'})
+    assert sorted(row['id'] for row in existing.values()) == ['b0', 'b1', 'b2']
+    assert db.breakdown() == "attendance:select=2" # other employees' rows never leave the server
+
+def test_window_read_chunks_employee_ids(monkeypatch):
+    monkeypatch.setattr(attendance_fold, 'ID_CHUNK', 4)
+    db = seeded_db()
+    existing = fetch_attendance_window(db, "2024-05-06", "2024-05-06", {f"x{i}" for i in range(10)} | {'e1'})
+    assert len(existing) == 11
+    assert db.breakdown() == "attendance:select=3"
+
+def test_reconcile_twice_writes_nothing_new():
+    db = FakeSupabase()
+    days = fold_punches([Log(1, at(8)), Log(1, at(17))], EMP_MAP)
+    assert reconcile_days(db, days, 'Gate', None)['inserted'] == 1
+    assert reconcile_days(db, days, 'Gate', None) == {"inserted": 0, "updated": 0, "skipped": 1, "failed": 0}
@@ -0,0 +1,72 @@
+
+from struct import pack
+from datetime import datetime, timedelta
+from attendance_stream import stream_attendance, encode_time, decode_time
+from conftest import FakeZK, make_users
+
+T0 = datetime(2024, 5, 6, 7, 0, 0)
+
+def punches_for(users, count):
+    return [(users[i % len(users)].user_id, T0 + timedelta(minutes=i)) for i in range(count)]
+
+def flat(chunks):
+    return [(log.user_id, log.timestamp) for chunk in chunks for log in chunk]
+
+class ShortRecordZK(FakeZK):
+    """Older firmware: 8-byte records carrying the uid, not the user_id."""
+    def _pack(self):
+        if self.buffer is None:
+            uid_of = {u.user_id: u.uid for u in self.users}
+            body = b''.join(pack('<HBIB', uid_of[user_id], 1, encode_time(ts), 0) for user_id, ts in self.punches)
+            self.buffer = pack('I', len(body)) + body
+        return self.buffer
+
+class OldPyzk:
+    """A connection without the pyzk internals the streaming reader needs."""
+    def __init__(self, zk):
+        self.zk = zk
+        self.records = 0
+
+    def read_sizes(self):
+        self.records = len(self.zk.punches)
+
+    def get_attendance(self):
+        return self.zk.get_attendance()
+
+def test_time_packing_round_trips():
+    for ts in (datetime(2000, 1, 1), datetime(2024, 2, 29, 23, 59, 59), T0):
+        assert decode_time(encode_time(ts)) == ts
+
+def test_streams_every_record_in_chunks():
+    users = make_users(3)
+    punches = punches_for(users, 25)
+    stats = {}
+    chunks = list(stream_attendance(FakeZK(users, punches), chunk_size=10, stats=stats))
+    assert [len(c) for c in chunks] == [10, 10, 5]
+    assert flat(chunks) == punches
+    assert stats == {'records': 25, 'scanned': 25, 'kept': 25}
+
+def test_filters_by_time_and_user_while_parsing():
+    users = make_users(3)
+    punches = punches_for(users, 30)
+    start, end = T0 + timedelta(minutes=5), T0 + timedelta(minutes=20)
+    stats = {}
+    kept = flat(stream_attendance(FakeZK(users, punches), start=start, end=end, user_ids={users[0].user_id}, stats=stats))
+    assert kept == [p for p in punches if start <= p[1] <= end and p[0] == users[0].user_id]
+    assert (stats['scanned'], stats['kept']) == (30, len(kept))
+
+def test_short_records_map_uid_to_user_id():
+    users = make_users(3)
+    punches = punches_for(users, 6)
+    assert flat(stream_attendance(ShortRecordZK(users, punches))) == punches
+
+def test_empty_buffer_yields_nothing():
+    assert list(stream_attendance(FakeZK(make_users(1), []))) == []
+
+def test_falls_back_to_get_attendance_without_pyzk_internals():
+    users = make_users(2)
+    punches = punches_for(users, 5)
+    stats = {}
+    chunks = list(stream_attendance(OldPyzk(FakeZK(users, punches)), chunk_size=2, start=T0 + timedelta(minutes=1), stats=stats))
+    assert flat(chunks) == punches[1:]
+    assert (stats['scanned'], stats['kept']) == (5, 4)
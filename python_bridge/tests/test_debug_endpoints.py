@@ -0,0 +1,21 @@
+
+import pytest
+
+@pytest.fixture
+def client(am):
+    return am.app.test_client()
+
+@pytest.mark.parametrize('query', ['limit=abc', 'limit=0', 'limit=-5', 'limit=1.5', 'limit='])
+def test_spans_rejects_bad_limit(client, query):
+    assert client.get(f'/debug/spans?{query}').status_code == 400
+
+def test_spans_limit(client, am):
+    for i in range(3):
+        with am.span("test.span", device='10.9.9.9'):
+            pass
+    assert client.get('/debug/spans').status_code == 200
+    assert len(client.get('/debug/spans?name=test.span&limit=2').get_json()['spans']) == 2
+
+@pytest.mark.parametrize('query', ['seconds=abc', 'seconds=0', 'interval=-1', 'seconds=inf', 'seconds=nan'])
+def test_profile_rejects_bad_parameters(client, query):
+    assert client.get(f'/debug/profile?{query}').status_code == 400
@@ -0,0 +1,71 @@
+
+import threading
+import time
+from employee_cache import EmployeeCache
+
+class Loader:
+    def __init__(self, data, gate=None):
+        self.data = data
+        self.gate = gate
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.gate:
+            self.gate.wait(5)
+        if isinstance(self.data, Exception):
+            raise self.data
+        return dict(self.data)
+
+def test_concurrent_refreshes_share_one_load():
+    gate = threading.Event()
+    loader = Loader({'1': 'A'}, gate)
+    cache = EmployeeCache(loader)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.refresh(force=True))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    while not cache.refreshing:
+        time.sleep(0.001)
+    time.sleep(0.05) # let the others queue up behind the running load
+    gate.set()
+    for t in threads:
+        t.join()
+    assert loader.calls == 1
+    assert results == [True] * 5
+    assert cache.stats()['coalesced'] == 4
+
+def test_miss_driven_reloads_are_rate_limited():
+    loader = Loader({'1': 'A'})
+    cache = EmployeeCache(loader, min_interval=60)
+    assert cache.refresh()
+    assert not cache.refresh()
+    assert (loader.calls, cache.stats()['rate_limited']) == (1, 1)
+    assert cache.refresh(force=True) and loader.calls == 2
+
+def test_unknown_id_is_negative_cached():
+    loader = Loader({'1': 'A'})
+    cache = EmployeeCache(loader, min_interval=0)
+    assert cache.resolve('1') == 'A' and loader.calls == 1
+    assert cache.resolve('9') is None
+    assert cache.resolve('9') is None
+    assert (loader.calls, cache.stats()['negative_hits']) == (2, 1)
+
+def test_negative_entry_expires_and_put_clears_it():
+    loader = Loader({})
+    cache = EmployeeCache(loader, min_interval=0, negative_ttl=0)
+    cache.resolve('9')
+    time.sleep(0.01)
+    cache.resolve('9')
+    assert loader.calls == 2 # expired -> reloaded again
+    cache.mark_missing('8')
+    cache.put('8', 'H')
+    assert not cache.is_known_missing('8') and cache.resolve('8') == 'H'
+
+def test_failed_load_keeps_the_old_directory():
+    loader = Loader({'1': 'A'})
+    cache = EmployeeCache(loader)
+    cache.refresh(force=True)
+    loader.data = RuntimeError("timeout")
+    assert not cache.refresh(force=True)
+    assert cache.get('1') == 'A' and cache.stats()['refresh_errors'] == 1
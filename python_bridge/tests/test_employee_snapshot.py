@@ -0,0 +1,73 @@
+
+import sqlite3
+import employee_snapshot
+from employee_directory import EmployeeEntry
+from employee_snapshot import EmployeeSnapshot, DeviceSnapshot
+
+def directory():
+    return {
+        '1001': EmployeeEntry('emp-1', 'Cali Axmed', '08:15', '10:00', 'x1', 'ACTIVE'),
+        '1002': EmployeeEntry('emp-2', 'Xaliimo', '08:15', '10:00', None, None),
+    }
+
+def as_tuples(entries):
+    return {zk_id: tuple(getattr(e, f) for f in employee_snapshot.FIELDS) for zk_id, e in entries.items()}
+
+def test_round_trip(tmp_path):
+    path = tmp_path / 'employees.db'
+    assert EmployeeSnapshot(path).load() is None # no file yet
+    assert EmployeeSnapshot(path).save(directory())
+    snapshot = EmployeeSnapshot(path) # next start
+    loaded = snapshot.load()
+    assert as_tuples(loaded) == as_tuples(directory())
+    assert snapshot.stats()['loaded_at_startup'] and snapshot.count == 2
+
+def test_unchanged_directory_is_not_rewritten(tmp_path):
+    snapshot = EmployeeSnapshot(tmp_path / 'employees.db')
+    assert snapshot.save(directory())
+    assert not snapshot.save(directory())
+    changed = directory()
+    changed['1002'].name = 'Xaliimo Cabdi'
+    assert snapshot.save(changed)
+    assert (snapshot.saves, snapshot.unchanged) == (2, 1)
+
+def test_loaded_version_skips_the_first_save(tmp_path):
+    path = tmp_path / 'employees.db'
+    EmployeeSnapshot(path).save(directory())
+    snapshot = EmployeeSnapshot(path)
+    snapshot.load()
+    assert not snapshot.save(directory()) # the reload found nothing new
+
+def test_other_format_is_ignored(tmp_path, monkeypatch):
+    path = tmp_path / 'employees.db'
+    EmployeeSnapshot(path).save(directory())
+    monkeypatch.setattr(employee_snapshot, 'SNAPSHOT_FORMAT', employee_snapshot.SNAPSHOT_FORMAT + 1)
+    assert EmployeeSnapshot(path).load() is None
+
+def test_corrupt_file_is_ignored(tmp_path):
+    path = tmp_path / 'employees.db'
+    path.write_bytes(b'not a database')
+    snapshot = EmployeeSnapshot(path)
+    assert snapshot.load() is None and snapshot.errors == 1
+
+def test_failed_write_keeps_the_previous_snapshot(tmp_path, monkeypatch):
+    path = tmp_path / 'employees.db'
+    EmployeeSnapshot(path).save(directory())
+    def broken_connect(*args, **kwargs):
+        raise sqlite3.OperationalError("disk I/O error")
+    monkeypatch.setattr(employee_snapshot.sqlite3, 'connect', broken_connect)
+    snapshot = EmployeeSnapshot(path)
+    assert not snapshot.save({})
+    monkeypatch.undo()
+    assert len(EmployeeSnapshot(path).load()) == 2
+
+def test_device_snapshot(tmp_path):
+    path = tmp_path / 'devices.json'
+    devices = [{"id": "dev-1", "ip_address": "10.0.0.5", "is_active": True}]
+    assert DeviceSnapshot(path).load() is None
+    snapshot = DeviceSnapshot(path)
+    assert snapshot.save(devices)
+    assert not snapshot.save(devices)
+    assert DeviceSnapshot(path).load() == devices
+    path.write_text('{broken', encoding='utf-8')
+    assert DeviceSnapshot(path).load() is None
@@ -0,0 +1,54 @@
+
+import random
+from collections import namedtuple
+from datetime import datetime, timedelta
+import attendance_fold
+from attendance_fold import fold_punches, fold_punches_columnar, fold_punches_fast, clock_in_class
+
+Log = namedtuple('Log', 'user_id timestamp')
+START = datetime(2024, 3, 1)
+
+def emp_map():
+    emps = {}
+    for code in range(1, 41):
+        emps[str(code)] = {'employee_id': f"e{code}", 'late_threshold': random.choice(['07:30:00', '08:00', None]),
+                           'absent_threshold': random.choice(['09:00:00', '10:15:30', None])}
+    emps['41'] = emps['1'] # two codes for one employee (re-enrolled finger)
+    return emps
+
+def random_logs(count):
+    # Unsorted, unknown codes included, some on the same second
+    return [Log(random.randint(1, 45), START + timedelta(days=random.randrange(60), seconds=random.randrange(86400)))
+            for _ in range(count)]
+
+def pure(logs, emps, start_date=None):
+    days = fold_punches(logs, emps, start_date)
+    return {key: (emp['employee_id'], first, last, clock_in_class(first.strftime("%H:%M:%S"), emp))
+            for key, (emp, first, last) in days.items()}
+
+def columnar(logs, emps, start_date=None):
+    return {key: (emp['employee_id'], first, last, klass)
+            for key, (emp, first, last, klass) in fold_punches_columnar(logs, emps, start_date).items()}
+
+def test_columnar_fold_matches_pure_fold():
+    random.seed(11)
+    emps = emp_map()
+    logs = random_logs(20000)
+    assert columnar(logs, emps) == pure(logs, emps)
+    start = START + timedelta(days=30, hours=12)
+    assert columnar(logs, emps, start) == pure(logs, emps, start)
+
+def test_columnar_fold_edge_cases():
+    emps = emp_map()
+    assert fold_punches_columnar([], emps) == {}
+    assert fold_punches_columnar([Log(99, START)], emps) == {}
+    logs = [Log(1, START.replace(hour=23, minute=59, second=59)), Log(41, START + timedelta(days=1)), Log(1, START)]
+    assert columnar(logs, emps) == pure(logs, emps)
+
+def test_fast_fold_uses_numpy_for_large_inputs(monkeypatch):
+    calls = []
+    monkeypatch.setattr(attendance_fold, 'fold_punches_columnar', lambda *args: calls.append(len(args[0])) or {})
+    monkeypatch.setattr(attendance_fold, 'COLUMNAR_MIN_LOGS', 10)
+    fold_punches_fast(random_logs(9), emp_map())
+    fold_punches_fast(random_logs(10), emp_map())
+    assert calls == [10]
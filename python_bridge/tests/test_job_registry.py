@@ -0,0 +1,57 @@
+
+import time
+import threading
+from job_registry import JobRegistry
+
+def wait(job, timeout=5):
+    deadline = time.time() + timeout
+    while job.finished_at is None and time.time() < deadline:
+        time.sleep(0.001)
+    return job
+
+def test_second_request_joins_the_running_job():
+    registry = JobRegistry()
+    gate = threading.Event()
+    def work(job):
+        gate.wait(5)
+        job.update(downloaded=10, processed=10, written=4)
+        return {"written": 4}
+    job, created = registry.submit('sync_logs', '10.0.0.1', work)
+    again, created_again = registry.submit('sync_logs', '10.0.0.1', work)
+    other, created_other = registry.submit('sync_logs', '10.0.0.2', lambda job: None)
+    assert created and not created_again and created_other
+    assert again is job and other is not job
+    gate.set()
+    info = wait(job).to_dict()
+    assert info['status'] == 'done' and info['result'] == {"written": 4}
+    assert info['progress'] == {"downloaded": 10, "processed": 10, "written": 4}
+    assert info['coalesced_requests'] == 1
+    assert registry.stats()['coalesced'] == 1
+
+def test_finished_job_frees_the_slot():
+    registry = JobRegistry()
+    first, _ = registry.submit('sync_users', 'ip', lambda job: 1)
+    wait(first)
+    second, created = registry.submit('sync_users', 'ip', lambda job: 2)
+    assert created and second is not first
+    assert wait(second).result == 2
+
+def test_failure_is_recorded():
+    registry = JobRegistry()
+    def fail(job):
+        raise ConnectionError("device unreachable")
+    job, _ = registry.submit('sync_logs', 'ip', fail)
+    info = wait(job).to_dict()
+    assert (info['status'], info['error']) == ('failed', "device unreachable")
+    assert registry.stats()['active'] == 0
+
+def test_history_keeps_running_jobs_and_drops_the_oldest_finished():
+    registry = JobRegistry(history=3)
+    gate = threading.Event()
+    running, _ = registry.submit('sync_logs', 'slow', lambda job: gate.wait(5))
+    done = [wait(registry.submit('sync_logs', f"ip{i}", lambda job: i)[0]) for i in range(4)]
+    assert registry.get(running.id) is running
+    assert [registry.get(job.id) for job in done] == [None, None, done[2], done[3]]
+    assert [info['id'] for info in registry.list()] == [done[3].id, done[2].id, running.id] # newest first
+    gate.set()
+    wait(running)
@@ -0,0 +1,99 @@
+
+import gzip
+import queue
+import logging
+import logging.handlers
+import pytest
+import tracing
+from log_pipeline import RecordBuffer, ContextFilter, DroppingQueueHandler, bind, gzip_namer, gzip_rotator
+
+def make_logger(name, *handlers):
+    logger = logging.getLogger(f"test_log_pipeline.{name}")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.handlers = list(handlers)
+    return logger
+
+@pytest.fixture
+def buffer(request):
+    buffer = RecordBuffer(size=5)
+    buffer.setFormatter(logging.Formatter('%(message)s'))
+    buffer.log = make_logger(request.node.name, buffer)
+    return buffer
+
+def messages(records):
+    return [r["message"] for r in records]
+
+def test_query_is_newest_first_and_pages_with_the_cursor(buffer):
+    for i in range(3):
+        buffer.log.info(f"m{i}")
+    records, cursor, truncated = buffer.query()
+    assert messages(records) == ["m2", "m1", "m0"] and cursor == 3 and not truncated
+    buffer.log.info("m3")
+    records, cursor, _ = buffer.query(after=cursor)
+    assert messages(records) == ["m3"] and cursor == 4
+    assert buffer.query(after=cursor)[0] == []
+
+def test_limit_sets_truncated(buffer):
+    for i in range(4):
+        buffer.log.info(f"m{i}")
+    records, cursor, truncated = buffer.query(limit=2)
+    assert messages(records) == ["m3", "m2"] and truncated and cursor == 4
+    assert not buffer.query(after=2, limit=2)[2] # exactly the limit is not truncated
+
+def test_ring_buffer_keeps_the_newest(buffer):
+    for i in range(8):
+        buffer.log.info(f"m{i}")
+    records, cursor, _ = buffer.query(after=1)
+    assert messages(records) == ["m7", "m6", "m5", "m4", "m3"] and cursor == 8
+
+def test_level_and_device_filters(buffer):
+    buffer.log.info("a", extra={"device": "10.0.0.1"})
+    buffer.log.warning("b", extra={"device": "10.0.0.1"})
+    buffer.log.error("c", extra={"device": "10.0.0.2"})
+    assert messages(buffer.query(level="warning")[0]) == ["c", "b"]
+    assert messages(buffer.query(device="10.0.0.1")[0]) == ["b", "a"]
+    assert messages(buffer.query(level="nonsense")[0]) == ["c", "b", "a"]
+
+def test_context_comes_from_extra_then_span_then_thread(buffer):
+    buffer.addFilter(ContextFilter())
+    try:
+        bind(device="thread-ip")
+        buffer.log.info("bound")
+        tracing.local.stack = [{"context": {"device": "span-ip", "employee": "1001"}}]
+        buffer.log.info("span")
+        buffer.log.info("extra", extra={"device": "extra-ip"})
+    finally:
+        tracing.local.stack = []
+        bind()
+    by_message = {r["message"]: r for r in buffer.query()[0]}
+    assert by_message["bound"]["device"] == "thread-ip"
+    assert (by_message["span"]["device"], by_message["span"]["employee"]) == ("span-ip", "1001")
+    assert by_message["extra"]["device"] == "extra-ip"
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = DroppingQueueHandler(queue.Queue(2))
+    log = make_logger("dropping", handler)
+    for i in range(5):
+        log.info(f"m{i}")
+    assert handler.queue.qsize() == 2 and handler.dropped == 3
+
+def test_rotation_gzips_old_generations(tmp_path):
+    path = tmp_path / "monitor_service.log"
+    handler = logging.handlers.RotatingFileHandler(str(path), maxBytes=200, backupCount=2, encoding='utf-8')
+    handler.namer = gzip_namer
+    handler.rotator = gzip_rotator
+    log = make_logger("rotation", handler)
+    for i in range(30):
+        log.info(f"line {i:02} " + "x" * 40)
+    handler.close()
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "monitor_service.log", "monitor_service.log.1.gz", "monitor_service.log.2.gz"]
+    assert "line" in gzip.open(tmp_path / "monitor_service.log.1.gz", 'rt').read()
+
+def test_logs_endpoint_returns_cursor_and_epoch(am):
+    client = am.app.test_client()
+    first = client.get('/logs?limit=1').get_json()
+    assert first["epoch"] == am.log_pipeline.epoch
+    assert first["cursor"] == am.log_pipeline.buffer.seq
+    assert len(first["logs"]) <= 1
@@ -0,0 +1,78 @@
+
+from datetime import datetime, timedelta
+import pytest
+from conftest import FakeSupabase
+from open_day import OpenDayState
+
+TODAY = datetime.now().strftime("%Y-%m-%d")
+DAY = datetime.strptime(TODAY, "%Y-%m-%d")
+
+def at(hour, minute=0):
+    return DAY.replace(hour=hour, minute=minute).isoformat()
+
+@pytest.fixture
+def rows():
+    db = FakeSupabase()
+    db.seed('attendance', [
+        {"id": "a1", "employee_id": "e1", "date": TODAY, "clock_in": at(8), "clock_out": None},
+        {"id": "a2", "employee_id": "e2", "date": TODAY, "clock_in": at(8), "clock_out": at(12)},
+    ])
+    return db
+
+def clock_out(state, db, emp, record_id, when, debounce=0):
+    return state.clock_out(db, emp, TODAY, record_id, {"clock_out": when}, debounce)
+
+def test_warm_answers_today_from_memory(rows):
+    state = OpenDayState()
+    assert state.warm(rows)
+    rows.reset_counts()
+    assert state.get_record(rows, 'e1', TODAY)['id'] == 'a1'
+    assert rows.requests() == 0
+    assert state.get_record(rows, 'e9', TODAY) is None # a miss is confirmed with one read
+    assert rows.requests() == 1
+
+def test_clock_out_moves_forward_and_updates_the_map(rows):
+    state = OpenDayState()
+    state.warm(rows)
+    assert clock_out(state, rows, 'e1', 'a1', at(17))
+    assert rows.rows('attendance')[0]['clock_out'] == at(17)
+    assert state.get_record(rows, 'e1', TODAY)['clock_out'] == at(17)
+
+def test_stale_map_never_overwrites_a_later_clock_out(rows):
+    state = OpenDayState()
+    state.warm(rows)
+    rows.rows('attendance')[0]['clock_out'] = at(18) # app.py / the dashboard, behind our back
+    assert not clock_out(state, rows, 'e1', 'a1', at(17))
+    assert rows.rows('attendance')[0]['clock_out'] == at(18)
+    assert state.stats()['stale'] == 1
+    assert state.get_record(rows, 'e1', TODAY)['clock_out'] == at(18) # dropped entry is read again
+
+def test_clock_out_is_never_before_clock_in(rows):
+    state = OpenDayState()
+    state.warm(rows)
+    assert not clock_out(state, rows, 'e1', 'a1', at(7))
+    assert rows.rows('attendance')[0]['clock_out'] is None
+
+def test_debounce_is_checked_by_the_update(rows):
+    state = OpenDayState()
+    state.warm(rows)
+    assert not clock_out(state, rows, 'e2', 'a2', at(12, 1), debounce=120)
+    assert clock_out(state, rows, 'e2', 'a2', at(12, 2), debounce=120)
+
+def test_deleted_row_is_forgotten(rows):
+    state = OpenDayState()
+    state.warm(rows)
+    rows.tables['attendance'].pop(0)
+    rows.index[('attendance', 'id')].pop('a1')
+    assert not clock_out(state, rows, 'e1', 'a1', at(17))
+    assert state.stats()['open_records'] == 1
+
+def test_push_attendance_rereads_instead_of_overwriting(am, db, users, device):
+    user = users[0]
+    emp_uuid = am.employee_cache.get(user.user_id)['uuid']
+    start = DAY.replace(hour=8)
+    assert am.push_attendance(user.user_id, start, device)
+    db.rows('attendance')[0]['clock_out'] = at(18) # a later clock_out written elsewhere
+    assert am.push_attendance(user.user_id, start + timedelta(hours=9), device) is False
+    assert db.rows('attendance')[0]['clock_out'] == at(18)
+    assert am.open_day.get_record(db, emp_uuid, TODAY)['clock_out'] == at(18)
@@ -0,0 +1,36 @@
+
+from datetime import datetime, timedelta
+import pytest
+from punch_ingest import summarize
+
+TODAY = datetime.now().replace(hour=7, minute=0, second=0, microsecond=0)
+
+@pytest.fixture
+def rpc(am, monkeypatch):
+    monkeypatch.setenv('INGEST_MODE', 'rpc')
+    am.open_day.warm(am.supabase)
+    return am
+
+def test_source_reaches_the_function(rpc, db, users, device):
+    rpc.ingest_punches([(users[0].user_id, TODAY, device)], 'history')
+    rpc.ingest_punches([(users[1].user_id, TODAY, device)], 'live')
+    notes = {row['employee_id']: row['notes'] for row in db.rows('attendance')}
+    uuid_of = lambda user: rpc.employee_cache.get(user.user_id)['uuid']
+    assert (notes[uuid_of(users[0])], notes[uuid_of(users[1])]) == ('Device History Sync', 'On Time')
+
+def test_clock_out_listed_before_clock_in_stays_in_open_day(rpc, db, users, device):
+    user = users[0]
+    batch = [(user.user_id, TODAY + timedelta(hours=9), device), (user.user_id, TODAY, device)]
+    assert rpc.ingest_punches(batch, 'live') == (2, 2)
+    record = rpc.open_day.get_record(db, rpc.employee_cache.get(user.user_id)['uuid'], TODAY.strftime("%Y-%m-%d"))
+    assert (record['clock_in'], record['clock_out']) == (TODAY.isoformat(), (TODAY + timedelta(hours=9)).isoformat())
+
+def test_unknown_employee_goes_through_push_attendance(rpc, db, users, device, monkeypatch):
+    pushed = []
+    monkeypatch.setattr(rpc, 'push_attendance', lambda *args: pushed.append(args) or True)
+    batch = [(users[0].user_id, TODAY, device), ('777', TODAY, device)]
+    assert rpc.ingest_punches(batch, 'sync') == (2, 2)
+    assert [(user_id, source) for user_id, _, _, source in pushed] == [('777', 'sync')]
+
+def test_summarize():
+    assert summarize([{'outcome': 'clock_in'}, {'outcome': 'folded'}, {'outcome': 'clock_in'}]) == {'clock_in': 2, 'folded': 1}
@@ -0,0 +1,53 @@
+
+from datetime import datetime, timedelta, timezone
+import pytest
+import punch_ledger
+
+T0 = datetime.now().replace(hour=7, minute=0, second=0, microsecond=0)
+
+@pytest.fixture
+def ledger_on(am, monkeypatch):
+    monkeypatch.setenv('PUNCH_LEDGER', 'on')
+    return am
+
+def punches_for(users, device):
+    # Clock-in, then clock-out an hour later, per user
+    return [(u.user_id, T0 + timedelta(hours=h, minutes=i), device) for h in (0, 1) for i, u in enumerate(users)]
+
+def attendance(db):
+    return sorted((r['employee_id'], r['date'], r['clock_in'], r.get('clock_out')) for r in db.rows('attendance'))
+
+def age_ledger(db, seconds=3600):
+    old = (datetime.now(timezone.utc) - timedelta(seconds=seconds)).isoformat()
+    for row in db.rows('punch_ledger'):
+        row['received_at'] = old
+
+def test_replayed_batch_changes_nothing(ledger_on, db, users, device):
+    punches = punches_for(users, device)
+    done, written = ledger_on.write_punches(punches, 'sync')
+    assert (done, written) == (len(punches), len(punches))
+    before = attendance(db)
+
+    db.reset_counts()
+    assert ledger_on.write_punches(punches, 'sync') == (len(punches), 0)
+    assert attendance(db) == before
+    assert len(db.rows('punch_ledger')) == len(punches)
+    assert db.breakdown() == "punch_ledger:upsert=1" # one idempotent append, no attendance traffic
+
+def test_apply_pending_finishes_rows_once(ledger_on, db, users, device, monkeypatch):
+    punches = punches_for(users, device)
+    real_push = ledger_on.push_attendance
+    monkeypatch.setattr(ledger_on, 'push_attendance', lambda *args, **kwargs: None) # derive fails after the append
+    assert ledger_on.write_punches(punches, 'sync') == (len(punches), 0)
+    assert attendance(db) == []
+
+    monkeypatch.setattr(ledger_on, 'push_attendance', real_push)
+    age_ledger(db)
+    assert punch_ledger.apply_pending(db, ledger_on.derive_attendance) == len(punches)
+    after = attendance(db)
+    assert len(after) == len(users) and all(clock_out for *_, clock_out in after)
+
+    # A second pass and a replay of the same punches find nothing left to do
+    assert punch_ledger.apply_pending(db, ledger_on.derive_attendance) == 0
+    assert ledger_on.write_punches(punches, 'sync') == (len(punches), 0)
+    assert attendance(db) == after
@@ -0,0 +1,100 @@
+
+import sqlite3
+from datetime import datetime, timedelta
+import pytest
+import punch_outbox
+from punch_outbox import PunchOutbox, MAX_ATTEMPTS
+
+DEVICE = {'ip_address': '10.9.9.9', 'name': 'test'}
+T0 = datetime(2024, 5, 1, 8, 0, 0)
+
+class Clock:
+    """Stands in for the time module inside punch_outbox."""
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(punch_outbox, 'time', clock)
+    return clock
+
+@pytest.fixture
+def outbox(tmp_path, clock):
+    return PunchOutbox(tmp_path / "punch_outbox.db")
+
+def queue(outbox, *user_ids):
+    for i, user_id in enumerate(user_ids):
+        outbox.append(user_id, T0 + timedelta(minutes=i), DEVICE)
+
+def deliver(outbox, clock, bad, rounds):
+    """Writer passes: rows of user `bad` fail, the rest are delivered in order."""
+    delivered = []
+    for _ in range(rounds):
+        batch = outbox.fetch_batch()
+        if not batch:
+            clock.sleep(punch_outbox.MAX_BACKOFF)
+            continue
+        for row_id, user_id, timestamp, _ in batch:
+            if user_id == bad:
+                outbox.mark_failed(row_id, "rejected")
+                break
+            outbox.mark_done([row_id])
+            delivered.append((user_id, timestamp))
+        clock.sleep(1)
+    return delivered
+
+def test_duplicate_append_is_stored_once(outbox):
+    assert outbox.append('7', T0, DEVICE)
+    assert not outbox.append('7', T0, DEVICE)
+    assert outbox.stats()['pending'] == 1
+
+def test_failed_row_does_not_block_other_employees(outbox, clock):
+    queue(outbox, 'bad', '1', '2')
+    delivered = deliver(outbox, clock, 'bad', rounds=2)
+    assert [user_id for user_id, _ in delivered] == ['1', '2']
+    stats = outbox.stats()
+    assert (stats['pending'], stats['deferred'], stats['dead_letters']) == (1, 1, 0)
+
+def test_same_employee_waits_behind_its_failed_row(outbox, clock):
+    queue(outbox, 'bad', '1', 'bad')
+    first = outbox.fetch_batch()[0]
+    outbox.mark_failed(first[0], "rejected")
+    assert [user_id for _, user_id, _, _ in outbox.fetch_batch()] == ['1']
+    clock.sleep(punch_outbox.MAX_BACKOFF)
+    assert [user_id for _, user_id, _, _ in outbox.fetch_batch()] == ['bad', '1', 'bad']
+
+def test_poison_row_is_dead_lettered_while_others_go_through(outbox, clock):
+    queue(outbox, 'bad', '1', '2', '3')
+    deliver(outbox, clock, 'bad', rounds=MAX_ATTEMPTS * 3)
+    stats = outbox.stats()
+    assert (stats['pending'], stats['delivered'], stats['dead_letters'], stats['dead_lettered']) == (0, 3, 1, 1)
+    with sqlite3.connect(outbox.db_path) as conn:
+        user_id, attempts, error = conn.execute("SELECT user_id, attempts, last_error FROM dead_punches").fetchone()
+    assert (user_id, attempts, error) == ('bad', MAX_ATTEMPTS, "rejected")
+
+def test_outage_never_dead_letters(outbox, clock):
+    queue(outbox, '1', '2')
+    for _ in range(MAX_ATTEMPTS * 4):
+        for row_id, _, _, _ in outbox.fetch_batch()[:1]:
+            outbox.mark_failed(row_id, "connection refused")
+        clock.sleep(punch_outbox.MAX_BACKOFF)
+    stats = outbox.stats()
+    assert (stats['pending'], stats['dead_letters']) == (2, 0)
+
+def test_old_outbox_file_gets_new_columns(tmp_path, clock):
+    path = tmp_path / "old.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute("""CREATE TABLE punches (id INTEGER PRIMARY KEY AUTOINCREMENT, device_ip TEXT NOT NULL,
+                        user_id TEXT NOT NULL, punch_time TEXT NOT NULL, device_json TEXT, attempts INTEGER DEFAULT 0,
+                        last_error TEXT, created_at REAL, UNIQUE(device_ip, user_id, punch_time))""")
+        conn.execute("INSERT INTO punches (device_ip, user_id, punch_time, device_json, created_at) VALUES (?, ?, ?, ?, ?)",
+                     ('10.9.9.9', '1', T0.isoformat(), '{}', 1.0))
+    outbox = PunchOutbox(path)
+    assert [user_id for _, user_id, _, _ in outbox.fetch_batch()] == ['1']
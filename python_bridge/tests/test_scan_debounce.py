@@ -0,0 +1,78 @@
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+from scan_debounce import ScanDebouncer
+
+WINDOW = 120
+T0 = datetime(2024, 5, 6, 8, 0, 0)
+Event = namedtuple('Event', 'user_id timestamp')
+
+def scan(debouncer, user_id, timestamp, ip='10.0.0.1', persisted=True):
+    """admit() + record() the way LiveDevice.handle does."""
+    if not debouncer.admit(user_id, timestamp, ip, WINDOW):
+        return False
+    if persisted:
+        debouncer.record(user_id, timestamp, ip, WINDOW)
+    return True
+
+def test_repeat_within_window_is_dropped():
+    d = ScanDebouncer()
+    assert scan(d, 1, T0)
+    assert not scan(d, 1, T0 + timedelta(seconds=30))
+    assert scan(d, 1, T0 + timedelta(seconds=WINDOW))
+    assert scan(d, 2, T0 + timedelta(seconds=1)) # other people are not affected
+    assert (d.stats()['admitted'], d.stats()['dropped']) == (3, 1)
+
+def test_window_counts_from_last_admitted_scan():
+    d = ScanDebouncer()
+    scan(d, 1, T0)
+    assert not scan(d, 1, T0 + timedelta(seconds=100))
+    assert scan(d, 1, T0 + timedelta(seconds=130)) # 130s after the admitted one, not 30s after the drop
+
+def test_repeat_on_another_gate_is_dropped_and_counted():
+    d = ScanDebouncer()
+    scan(d, 1, T0, ip='10.0.0.1')
+    assert not scan(d, 1, T0 - timedelta(seconds=5), ip='10.0.0.2') # gates' clocks differ
+    assert d.stats()['dropped_cross_device'] == 1
+    assert d.stats()['dropped_by_device'] == {'10.0.0.2': 1}
+
+def test_redelivered_punch_is_admitted():
+    d = ScanDebouncer()
+    scan(d, 1, T0)
+    assert scan(d, 1, T0)
+
+def test_window_does_not_span_midnight():
+    d = ScanDebouncer()
+    late = datetime(2024, 5, 6, 23, 59, 30)
+    scan(d, 1, late)
+    assert scan(d, 1, late + timedelta(minutes=1)) # 00:00:30 is the next day's clock-in
+
+def test_scan_that_was_not_persisted_does_not_drop_the_rescan():
+    d = ScanDebouncer()
+    assert scan(d, 1, T0, persisted=False) # outbox and direct push both failed
+    assert scan(d, 1, T0 + timedelta(seconds=10))
+
+def test_zero_window_admits_everything():
+    d = ScanDebouncer()
+    assert d.admit(1, T0, 'a', 0)
+    d.record(1, T0, 'a', 0)
+    assert d.admit(1, T0 + timedelta(seconds=1), 'a', 0)
+
+def test_live_device_records_only_persisted_scans(am, device, monkeypatch):
+    monkeypatch.setenv('SCAN_DEBOUNCE_SECONDS', str(WINDOW))
+    live = am.LiveDevice(device)
+
+    class BrokenOutbox:
+        def append(self, *args):
+            raise OSError("disk full")
+    monkeypatch.setattr(am, 'outbox', BrokenOutbox())
+    monkeypatch.setattr(am, 'push_attendance', lambda *args, **kwargs: None)
+    live.handle(Event(1001, T0))
+    assert am.scan_debouncer.stats()['admitted'] == 0
+
+    pushed = []
+    monkeypatch.setattr(am, 'push_attendance', lambda *args, **kwargs: pushed.append(args) or True)
+    live.handle(Event(1001, T0 + timedelta(seconds=20)))
+    live.handle(Event(1001, T0 + timedelta(seconds=40)))
+    assert len(pushed) == 1
+    assert am.scan_debouncer.stats()['dropped'] == 1
@@ -0,0 +1,37 @@
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+from conftest import FakeZK
+from startup import target_of
+
+Log = namedtuple('Log', 'user_id timestamp')
+
+def test_target_of():
+    assert target_of("https://abc.supabase.co") == ("abc.supabase.co", 443)
+    assert target_of("http://10.0.0.2:8000/") == ("10.0.0.2", 8000)
+    assert target_of("") == (None, None)
+
+def test_devices_start_from_the_snapshot_before_supabase(am, db, device, monkeypatch):
+    db.rows('devices')[0]['is_active'] = True
+    assert [d['id'] for d in am.load_active_devices()] == ['dev-1'] # read from Supabase and saved
+    monkeypatch.setattr(am, 'supabase', None)
+    assert [d['id'] for d in am.load_active_devices()] == ['dev-1']
+
+def test_offline_start_listens_and_catches_up_once_connected(am, db, users, device, monkeypatch):
+    yesterday = (datetime.now() - timedelta(days=1)).replace(hour=8, minute=0, second=0, microsecond=0)
+    punches = [(u.user_id, yesterday + timedelta(minutes=i)) for i, u in enumerate(users)]
+    zk = FakeZK(users, punches)
+    cloud = am.supabase
+    monkeypatch.setattr(am, 'supabase', None)
+    live = am.LiveDevice(device)
+    live.start(zk)
+    assert device['ip_address'] in am.catchup_deferred and not live.live_ok
+    live.handle(Log(users[0].user_id, datetime.now()))
+    assert am.outbox.stats()['pending'] == 1 # captured while offline
+
+    monkeypatch.setattr(am, 'supabase', cloud)
+    monkeypatch.setattr(am, 'manual_connect', lambda ip, port: lambda: zk)
+    am.catch_up_deferred()
+    assert am.catchup_deferred == {}
+    assert len(db.rows('attendance')) == len(users)
+    assert db.rows('devices')[0]['last_log_at'] == punches[-1][1].isoformat()
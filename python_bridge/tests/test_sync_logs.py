@@ -0,0 +1,62 @@
+
+import io
+import contextlib
+from datetime import datetime, timedelta
+import pytest
+from conftest import FakeZK, make_users
+
+T0 = datetime(2024, 5, 6, 7, 0, 0)
+
+@pytest.fixture
+def app(db, monkeypatch):
+    """app.py (POST /sync-logs) on the FakeSupabase."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app # (prints its banner)
+    monkeypatch.setattr(app, 'supabase', db)
+    return app
+
+def sync(app, zk, monkeypatch, **body):
+    monkeypatch.setattr(app, 'ZK', lambda *args, **kwargs: zk)
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = app.app.test_client().post('/sync-logs', json={'ip': '10.9.9.9', **body})
+    assert response.status_code == 200
+    return response.get_json()
+
+def watermark(db):
+    return db.rows('devices')[0].get('last_log_at')
+
+def test_unknown_users_do_not_hold_the_watermark(app, db, users, monkeypatch):
+    stranger = make_users(9)[-1] # on the device, not in employees
+    punches = [(users[0].user_id, T0), (stranger.user_id, T0 + timedelta(minutes=1)),
+               (users[1].user_id, T0 + timedelta(minutes=2))]
+    result = sync(app, FakeZK(users + [stranger], punches), monkeypatch)
+    assert (result['new_logs'], result['unknown_users']) == (3, 1)
+    assert watermark(db) == (T0 + timedelta(minutes=2)).isoformat()
+    assert len(db.rows('attendance')) == 2
+
+    result = sync(app, FakeZK(users + [stranger], punches), monkeypatch)
+    assert result['new_logs'] == 0 # nothing re-downloaded behind the stranger's punch
+
+def test_failed_write_holds_the_watermark(app, db, users, monkeypatch):
+    punches = [(users[0].user_id, T0), (users[1].user_id, T0 + timedelta(minutes=1))]
+    import attendance_fold
+    real = attendance_fold._write_chunks
+    monkeypatch.setattr(attendance_fold, '_write_chunks', lambda supabase, rows, upsert=False: (0, len(rows)))
+    sync(app, FakeZK(users, punches), monkeypatch)
+    assert (watermark(db), db.rows('devices')[0]['last_log_seq']) == (T0.isoformat(), 0) # just before the first punch
+
+    monkeypatch.setattr(attendance_fold, '_write_chunks', real)
+    assert sync(app, FakeZK(users, punches), monkeypatch)['new_logs'] == 2
+    assert len(db.rows('attendance')) == 2
+
+def test_earlier_punch_in_a_later_chunk_still_sets_clock_in(app, db, users, monkeypatch):
+    # Device clock was reset: the buffer holds 09:00 before 07:00 of the same day
+    from functools import partial
+    from attendance_stream import stream_attendance
+    punches = [(users[0].user_id, T0 + timedelta(hours=2)), (users[1].user_id, T0 + timedelta(hours=2)),
+               (users[0].user_id, T0), (users[0].user_id, T0 + timedelta(hours=10))]
+    monkeypatch.setattr(app, 'stream_attendance', partial(stream_attendance, chunk_size=2))
+    sync(app, FakeZK(users, punches), monkeypatch)
+    row = next(r for r in db.rows('attendance') if r['employee_id'] == db.rows('employees')[0]['id'])
+    assert (row['clock_in'], row['clock_out'], row['status']) == (T0.isoformat(), (T0 + timedelta(hours=10)).isoformat(), 'PRESENT')
+
@@ -0,0 +1,123 @@
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+from functools import partial
+from attendance_stream import stream_attendance
+from conftest import FakeZK
+from sync_watermark import WatermarkCursor, filter_new_logs, advance_watermark
+
+Log = namedtuple('Log', 'user_id timestamp')
+T0 = (datetime.now() - timedelta(days=1)).replace(hour=8, minute=0, second=0, microsecond=0) # inside the 7-day catch-up
+
+def at(minutes):
+    return T0 + timedelta(minutes=minutes)
+
+def minutes_apart(users, count):
+    return [(users[i % len(users)].user_id, at(i)) for i in range(count)]
+
+def saved_watermark(db):
+    row = db.rows('devices')[0]
+    return row.get('last_log_at'), row.get('last_log_seq')
+
+# --- WatermarkCursor ---
+def test_cursor_matches_filter_new_logs():
+    logs = [Log(1, at(2)), Log(2, at(0)), Log(3, at(0)), Log(4, at(1))]
+    watermark = {'device_id': 'd', 'last_at': at(0), 'seq': 1, 'records': 4}
+    assert WatermarkCursor(watermark).new_logs(logs) == filter_new_logs(logs, watermark)
+    assert [log.user_id for log in filter_new_logs(logs, watermark)] == [3, 4, 1]
+
+def test_cursor_skips_same_second_across_chunks():
+    watermark = {'device_id': 'd', 'last_at': at(0), 'seq': 2, 'records': 0}
+    cursor = WatermarkCursor(watermark)
+    assert cursor.new_logs([Log(1, at(0))]) == []
+    assert cursor.new_logs([Log(2, at(0)), Log(3, at(0))]) == [Log(3, at(0))]
+
+def test_cursor_advances_like_advance_watermark():
+    logs = [Log(1, at(0)), Log(2, at(1)), Log(3, at(1))]
+    cursor = WatermarkCursor(None)
+    cursor.committed(cursor.new_logs(logs[:2]))
+    cursor.committed(cursor.new_logs(logs[2:]))
+    assert cursor.result(3) == advance_watermark(None, logs, 3)
+
+def test_cursor_stops_before_blocked_punch():
+    cursor = WatermarkCursor({'device_id': 'd', 'last_at': None, 'seq': 0, 'records': 0})
+    new = cursor.new_logs([Log(1, at(0)), Log(2, at(1)), Log(3, at(2))])
+    cursor.committed(new[:1])
+    cursor.blocked(new[1:])
+    assert (cursor.result()['last_at'], cursor.result()['seq']) == (at(0), 1)
+
+def test_cursor_falls_back_when_an_earlier_chunk_moved_past_a_blocked_punch():
+    # Buffer not in time order: chunk 2 holds a punch older than chunk 1's
+    cursor = WatermarkCursor({'device_id': 'd', 'last_at': None, 'seq': 0, 'records': 0})
+    cursor.committed(cursor.new_logs([Log(1, at(5)), Log(2, at(6))]))
+    cursor.blocked(cursor.new_logs([Log(3, at(3))]))
+    result = cursor.result()
+    assert (result['last_at'], result['seq']) == (at(3), 0)
+    assert filter_new_logs([Log(3, at(3))], result) == [Log(3, at(3))]
+
+# --- push_new_device_logs ---
+def failing_push(fail_at, written):
+    def push(user_id, timestamp, device_info, source='sync'):
+        if timestamp == fail_at:
+            return None
+        written.append((str(user_id), timestamp))
+        return True
+    return push
+
+def test_partial_commit_keeps_watermark_before_failed_punch(am, db, users, device, monkeypatch):
+    punches = minutes_apart(users, 12)
+    written = []
+    monkeypatch.setattr(am, 'push_attendance', failing_push(at(7), written))
+    monkeypatch.setattr(am, 'stream_attendance', partial(stream_attendance, chunk_size=4))
+
+    records, new, count, watermark, complete = am.push_new_device_logs(FakeZK(users, punches), device)
+
+    assert (records, new, count, complete) == (12, 12, 7, False)
+    assert (watermark['last_at'], watermark['seq']) == (at(6), 1)
+    assert saved_watermark(db) == (at(6).isoformat(), 1)
+    assert [ts for _, ts in written] == [at(i) for i in range(7)] # nothing after the failure
+    assert device['ip_address'] in am.catchup_pending
+
+    # The next sync retries from the failed punch and finishes
+    monkeypatch.setattr(am, 'push_attendance', failing_push(None, written))
+    _, new, count, watermark, complete = am.push_new_device_logs(FakeZK(users, punches), device)
+    assert (new, count, complete) == (5, 5, True)
+    assert watermark['last_at'] == at(11)
+    assert device['ip_address'] not in am.catchup_pending
+
+def test_earlier_punch_in_a_later_chunk_still_sets_clock_in(am, db, users, device, monkeypatch):
+    # Device clock was reset: 09:00 sits before 08:00 in the buffer
+    punches = [(users[0].user_id, at(60)), (users[1].user_id, at(61)), (users[0].user_id, at(0)), (users[0].user_id, at(600))]
+    monkeypatch.setattr(am, 'stream_attendance', partial(stream_attendance, chunk_size=2))
+    am.push_new_device_logs(FakeZK(users, punches), device)
+    emp_uuid = am.employee_cache.get(users[0].user_id)['uuid']
+    row = next(r for r in db.rows('attendance') if r['employee_id'] == emp_uuid)
+    assert (row['clock_in'], row['clock_out']) == (at(0).isoformat(), at(600).isoformat())
+    assert saved_watermark(db) == (at(600).isoformat(), 1)
+
+def test_live_punches_do_not_move_watermark_after_partial_catch_up(am, db, users, device, monkeypatch):
+    punches = minutes_apart(users, 6)
+    monkeypatch.setattr(am, 'push_attendance', failing_push(at(3), []))
+    monkeypatch.setattr(am, 'sync_device_users', lambda conn, device_info, progress=None: None)
+    live = am.LiveDevice(device)
+    live.start(FakeZK(users, punches))
+    assert live.watermark['last_at'] == at(2)
+    assert not live.live_ok
+
+    live.handle(Log(users[0].user_id, at(30)))
+    live.save()
+    assert live.watermark['last_at'] == at(2)
+    assert saved_watermark(db) == (at(2).isoformat(), 1)
+    assert am.outbox.stats()['pending'] == 1 # the live punch itself is still queued
+
+def test_live_punches_move_watermark_after_full_catch_up(am, db, users, device, monkeypatch):
+    punches = minutes_apart(users, 6)
+    monkeypatch.setattr(am, 'push_attendance', failing_push(None, []))
+    monkeypatch.setattr(am, 'sync_device_users', lambda conn, device_info, progress=None: None)
+    live = am.LiveDevice(device)
+    live.start(FakeZK(users, punches))
+    assert live.live_ok
+
+    live.handle(Log(users[0].user_id, at(30)))
+    live.save()
+    assert saved_watermark(db) == (at(30).isoformat(), 1)
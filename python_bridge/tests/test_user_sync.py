@@ -0,0 +1,60 @@
+
+from zk.user import User
+from conftest import FakeSupabase, make_users, make_employees
+import user_sync
+from user_sync import diff_users, sync_users
+
+def employees_by_code(db):
+    return {e['employee_id_code']: e for e in db.rows('employees')}
+
+def test_diff_splits_new_renamed_and_unchanged():
+    users = make_users(3) + [User(9, '', 0, '', '', '1009'), User(1, 'dup', 0, '', '', '1001')]
+    existing = {
+        '1001': {"id": "e1", "employee_id_code": "1001", "name": "Shaqaale 1"},
+        '1002': {"id": "e2", "employee_id_code": "1002", "name": "Old name"},
+    }
+    inserts, renames, unchanged = diff_users(users, existing, 'x1')
+    assert sorted(r['employee_id_code'] for r in inserts) == ['1003', '1009']
+    assert [r for r in inserts if r['employee_id_code'] == '1009'][0]['name'] == 'Worker 1009'
+    assert renames == [{"id": "e2", "employee_id_code": "1002", "name": "Shaqaale 2", "old_name": "Old name"}]
+    assert unchanged == 1 # the repeated 1001 is skipped, not counted twice
+
+def test_only_placeholders_keeps_names_set_by_hand():
+    users = make_users(2)
+    existing = {
+        '1001': {"id": "e1", "employee_id_code": "1001", "name": "Staff 1001"},
+        '1002': {"id": "e2", "employee_id_code": "1002", "name": "Cali Axmed"},
+    }
+    _, renames, unchanged = diff_users(users, existing, 'x1', only_placeholders=True)
+    assert [r['id'] for r in renames] == ['e1']
+    assert unchanged == 1
+
+def test_sync_writes_in_bulk(monkeypatch):
+    monkeypatch.setattr(user_sync, 'WRITE_CHUNK', 10)
+    users = make_users(30)
+    db = FakeSupabase()
+    db.seed('employees', make_employees(users[:5]))
+    db.rows('employees')[0]['name'] = 'Staff 1001'
+    result = sync_users(db, users, 'x1')
+    assert (result['inserted'], result['renamed'], result['unchanged'], result['failed']) == (25, 1, 4, 0)
+    assert result['requests'] == db.requests() == 1 + 3 + 1 # one page, three insert chunks, one rename chunk
+    rows = employees_by_code(db)
+    assert len(rows) == 30
+    assert rows['1001']['name'] == 'Shaqaale 1'
+    assert rows['1030']['xarun_id'] == 'x1' and rows['1030']['finger_id'] == 30
+
+def test_user_created_meanwhile_is_skipped_not_failed():
+    users = make_users(3)
+    db = FakeSupabase()
+    inserts, renames, _ = diff_users(users, {}, 'x1')
+    db.seed('employees', [{"id": "other", "employee_id_code": "1002", "name": "Shaqaale 2"}])
+    result = user_sync.apply_user_diff(db, inserts, renames)
+    assert (result['inserted'], result['failed']) == (2, 0)
+    assert employees_by_code(db)['1002']['id'] == 'other'
+
+def test_failed_chunk_is_counted():
+    class Broken(FakeSupabase):
+        def _do_upsert(self, query):
+            raise Exception("connection reset")
+    result = sync_users(Broken(), make_users(4), 'x1')
+    assert (result['inserted'], result['failed']) == (0, 4)
@@ -0,0 +1,65 @@
+
+import threading
+from worker_pool import KeyedWorkerPool
+
+def drain(pool):
+    for q in pool.queues:
+        q.join()
+
+def test_threads_start_lazily():
+    pool = KeyedWorkerPool(lambda *args: None, workers=2)
+    assert pool.threads == []
+    pool.submit('a', 1)
+    drain(pool)
+    assert len(pool.threads) == 2
+    pool.start() # idempotent
+    assert len(pool.threads) == 2
+
+def test_same_key_keeps_order_and_never_overlaps():
+    seen = {}
+    running = set()
+    overlaps = []
+    lock = threading.Lock()
+    def handler(key, i):
+        with lock:
+            if key in running:
+                overlaps.append(key)
+            running.add(key)
+        seen.setdefault(key, []).append(i)
+        with lock:
+            running.discard(key)
+    pool = KeyedWorkerPool(handler, workers=4)
+    for i in range(200):
+        key = f"user-{i % 7}"
+        pool.submit(key, key, i)
+    drain(pool)
+    assert overlaps == []
+    assert all(order == sorted(order) for order in seen.values())
+    assert sum(map(len, seen.values())) == 200
+
+def test_full_queue_rejects():
+    started = threading.Event()
+    gate = threading.Event()
+    def handler(i):
+        started.set()
+        gate.wait(5)
+    pool = KeyedWorkerPool(handler, workers=1, queue_size=1)
+    assert pool.submit('k', 0)
+    started.wait(5) # the worker holds job 0, the queue is empty again
+    assert [pool.submit('k', i) for i in (1, 2, 3)] == [True, False, False]
+    gate.set()
+    drain(pool)
+    stats = pool.stats()
+    assert (stats['submitted'], stats['processed'], stats['rejected']) == (2, 2, 2)
+
+def test_false_and_exceptions_count_as_errors():
+    def handler(value):
+        if value == 'raise':
+            raise ValueError(value)
+        return value
+    pool = KeyedWorkerPool(handler, workers=2)
+    for value in (True, False, 'raise', None):
+        pool.submit(str(value), value)
+    drain(pool)
+    stats = pool.stats()
+    assert (stats['processed'], stats['errors']) == (4, 2)
@@ -0,0 +1,94 @@
+
+import time
+import threading
+import pytest
+from conftest import FakeZK, make_users
+from zk_session import ZKSessionManager, LIVE_POLL_SECONDS
+
+class Sock:
+    def __init__(self):
+        self.timeouts = []
+
+    def settimeout(self, value):
+        self.timeouts.append(value)
+
+class LiveZK(FakeZK):
+    """FakeZK in live capture: reg_event and the socket that pausing touches."""
+    def __init__(self, punches=()):
+        super().__init__(make_users(2), list(punches))
+        self.events = []
+        self._ZK__sock = Sock()
+        self._ZK__timeout = 60
+
+    def reg_event(self, flags):
+        self.events.append(flags)
+
+def serve_until_done(session, stop, **hooks):
+    """The monitor thread: serves borrowed jobs between live events."""
+    while not stop.is_set():
+        session.serve(**hooks)
+        stop.wait(0.005)
+
+@pytest.fixture
+def live():
+    manager = ZKSessionManager()
+    conn = LiveZK()
+    session = manager.attach('ip', conn)
+    stop = threading.Event()
+    gaps = []
+    thread = threading.Thread(target=serve_until_done, args=(session, stop), kwargs={'on_gap': gaps.append})
+    thread.start()
+    yield manager, conn, gaps
+    stop.set()
+    thread.join()
+
+def no_connect():
+    raise AssertionError("a live session exists, no second connection")
+
+def test_run_borrows_the_live_session(live):
+    manager, conn, _ = live
+    assert manager.run('ip', lambda c: c is conn, no_connect)
+    assert manager.stats()['borrowed'] == 1 and manager.stats()['own_connections'] == 0
+    assert conn._ZK__sock.timeouts == [60, LIVE_POLL_SECONDS] # paused, then back to live polling
+
+def test_borrowed_job_error_reaches_the_caller(live):
+    manager, _, _ = live
+    def fail(conn):
+        raise ValueError("bad job")
+    with pytest.raises(ValueError):
+        manager.run('ip', fail, no_connect)
+
+def test_punches_while_paused_trigger_catch_up_unless_covered(live):
+    manager, conn, gaps = live
+    def punch(conn):
+        conn.punches.append(('1001', None))
+    manager.run('ip', punch, no_connect)
+    assert gaps == [conn]
+    manager.run('ip', punch, no_connect, covers_logs=True)
+    assert gaps == [conn]
+
+def test_no_session_uses_own_connection_under_the_owner_lock():
+    manager = ZKSessionManager()
+    conn = FakeZK(make_users(1), [])
+    held = []
+    result = manager.run('ip', lambda c: held.append(manager.owner('ip').locked()) or 'done', lambda: conn)
+    assert result == 'done' and held == [True]
+    assert not manager.owner('ip').locked()
+    assert manager.stats()['own_connections'] == 1
+
+def test_detach_fails_waiting_jobs():
+    manager = ZKSessionManager()
+    session = manager.attach('ip', LiveZK())
+    errors = []
+    def borrow():
+        try:
+            manager.run('ip', lambda c: None, no_connect, timeout=5)
+        except ConnectionError as e:
+            errors.append(e)
+    thread = threading.Thread(target=borrow)
+    thread.start()
+    while not session.pending:
+        time.sleep(0.001)
+    manager.detach('ip', session)
+    thread.join()
+    assert len(errors) == 1 and manager.get('ip') is None
@@ -0,0 +1,94 @@
+
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from metrics import registry as metrics
+
+# ==========================================
+# LIGHTWEIGHT TRACING SPANS
+# ==========================================
+# with span("zk.get_users", device=ip): ...
+# Each finished span keeps its name, duration, parent span and context
+# (device / employee / table ...). The last SPAN_BUFFER spans are kept for
+# /debug/spans and every duration also goes to the span_seconds histogram.
+
+SPAN_BUFFER = 2000
+SPAN_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+span_seconds = metrics.histogram("span_seconds", "Duration of traced hot-path spans.", ("span",), SPAN_BUCKETS)
+finished = deque(maxlen=SPAN_BUFFER)
+local = threading.local()
+_ids = iter(range(1, 1 << 62))
+_ids_lock = threading.Lock()
+
+def _next_id():
+    with _ids_lock:
+        return next(_ids)
+
+@contextmanager
+def span(name, **context):
+    stack = getattr(local, 'stack', None)
+    if stack is None:
+        stack = local.stack = []
+    parent = stack[-1] if stack else None
+    inherited = dict(parent['context']) if parent else {}
+    inherited.update({k: v for k, v in context.items() if v is not None})
+    record = {
+        "id": _next_id(),
+        "parent": parent['id'] if parent else None,
+        "name": name,
+        "thread": threading.current_thread().name,
+        "context": inherited,
+        "start": time.time()
+    }
+    stack.append(record)
+    started = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        record["error"] = str(e)[:200]
+        raise
+    finally:
+        stack.pop()
+        record["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        finished.append(record)
+        span_seconds.observe(record["duration_ms"] / 1000, span=name)
+
+def traced_method(obj, method_name, span_name, **context):
+    """Replaces obj.method_name with a version that runs inside a span."""
+    original = getattr(obj, method_name)
+
+    def wrapper(*args, **kwargs):
+        with span(span_name, **context):
+            return original(*args, **kwargs)
+
+    setattr(obj, method_name, wrapper)
+
+def recent(name=None, device=None, limit=200):
+    items = list(finished)
+    out = []
+    for record in reversed(items):
+        if name and not record["name"].startswith(name):
+            continue
+        if device and record["context"].get("device") != device:
+            continue
+        out.append(record)
+        if len(out) >= limit:
+            break
+    return out
+
+def summary():
+    """Per span name: count, total / avg / max ms over the buffered spans."""
+    stats = {}
+    for record in list(finished):
+        s = stats.setdefault(record["name"], {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "errors": 0})
+        s["count"] += 1
+        s["total_ms"] += record.get("duration_ms", 0)
+        s["max_ms"] = max(s["max_ms"], record.get("duration_ms", 0))
+        if "error" in record:
+            s["errors"] += 1
+    for s in stats.values():
+        s["avg_ms"] = round(s["total_ms"] / s["count"], 3)
+        s["total_ms"] = round(s["total_ms"], 3)
+    return dict(sorted(stats.items(), key=lambda kv: -kv[1]["total_ms"]))
@@ -0,0 +1,120 @@
+
+import uuid
+import logging
+from datetime import datetime
+from employee_directory import fetch_pages
+
+# ==========================================
+# DEVICE -> EMPLOYEES USER SYNC (DIFF + BULK)
+# ==========================================
+# Reads the employees directory once (paginated), diffs it against
+# conn.get_users() in memory, then writes:
+# - every new user in multi-row inserts (upsert on employee_id_code with
+#   ignore_duplicates, so a user created meanwhile by another sync is skipped
+#   instead of failing the whole batch)
+# - every name change in a batched upsert on id
+# A 3,000-user device is a handful of requests instead of one per user.
+
+WRITE_CHUNK = 500
+PLACEHOLDER_MARKERS = ("Staff", "Worker")
+
+def device_name(user):
+    return user.name.replace('\x00', '').strip() if user.name else ""
+
+def is_placeholder(name):
+    return not name or any(marker in name for marker in PLACEHOLDER_MARKERS)
+
+def diff_users(device_users, existing_map, xarun_id, placeholder="Worker", only_placeholders=False, with_finger_id=True):
+    """
+    Returns (inserts, renames, unchanged).
+    existing_map: { employee_id_code: {id, employee_id_code, name} }
+    only_placeholders: rename only employees still called "Staff N"/"Worker N"/"" in the DB.
+    """
+    inserts = []
+    renames = []
+    unchanged = 0
+    seen = set()
+    today = datetime.now().strftime("%Y-%m-%d")
+    for user in device_users:
+        zk_id = str(user.user_id)
+        if zk_id in seen:
+            continue
+        seen.add(zk_id)
+        name = device_name(user)
+
+        current = existing_map.get(zk_id)
+        if current is None:
+            row = {
+                "id": str(uuid.uuid4()),
+                "name": name or f"{placeholder} {zk_id}",
+                "employee_id_code": zk_id,
+                "position": "STAFF",
+                "status": "ACTIVE",
+                "joined_date": today,
+                "xarun_id": xarun_id,
+                "salary": 0,
+                "avatar": f"https://api.dicebear.com/7.x/avataaars/svg?seed={zk_id}"
+            }
+            if with_finger_id:
+                row["finger_id"] = user.uid
+            inserts.append(row)
+        elif name and current['name'] != name and (not only_placeholders or is_placeholder(current['name'])):
+            renames.append({"id": current['id'], "employee_id_code": zk_id, "name": name, "old_name": current['name']})
+        else:
+            unchanged += 1
+    return inserts, renames, unchanged
+
+def _chunks(rows):
+    for i in range(0, len(rows), WRITE_CHUNK):
+        yield rows[i:i + WRITE_CHUNK]
+
+def apply_user_diff(supabase, inserts, renames):
+    """Writes the diff in bulk. Returns dict(inserted, renamed, failed, requests)."""
+    result = {"inserted": 0, "renamed": 0, "failed": 0, "requests": 0}
+    for chunk in _chunks(inserts):
+        result["requests"] += 1
+        try:
+            res = supabase.table('employees').upsert(
+                chunk, on_conflict='employee_id_code', ignore_duplicates=True
+            ).execute()
+            result["inserted"] += len(res.data) if res.data is not None else len(chunk)
+        except Exception as e:
+            logging.error(f"❌ Bulk user insert failed ({len(chunk)} users): {e}")
+            result["failed"] += len(chunk)
+
+    # employee_id_code is NOT NULL, so it travels with the name; only these
+    # columns are touched on conflict
+    for chunk in _chunks(renames):
+        result["requests"] += 1
+        payload = [{"id": r["id"], "employee_id_code": r["employee_id_code"], "name": r["name"]} for r in chunk]
+        try:
+            supabase.table('employees').upsert(payload, on_conflict='id').execute()
+            result["renamed"] += len(chunk)
+        except Exception as e:
+            logging.error(f"❌ Bulk name update failed ({len(chunk)} users): {e}")
+            result["failed"] += len(chunk)
+    return result
+
+def sync_users(supabase, device_users, xarun_id, placeholder="Worker", only_placeholders=False, with_finger_id=True):
+    """
+    Full diff-based sync. Returns a summary dict:
+    device_users, existing, inserted, renamed, unchanged, failed, requests, renames (old -> new names).
+    """
+    existing_map = {}
+    pages = 0
+    for page in fetch_pages(supabase, 'employees', "id, employee_id_code, name"):
+        pages += 1
+        for e in page:
+            existing_map[str(e['employee_id_code'])] = e
+    inserts, renames, unchanged = diff_users(
+        device_users, existing_map, xarun_id, placeholder, only_placeholders, with_finger_id
+    )
+    result = apply_user_diff(supabase, inserts, renames)
+    result["requests"] += max(pages, 1)
+    result.update({
+        "device_users": len(device_users),
+        "existing": len(existing_map),
+        "unchanged": unchanged,
+        "renames": [(r["old_name"], r["name"]) for r in renames]
+    })
+    return result
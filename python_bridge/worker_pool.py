@@ -0,0 +1,85 @@
+
+import queue
+import zlib
+import threading
+
+# ==========================================
+# BOUNDED, KEY-ORDERED WORKER POOL
+# ==========================================
+# A fixed number of worker threads, each with its own bounded queue. Every
+# key (e.g. a ZK user id) always lands on the same worker, so two jobs for
+# the same person never run at the same time and keep their arrival order.
+# Threads start on start() or the first submit(), not when the pool is built.
+# A handler that returns False counts as an error, like one that raises.
+
+class KeyedWorkerPool:
+    def __init__(self, handler, workers=4, queue_size=1000, name="Worker"):
+        self.handler = handler
+        self.name = name
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.threads = []
+        self.stats_lock = threading.Lock()
+        self.submitted = 0
+        self.processed = 0
+        self.rejected = 0
+        self.errors = 0
+        self.max_depth = 0
+
+    def start(self):
+        with self.stats_lock:
+            if self.threads:
+                return
+            for i, q in enumerate(self.queues):
+                t = threading.Thread(target=self._run, args=(q,), name=f"{self.name}-{i}", daemon=True)
+                t.start()
+                self.threads.append(t)
+
+    def _slot(self, key):
+        # crc32 instead of hash(): stable across runs and cheap
+        return zlib.crc32(str(key).encode()) % len(self.queues)
+
+    def submit(self, key, *args):
+        """Queues handler(*args) on the worker that owns key. Returns False if that queue is full."""
+        if not self.threads:
+            self.start()
+        q = self.queues[self._slot(key)]
+        try:
+            q.put_nowait(args)
+        except queue.Full:
+            with self.stats_lock:
+                self.rejected += 1
+            return False
+        with self.stats_lock:
+            self.submitted += 1
+            depth = self.depth()
+            if depth > self.max_depth:
+                self.max_depth = depth
+        return True
+
+    def depth(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def _run(self, q):
+        while True:
+            args = q.get()
+            try:
+                failed = self.handler(*args) is False
+            except Exception:
+                failed = True
+            with self.stats_lock:
+                self.processed += 1
+                if failed:
+                    self.errors += 1
+            q.task_done()
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                "workers": len(self.queues),
+                "queue_depth": self.depth(),
+                "max_depth": self.max_depth,
+                "submitted": self.submitted,
+                "processed": self.processed,
+                "rejected": self.rejected,
+                "errors": self.errors
+            }
@@ -0,0 +1,182 @@
+
+import time
+import logging
+import threading
+from zk import const
+
+# ==========================================
+# SHARED ZK SESSIONS (ONE CONNECTION PER DEVICE)
+# ==========================================
+# The monitor thread owns the only connection to a device and keeps it in
+# live capture. A manual sync does not open a second connection any more:
+# it hands its work to the session (borrow) and waits. Between two live
+# events (live_capture yields at least every LIVE_POLL_SECONDS) the monitor
+# thread pauses the realtime stream, runs the job on the same socket and
+# resumes capture - no disconnect, no user re-sync, no 7-day replay.
+#
+# Pausing uses pyzk 0.9 internals (_ZK__sock / _ZK__timeout): live_capture
+# shortens the socket timeout and only restores it when the capture ends.
+# If pausing fails the session raises, and the monitor falls back to its
+# usual reconnect.
+
+LIVE_POLL_SECONDS = 2
+BORROW_TIMEOUT = 600
+
+class BorrowRequest:
+    def __init__(self, fn, covers_logs):
+        self.fn = fn
+        self.covers_logs = covers_logs # fn downloads the logs itself (no gap catch-up)
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class DeviceSession:
+    def __init__(self, ip, conn):
+        self.ip = ip
+        self.conn = conn
+        self.pending = []
+        self.lock = threading.Lock()
+        self.served = 0
+
+    def submit(self, request):
+        with self.lock:
+            self.pending.append(request)
+
+    def _pause(self, conn):
+        conn.reg_event(0)
+        conn._ZK__sock.settimeout(conn._ZK__timeout)
+        conn.disable_device()
+        conn.read_sizes()
+        return conn.records
+
+    def _resume(self, conn):
+        conn.enable_device()
+        conn.reg_event(const.EF_ATTLOG)
+        conn._ZK__sock.settimeout(LIVE_POLL_SECONDS)
+
+    def serve(self, on_pause=None, on_resume=None, on_gap=None):
+        """
+        Called by the monitor thread between live events. Runs queued jobs on
+        the live connection. on_gap(conn) runs when punches arrived while the
+        stream was paused and no job downloaded them.
+        """
+        with self.lock:
+            if not self.pending:
+                return 0
+            requests, self.pending = self.pending, []
+
+        conn = self.conn
+        try:
+            records_before = self._pause(conn)
+        except Exception as e:
+            for request in requests:
+                request.error = e
+                request.done.set()
+            raise
+
+        if on_pause: on_pause(conn)
+        covered = False
+        for request in requests:
+            try:
+                request.result = request.fn(conn)
+                covered = covered or request.covers_logs
+            except Exception as e:
+                request.error = e
+            finally:
+                request.done.set()
+                self.served += 1
+
+        conn.read_sizes()
+        if not covered and conn.records != records_before and on_gap:
+            on_gap(conn)
+        if on_resume: on_resume(conn)
+        self._resume(conn)
+        return len(requests)
+
+    def fail_pending(self, error):
+        with self.lock:
+            requests, self.pending = self.pending, []
+        for request in requests:
+            request.error = error
+            request.done.set()
+
+class ZKSessionManager:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = {} # ip -> DeviceSession (live)
+        self.owners = {}   # ip -> Lock held by whoever has the device connected
+        self.borrowed = 0
+        self.own_connections = 0
+
+    def owner(self, ip):
+        """Held while a connection to ip is open (monitor loop or a manual fallback)."""
+        with self.lock:
+            lock = self.owners.get(ip)
+            if lock is None:
+                lock = self.owners[ip] = threading.Lock()
+            return lock
+
+    def attach(self, ip, conn):
+        session = DeviceSession(ip, conn)
+        with self.lock:
+            self.sessions[ip] = session
+        return session
+
+    def detach(self, ip, session):
+        with self.lock:
+            if self.sessions.get(ip) is session:
+                del self.sessions[ip]
+        session.fail_pending(ConnectionError(f"Session for {ip} closed"))
+
+    def get(self, ip):
+        return self.sessions.get(ip)
+
+    def connected_ips(self):
+        return list(self.sessions)
+
+    def run(self, ip, fn, connect, covers_logs=False, timeout=BORROW_TIMEOUT):
+        """
+        Runs fn(conn) on the device: on the live session if there is one,
+        otherwise on a short-lived connection made with connect().
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            session = self.get(ip)
+            if session:
+                request = BorrowRequest(fn, covers_logs)
+                session.submit(request)
+                if not request.done.wait(max(deadline - time.time(), 0)):
+                    raise TimeoutError(f"Live session for {ip} did not pick up the job")
+                if request.error:
+                    raise request.error
+                self.borrowed += 1
+                return request.result
+
+            owner = self.owner(ip)
+            if owner.acquire(timeout=1):
+                try:
+                    return self._run_own(fn, connect)
+                finally:
+                    owner.release()
+            # The monitor is connecting -> its session shows up shortly
+        raise TimeoutError(f"Device {ip} busy")
+
+    def _run_own(self, fn, connect):
+        self.own_connections += 1
+        conn = connect()
+        try:
+            conn.disable_device()
+            result = fn(conn)
+            conn.enable_device()
+            return result
+        finally:
+            try: conn.disconnect()
+            except: pass
+
+    def stats(self):
+        return {
+            "live_sessions": len(self.sessions),
+            "borrowed": self.borrowed,
+            "own_connections": self.own_connections,
+            "served": {ip: s.served for ip, s in self.sessions.items()}
+        }
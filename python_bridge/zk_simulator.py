@@ -0,0 +1,306 @@
+
+import sys
+import time
+import random
+import asyncio
+import logging
+import os
+import argparse
+import tempfile
+import ipaddress
+import threading
+from struct import pack, unpack
+from collections import Counter
+from datetime import datetime
+from zk import const
+from attendance_stream import encode_time
+from bench_sync import make_punches
+from tests.conftest import make_users
+
+# ==========================================
+# ZKTECO PROTOCOL SIMULATOR (TCP)
+# ==========================================
+# Speaks enough of the ZK TCP protocol on port 4370 for pyzk's connect,
+# read_sizes, get_users, get_attendance (read-with-buffer + chunks),
+# disable/enable_device, reg_event and live_capture. Each simulated scanner
+# has its own user and log buffer and, while an event listener is
+# registered, pushes realtime punches at --rate per second (they are also
+# appended to its log buffer, like a real device).
+#
+# Faults: --slow-ms/--slow-ratio delay replies, --stall-ratio never
+# answers a command (client times out), --drop-ratio closes the socket on a
+# command, --disconnect-every closes live connections after a random time.
+#
+# Scanners listen on consecutive loopback IPs (127.0.1.1, 127.0.1.2 ...,
+# all on lo under Linux) or, with --spread port, on consecutive ports.
+#
+#   python zk_simulator.py --devices 200 --rate 0.2
+#   python zk_simulator.py --devices 300 --load-test --seconds 120 --drop-ratio 0.01
+#
+# --load-test runs advanced_monitor.monitor_single_device threads against
+# the scanners with FakeSupabase (tests/conftest.py) and reports what got through.
+# (Replies carry no checksum: pyzk never verifies it.)
+
+READ_BUFFER_CMD = 1503
+READ_CHUNK_CMD = 1504
+FIRMWARE = b"Ver 6.60 Sim\x00"
+
+def frame(code, session, reply_id, data=b''):
+    packet = pack('<4H', code, 0, session, reply_id) + data
+    return pack('<HHI', const.MACHINE_PREPARE_DATA_1, const.MACHINE_PREPARE_DATA_2, len(packet)) + packet
+
+def event_payload(user_id, when):
+    timehex = pack('6B', when.year - 2000, when.month, when.day, when.hour, when.minute, when.second)
+    return pack('<24sBB6s4s', str(user_id).encode(), 1, 0, timehex, b'\x00' * 4)
+
+class Faults:
+    def __init__(self, slow_ms=0, slow_ratio=0.0, stall_ratio=0.0, drop_ratio=0.0, disconnect_every=0):
+        self.slow = slow_ms / 1000.0
+        self.slow_ratio = slow_ratio
+        self.stall_ratio = stall_ratio
+        self.drop_ratio = drop_ratio
+        self.disconnect_every = disconnect_every
+
+class SimDevice:
+    def __init__(self, name, host, port, users, logs, rate, faults):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.users = users
+        self.logs = logs # [(user_id, datetime)]
+        self.rate = rate
+        self.faults = faults
+        self.user_data = None
+        self.log_data = None
+        self.connections = 0
+        self.live = 0
+        self.events_sent = 0
+        self.commands = Counter()
+        self.faults_hit = Counter()
+
+    # --- buffers (4-byte total size + records, as read-with-buffer returns them) ---
+    def user_buffer(self):
+        if self.user_data is None:
+            body = b''.join(
+                pack('<HB8s24sIx7sx24s', u.uid, 0, b'', u.name.encode()[:24], 0, b'1', u.user_id.encode())
+                for u in self.users
+            )
+            self.user_data = pack('I', len(body)) + body
+        return self.user_data
+
+    def log_buffer(self):
+        if self.log_data is None:
+            body = b''.join(
+                pack('<H24sBIB8s', 0, user_id.encode(), 1, encode_time(ts), 0, b'') for user_id, ts in self.logs
+            )
+            self.log_data = pack('I', len(body)) + body
+        return self.log_data
+
+    def sizes(self):
+        fields = [0] * 20
+        fields[4] = len(self.users)
+        fields[8] = len(self.logs)
+        fields[14], fields[15], fields[16] = 10000, 10000, 200000
+        fields[17] = fields[14]
+        fields[18] = fields[15] - len(self.users)
+        fields[19] = fields[16] - len(self.logs)
+        return pack('20i', *fields) + pack('3i', 0, 0, 0)
+
+    def reply(self, cmd, data, conn):
+        """Returns (response code, payload) for one command."""
+        if cmd == const.CMD_GET_FREE_SIZES:
+            return const.CMD_ACK_OK, self.sizes()
+        if cmd == READ_BUFFER_CMD:
+            _, command, _, _ = unpack('<bhii', data[:11])
+            if command == const.CMD_USERTEMP_RRQ:
+                conn['buffer'] = self.user_buffer()
+            elif command == const.CMD_ATTLOG_RRQ:
+                conn['buffer'] = self.log_buffer()
+            else:
+                conn['buffer'] = pack('I', 0)
+            return const.CMD_ACK_OK, pack('<BI', 0, len(conn['buffer']))
+        if cmd == READ_CHUNK_CMD:
+            start, size = unpack('<ii', data[:8])
+            return const.CMD_DATA, conn['buffer'][start:start + size]
+        if cmd == const.CMD_FREE_DATA:
+            conn['buffer'] = b''
+        elif cmd == const.CMD_REG_EVENT:
+            conn['live'] = unpack('I', data[:4])[0] != 0
+        elif cmd == const.CMD_GET_VERSION:
+            return const.CMD_ACK_OK, FIRMWARE
+        elif cmd == const.CMD_GET_TIME:
+            return const.CMD_ACK_OK, pack('I', encode_time(datetime.now()))
+        elif cmd == const.CMD_OPTIONS_RRQ:
+            key = data.split(b'\x00')[0]
+            return const.CMD_ACK_OK, key + b'=' + self.name.encode() + b'\x00'
+        elif cmd == const.CMD_CLEAR_ATTLOG:
+            self.logs = []
+            self.log_data = None
+        return const.CMD_ACK_OK, b''
+
+    # --- connection ---
+    async def serve(self, reader, writer):
+        self.connections += 1
+        session = random.randint(1, 0xFFFE)
+        conn = {'buffer': b'', 'live': False}
+        tasks = [asyncio.ensure_future(self.emit_events(writer, session, conn))]
+        if self.faults.disconnect_every:
+            tasks.append(asyncio.ensure_future(self.cut_after(writer, random.expovariate(1.0 / self.faults.disconnect_every))))
+        try:
+            while True:
+                top = await reader.readexactly(8)
+                _, _, length = unpack('<HHI', top)
+                packet = await reader.readexactly(length)
+                cmd, _, _, reply_id = unpack('<4H', packet[:8])
+                if cmd == const.CMD_ACK_OK:
+                    continue # the client acknowledging a realtime event
+                self.commands[cmd] += 1
+                if cmd != const.CMD_CONNECT and random.random() < self.faults.drop_ratio:
+                    self.faults_hit['drop'] += 1
+                    break
+                if random.random() < self.faults.stall_ratio:
+                    self.faults_hit['stall'] += 1
+                    continue
+                if self.faults.slow and random.random() < self.faults.slow_ratio:
+                    self.faults_hit['slow'] += 1
+                    await asyncio.sleep(self.faults.slow)
+                code, payload = self.reply(cmd, packet[8:], conn)
+                writer.write(frame(code, session, reply_id, payload))
+                await writer.drain()
+                if cmd == const.CMD_EXIT:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def emit_events(self, writer, session, conn):
+        if self.rate <= 0:
+            return
+        while True:
+            await asyncio.sleep(random.expovariate(self.rate))
+            if not conn['live'] or writer.is_closing():
+                continue
+            user = random.choice(self.users)
+            now = datetime.now().replace(microsecond=0)
+            self.logs.append((user.user_id, now))
+            self.log_data = None
+            writer.write(frame(const.CMD_REG_EVENT, session, 0, event_payload(user.user_id, now)))
+            self.events_sent += 1
+
+    async def cut_after(self, writer, seconds):
+        await asyncio.sleep(seconds)
+        self.faults_hit['disconnect'] += 1
+        writer.close()
+
+    def stats(self):
+        return {
+            "connections": self.connections,
+            "events_sent": self.events_sent,
+            "logs": len(self.logs),
+            "commands": sum(self.commands.values()),
+            "faults": dict(self.faults_hit)
+        }
+
+def build_devices(args):
+    faults = Faults(args.slow_ms, args.slow_ratio, args.stall_ratio, args.drop_ratio, args.disconnect_every)
+    users = make_users(args.users)
+    base = ipaddress.ip_address(args.host)
+    devices = []
+    for i in range(args.devices):
+        host, port = (str(base + i), args.port) if args.spread == 'ip' else (args.host, args.port + i)
+        logs = make_punches(users, args.logs, args.days) if args.logs else []
+        devices.append(SimDevice(f"SIM{i + 1:04d}", host, port, users, logs, args.rate, faults))
+    return devices
+
+async def serve_all(devices, ready=None):
+    for device in devices:
+        await asyncio.start_server(device.serve, device.host, device.port)
+    if ready:
+        ready.set()
+    while True:
+        await asyncio.sleep(3600)
+
+def totals(devices):
+    total = Counter()
+    for device in devices:
+        s = device.stats()
+        total['connections'] += s['connections']
+        total['events_sent'] += s['events_sent']
+        total['commands'] += s['commands']
+        total.update(s['faults'])
+    return dict(total)
+
+# --- LOAD TEST: advanced_monitor against the simulated scanners ---
+def load_test(devices, args):
+    from bench_sync import import_monitor
+    from tests.conftest import FakeSupabase, make_employees
+    am = import_monitor()
+    from metrics import InstrumentedClient
+
+    ready = threading.Event()
+    threading.Thread(target=lambda: asyncio.run(serve_all(devices, ready)), name="Thread-Simulator", daemon=True).start()
+    ready.wait()
+
+    db = FakeSupabase(args.latency / 1000.0)
+    db.seed('employees', make_employees(devices[0].users))
+    rows = [{"id": f"dev-{i}", "name": d.name, "ip_address": d.host, "port": d.port, "is_active": True,
+             "xarun_id": "x1", "last_log_at": None} for i, d in enumerate(devices)]
+    db.seed('devices', rows)
+    am.supabase = InstrumentedClient(db)
+    am.open_outbox() # in SMARTSTOCK_STATE_DIR (see __main__)
+    am.employee_cache.refresh(force=True)
+    am.open_day.warm(am.supabase)
+    threading.Thread(target=am.drain_outbox, name="Thread-Outbox", daemon=True).start()
+    for row in rows:
+        threading.Thread(target=am.monitor_single_device, args=(row, ), name=f"Thread-{row['name']}", daemon=True).start()
+
+    started = time.time()
+    while time.time() - started < args.seconds:
+        time.sleep(min(10, args.seconds))
+        sim = totals(devices)
+        print(f"[{time.time() - started:6.0f}s] live={len(am.zk_sessions.connected_ips()):4}/{len(devices)} "
+              f"threads={threading.active_count():4} events_sent={sim['events_sent']:6} "
+              f"outbox={am.outbox.stats()} attendance_rows={len(db.rows('attendance'))} "
+              f"connections={sim['connections']} faults={ {k: v for k, v in sim.items() if k in ('drop', 'stall', 'slow', 'disconnect')} }")
+    print(f"db requests: {db.requests()} ({db.breakdown()})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ZKTeco TCP protocol simulator")
+    parser.add_argument('--devices', type=int, default=1)
+    parser.add_argument('--host', default='127.0.1.1', help="first scanner IP")
+    parser.add_argument('--port', type=int, default=4370)
+    parser.add_argument('--spread', choices=['ip', 'port'], default='ip', help="one IP or one port per scanner")
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--logs', type=int, default=2000, help="punches already in each log buffer")
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--rate', type=float, default=0.2, help="realtime punches per second per scanner")
+    parser.add_argument('--slow-ms', type=float, default=0)
+    parser.add_argument('--slow-ratio', type=float, default=1.0)
+    parser.add_argument('--stall-ratio', type=float, default=0.0)
+    parser.add_argument('--drop-ratio', type=float, default=0.0)
+    parser.add_argument('--disconnect-every', type=float, default=0, help="mean seconds before a connection is cut")
+    parser.add_argument('--load-test', action='store_true', help="run advanced_monitor against the scanners")
+    parser.add_argument('--seconds', type=float, default=60)
+    parser.add_argument('--latency', type=float, default=0, help="ms per fake Supabase request (--load-test)")
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    devices = build_devices(args)
+    first, last = devices[0], devices[-1]
+    print(f"🛰️  {len(devices)} simulated scanners: {first.host}:{first.port} .. {last.host}:{last.port} "
+          f"({args.users} users, {args.logs} logs, {args.rate}/s events each)")
+    if args.load_test:
+        logging.disable(logging.WARNING)
+        # advanced_monitor's log / outbox / employee snapshot go to a throwaway dir, never the real ones
+        with tempfile.TemporaryDirectory(prefix="zksim_", ignore_cleanup_errors=True) as state:
+            os.environ['SMARTSTOCK_STATE_DIR'] = state
+            load_test(devices, args)
+        sys.exit(0)
+    try:
+        asyncio.run(serve_all(devices))
+    except KeyboardInterrupt:
+        print(totals(devices))